@@ -0,0 +1,115 @@
+"""Static analysis of the variables parse trees read.
+
+Scoping is dynamic, so which binding a name refers to is only known when
+it's read. What can be known ahead of time is which names a tree might read
+at all, and that's enough to tell when a binding can never be read again.
+"""
+import parser
+import infixlang
+
+
+class Unanalyzable(Exception):
+  """Raised for trees whose reads can't be found statically."""
+
+
+def free_variables(tree):
+  """Returns the names of the variables tree reads from the context it's
+  evaluated in, sorted, or None if it reads this or has nodes this module
+  doesn't know about.
+
+  Names the tree binds before reading them aren't free. The bodies of ~ links
+  in the tree are included, since they may be evaluated in contexts derived
+  from this one.
+  """
+  free = read_names(tree)
+  if free is None or 'this' in free:
+    return None
+  return tuple(sorted(free))
+
+def read_names(tree):
+  """Like free_variables, but returns a set that includes 'this' if tree
+  reads this."""
+  free = set()
+  try:
+    reads(tree, frozenset(), free)
+  except Unanalyzable:
+    return None
+  return free
+
+def reads(node, bound, free):
+  """Adds the free variables of node to free. Returns the names bound after
+  evaluating node, given those bound before."""
+  if isinstance(node, infixlang.expr_sequence):
+    return reads(node.val[-1], reads(node.val[0], bound, free), free)
+
+  if isinstance(node, (infixlang.expr_assignment, infixlang.expr_link)):
+    reads(node.val[2], bound, free)
+    return bound | frozenset([node.val[0].val])
+
+  if isinstance(node, infixlang.expr_equality):
+    reads(node.val[0], bound, free)
+    reads(node.val[2], bound, free)
+    return bound
+
+  if isinstance(node, infixlang.parenthesized_expr):
+    reads(node.val[1], bound, free)
+    return bound
+
+  if isinstance(node, infixlang.variable):
+    names = [node.val]
+  elif isinstance(node, infixlang.integer):
+    names = []
+  elif isinstance(node, infixlang.op_if):
+    names = ['cond', 'then', 'else']
+  elif isinstance(node, infixlang.builtin):
+    names = node.arguments[node.val]
+  else:
+    raise Unanalyzable(type(node).__name__)
+
+  free.update(name for name in names if name not in bound)
+  return bound
+
+
+def link_bodies(tree):
+  """Yields the bodies of the ~ links in tree."""
+  stack = [tree]
+  while stack:
+    node = stack.pop()
+    if isinstance(node, infixlang.expr_link):
+      yield node.val[2]
+    if not isinstance(node, parser.Terminal):
+      stack.extend(node.val)
+
+
+def live_variables(statements):
+  """Returns, for each statement in a program, the names that the statements
+  after it might read, or None where they might read any name.
+
+  Every variable is read by a variable node somewhere in the program, so a
+  binding the rest of the program has no node for can't be read again, even
+  through a context captured with this. A statement that reads this can
+  print every binding, though, so everything is live before it. A ~ body can
+  be called long after the statement that defined it, from any context, so
+  whatever the bodies defined by the program read is live throughout.
+  """
+  always = set()
+  for tree in statements:
+    for body in link_bodies(tree):
+      names = read_names(body)
+      if names is None:
+        return [None] * len(statements)
+      always.update(names)
+
+  live = []
+  later = frozenset(always)
+  for tree in reversed(statements):
+    live.append(later)
+    names = read_names(tree)
+    if names is None or 'this' in names or later is None:
+      later = None
+    else:
+      later = later.union(names)
+  live.reverse()
+  return [names - THIS if names is not None else None for names in live]
+
+THIS = frozenset(['this'])
@@ -0,0 +1,265 @@
+"""Evaluates one expression over many rows of variable bindings.
+
+  values = batch.evaluate(tree, {'a': [1, 2, 3], 'b': [4, 5, 6]}, context)
+
+returns, for each row i, tree.eval(context + {a: a[i], b: b[i]}).val.
+
+When NumPy is installed, the columns are evaluated as arrays: arithmetic and
+== work on whole columns at once, and if splits the rows by the value of cond
+and evaluates then and else on just the rows that take them. Assignments,
+~ links, sequences and calls to ~ bodies work too.
+
+Anything that can't be evaluated on arrays with exactly the results eval()
+gets (contexts as values, this, integers that overflow 64 bits, division by
+zero, unknown variables) makes the whole batch fall back to evaluating one row
+at a time, so the results and the errors raised are always eval()'s. Without
+NumPy, every batch is evaluated a row at a time, and the results are returned
+as a list.
+"""
+import infixlang
+from infixlang import Context, expr_reference
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+
+def evaluate(tree, columns, context=None):
+  """Returns the value of tree in each row of columns, a dict from variable
+  names to equally long sequences of values. The rows are evaluated in
+  children of context, or of an empty context."""
+  if context is None:
+    context = Context()
+  if numpy is not None:
+    try:
+      return Vectorizer(context).evaluate(tree, columns)
+    except Unsupported:
+      pass
+    values = evaluate_rows(tree, columns, context)
+    array = numpy.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+  return evaluate_rows(tree, columns, context)
+
+def evaluate_rows(tree, columns, context):
+  """Like evaluate, one row at a time. Returns a list."""
+  names = columns.keys()
+  return [tree.eval(Context(parent=context, slots=dict(zip(names, row)))).val
+          for row in zip(*[columns[name] for name in names])]
+
+
+class Unsupported(Exception):
+  """Raised when a batch can't be evaluated on arrays."""
+
+
+# integers past this might not fit in an int64 after one more operation.
+MAX_INT = 2 ** 62
+
+# the value of a variable that only some of the rows bind.
+PARTIAL = object()
+
+
+class Vectorizer(object):
+  """Evaluates trees where variables can hold NumPy arrays with one element
+  per row.
+
+  The bindings are a dict from names to values, in front of the bindings of
+  the context the batch runs in. A value is an integer, a bool, an array of
+  either, or an expr_reference.
+  """
+
+  def __init__(self, context):
+    self.context = context
+
+  def evaluate(self, tree, columns):
+    env = {}
+    num_rows = None
+    for name, column in columns.iteritems():
+      array = numpy.asarray(column)
+      if array.ndim != 1 or array.dtype.kind not in 'bi':
+        raise Unsupported('column %s is not integers' % name)
+      if array.dtype.kind == 'i' and len(array) and (
+          abs(array).max() >= MAX_INT or array.min() < -MAX_INT):
+        raise Unsupported('column %s is too large' % name)
+      if num_rows is not None and len(array) != num_rows:
+        raise ValueError('columns have different lengths')
+      num_rows = len(array)
+      env[name] = array
+
+    try:
+      _, val = self.eval(tree, env)
+    except (infixlang.Error, ArithmeticError, TypeError, RuntimeError):
+      # let eval() raise the error, from the row that causes it.
+      raise Unsupported('evaluation failed')
+    self.check(val)
+    return numpy.resize(numpy.asarray(val), num_rows or 0)
+
+  def check(self, val):
+    if isinstance(val, numpy.ndarray):
+      return val
+    if type(val) in (int, long) and -MAX_INT < val < MAX_INT:
+      return val
+    if type(val) is bool:
+      return val
+    raise Unsupported('%r is not a number' % (val,))
+
+  def lookup(self, env, name):
+    if name == 'this':
+      raise Unsupported('this')
+    v = env[name] if name in env else self.context[name]
+    if v is PARTIAL:
+      raise Unsupported('%s is only bound in some rows' % name)
+    return v
+
+  def eval(self, node, env):
+    """Returns the bindings after evaluating node, and its value."""
+    for cls in type(node).__mro__:
+      method = self.evaluators.get(cls)
+      if method:
+        return method(self, node, env)
+    raise Unsupported(type(node).__name__)
+
+  def eval_integer(self, node, env):
+    return env, node.val
+
+  def eval_variable(self, node, env):
+    return self.eval_name(node.val, env)
+
+  def eval_name(self, name, env):
+    v = self.lookup(env, name)
+    if isinstance(v, expr_reference):
+      return self.eval(v.val, env)
+    return env, self.check(v)
+
+  def eval_parenthesized(self, node, env):
+    return env, self.eval(node.val[1], env)[1]
+
+  def eval_sequence(self, node, env):
+    env, _ = self.eval(node.val[0], env)
+    return self.eval(node.val[-1], env)
+
+  def eval_assignment(self, node, env):
+    _, val = self.eval(node.val[2], env)
+    env = dict(env)
+    env[node.val[0].val] = val
+    return env, None
+
+  def eval_link(self, node, env):
+    rhs_val = expr_reference(node.val[2])
+    env = dict(env)
+    env[node.val[0].val] = rhs_val
+    return env, rhs_val
+
+  def eval_binary_op(self, node, env):
+    lhs = self.check(self.eval(node.val[0], env)[1])
+    rhs = self.check(self.eval(node.val[2], env)[1])
+    op = node.val[1].val
+
+    if not isinstance(lhs, numpy.ndarray) and not isinstance(
+        rhs, numpy.ndarray):
+      # plain integers get the operator eval() uses.
+      return env, self.check(node.operators[op](lhs, rhs))
+
+    if op == '==':
+      return env, numpy.equal(lhs, rhs)
+
+    # eval()'s operators treat bools as the integers 0 and 1.
+    lhs, rhs = as_ints(lhs), as_ints(rhs)
+    if op == '/':
+      if numpy.any(numpy.equal(rhs, 0)):
+        raise Unsupported('division by zero')
+      # python 2 divides integers by flooring, like floor_divide.
+      return env, numpy.floor_divide(lhs, rhs)
+
+    ufunc = {'+': numpy.add, '-': numpy.subtract, '*': numpy.multiply}[op]
+    estimate = ufunc(numpy.asarray(lhs, dtype=float),
+                     numpy.asarray(rhs, dtype=float))
+    if numpy.any(numpy.abs(estimate) >= MAX_INT):
+      raise Unsupported('integer overflow')
+    return env, ufunc(lhs, rhs)
+
+  def eval_if(self, node, env):
+    env, cond = self.eval_name('cond', env)
+    else_bound = 'else' in env or 'else' in self.context
+
+    if not isinstance(cond, numpy.ndarray):
+      if cond:
+        return self.eval_name('then', env)
+      return self.eval_else(env, cond, else_bound)
+
+    # evaluate each branch on the rows that take it, and merge the results.
+    mask = numpy.not_equal(cond, 0)
+    branches = []
+    for rows in (mask, ~mask):
+      if not rows.any():
+        continue
+      sub_env = dict((name, v[rows] if isinstance(v, numpy.ndarray) else v)
+                     for name, v in env.iteritems())
+      if rows is mask:
+        branch_env, val = self.eval_name('then', sub_env)
+      else:
+        branch_env, val = self.eval_else(sub_env, cond[rows], else_bound)
+      branches.append((rows, branch_env, val))
+
+    if len(branches) == 1:
+      # every row took the same branch, so its arrays are already whole.
+      return branches[0][1], branches[0][2]
+
+    (then_rows, then_env, then_val), (_, else_env, else_val) = branches
+    merged_env = {}
+    for name in set(then_env) | set(else_env):
+      if name in then_env and name in else_env:
+        merged_env[name] = merge(then_rows, then_env[name], else_env[name])
+      else:
+        merged_env[name] = PARTIAL
+    val = merge(then_rows, then_val, else_val)
+    if val is PARTIAL:
+      raise Unsupported('the branches of if make different kinds of values')
+    return merged_env, val
+
+  def eval_else(self, env, cond, else_bound):
+    if not else_bound:
+      return env, cond
+    try:
+      return self.eval_name('else', env)
+    except infixlang.UnknownVariableError:
+      # eval() returns the truth context of the rows whose else fails. which
+      # rows those are depends on the path each row took to get here.
+      raise Unsupported('else failed')
+
+  evaluators = {
+      infixlang.integer: eval_integer,
+      infixlang.variable: eval_variable,
+      infixlang.parenthesized_expr: eval_parenthesized,
+      infixlang.expr_sequence: eval_sequence,
+      infixlang.expr_assignment: eval_assignment,
+      infixlang.expr_link: eval_link,
+      infixlang.expr_equality: eval_binary_op,
+      infixlang.op_if: eval_if,
+      }
+
+
+def as_ints(v):
+  if isinstance(v, numpy.ndarray) and v.dtype.kind == 'b':
+    return v.astype(numpy.int64)
+  if type(v) is bool:
+    return int(v)
+  return v
+
+def merge(rows, a, b):
+  """Returns an array with a's elements in rows and b's elsewhere, where a
+  and b each have one element per row they cover, or are the same for every
+  row."""
+  if a is b:
+    return a
+  if isinstance(a, expr_reference) or isinstance(b, expr_reference):
+    return PARTIAL
+  if a is PARTIAL or b is PARTIAL or a is None or b is None:
+    return PARTIAL
+
+  bools = numpy.asarray(a).dtype.kind == numpy.asarray(b).dtype.kind == 'b'
+  out = numpy.empty(len(rows), dtype=bool if bools else numpy.int64)
+  out[rows] = a
+  out[~rows] = b
+  return out
@@ -0,0 +1,506 @@
+#!/usr/bin/env python
+"""Benchmarks for infixlang.
+
+  python bench.py [-o results.json] [-c baseline.json] [workload ...]
+
+runs the workloads below at several sizes, and times tokenizing, parsing and
+evaluating each of them separately. -o saves the results, and -c compares
+them to results saved by an earlier run.
+
+  python bench.py --micro
+
+runs the benchmarks of individual optimizations instead.
+"""
+import argparse
+import gc
+import json
+import sys
+import time
+import types
+
+import parser
+import pmap
+import infixlang
+import batch
+import closure_compiler
+import engines
+import incremental
+import memo
+import precompiled
+import reactive
+import trampoline
+
+def timed(f, *args):
+  start = time.time()
+  f(*args)
+  return time.time() - start
+
+def make_script(num_statements):
+  return '\n'.join('v%d = (a=%d, b=a*2+1, c=(b==3), a+b)' % (i, i)
+                   for i in xrange(num_statements))
+
+def bench_tokenize(sizes=(1000, 2000, 4000, 8000, 16000)):
+  # the time per character should stay flat as the script grows.
+  print 'tokenize'
+  print '%10s %10s %12s' % ('chars', 'seconds', 'us/char')
+  for n in sizes:
+    script = make_script(n)
+    t = timed(infixlang.tokenize, script)
+    print '%10d %10.3f %12.3f' % (len(script), t, 1e6 * t / len(script))
+
+def bench_parse(depths=(1, 2, 3, 15, 30, 60), max_backtrack_depth=3):
+  # compare backtracking parsing with packrat parsing on nested
+  # parenthesized expressions. backtracking is exponential in the depth, so
+  # it's only timed on shallow nestings.
+  print 'parse'
+  print '%10s %12s %12s' % ('depth', 'backtrack', 'packrat')
+  for depth in depths:
+    tokens = infixlang.tokenize('(' * depth + '1' + '+1)' * depth)
+    backtrack = (timed(infixlang.expr_sequence.parse, tokens)
+                 if depth <= max_backtrack_depth else float('nan'))
+    packrat = timed(infixlang.expr_sequence.parse, tokens, {})
+    print '%10d %12.4f %12.4f' % (depth, backtrack, packrat)
+
+def bench_incremental(sizes=(1000, 2000, 4000, 8000)):
+  # replace one character in the middle of a script. a full parse grows
+  # with the script, an incremental one mostly with the edit.
+  print 'incremental parse'
+  print '%10s %10s %10s %10s' % ('statements', 'full', 'edit', 'speedup')
+  for n in sizes:
+    script = make_script(n)
+    source = incremental.Source(script)
+    middle = script.index('a=', len(script) // 2) + 2
+    full_time = timed(incremental.Source, script)
+    edit_time = timed(source.edit, middle, middle + 1, '7')
+    print '%10d %10.3f %10.4f %10.0f' % (n, full_time, edit_time,
+                                         full_time / edit_time)
+
+def parse_statements(tokens):
+  stream = parser.TokenStream(tokens)
+  trees = []
+  while stream:
+    tree, stream = infixlang.expr.parse(stream, {})
+    trees.append(tree)
+  return trees
+
+def bench_parse_statements(sizes=(1000, 2000, 4000, 8000)):
+  # parse a long script statement by statement. the time per token should
+  # stay flat as the script grows.
+  print 'parse statements'
+  print '%10s %10s %12s' % ('tokens', 'seconds', 'us/token')
+  for n in sizes:
+    tokens = infixlang.tokenize(make_script(n))
+    t = timed(parse_statements, tokens)
+    print '%10d %10.3f %12.3f' % (len(tokens), t, 1e6 * t / len(tokens))
+
+def bench_parse_chain(sizes=(2500, 5000, 10000, 20000)):
+  # the precedence climbing backend parses long operator chains in linear
+  # time.
+  print 'parse operator chain (precedence backend)'
+  print '%10s %10s %12s' % ('terms', 'seconds', 'us/term')
+  infixlang.set_parser_backend('precedence')
+  try:
+    for n in sizes:
+      tokens = infixlang.tokenize('+'.join(['1'] * n))
+      t = timed(infixlang.expr_sequence.parse, tokens)
+      print '%10d %10.3f %12.3f' % (n, t, 1e6 * t / n)
+  finally:
+    infixlang.set_parser_backend('descent')
+
+FACTORIAL = """
+  factorial ~ (then ~ i*(i=i-1 factorial) else=1 cond=i if)
+  (i=%d factorial)
+  """
+
+WHILE = """
+  iterate ~ (i=i+1, sum=sum+i, stop=(i==%d), this)
+  while ~ (then=iterator, else~(iterator=(iterator iterate) while), cond=(iterator stop) if)
+  final = (iterator=(i=0 sum=0 iterate) while)
+  (final sum)
+  """
+
+def parse_program(program):
+  tree, rest = infixlang.expr_sequence.parse(infixlang.tokenize(program), {})
+  assert not rest
+  return tree
+
+def bench_eval(repeat=20):
+  # compare the tree walking evaluator with the closure compiler on the
+  # README's recursive and looping programs.
+  sys.setrecursionlimit(20000)
+  print 'eval'
+  print '%20s %10s %10s %8s' % ('program', 'tree', 'closures', 'speedup')
+  for name, program in [('factorial 100', FACTORIAL % 100),
+                        ('while 100', WHILE % 100)]:
+    tree = parse_program(program)
+    assert (closure_compiler.evaluate(tree, infixlang.Context()).val ==
+            tree.eval(infixlang.Context()).val)
+    walk = timed(lambda: [tree.eval(infixlang.Context())
+                          for _ in xrange(repeat)])
+    compiled = timed(lambda: [closure_compiler.evaluate(tree, infixlang.Context())
+                              for _ in xrange(repeat)])
+    print '%20s %10.3f %10.3f %8.1f' % (name, walk, compiled, walk / compiled)
+
+def bench_chain(sizes=(250, 500, 1000, 2000), reads=200):
+  # build a linked list of n entries one statement at a time, without
+  # collapsing the context in between, then time reading the list's head.
+  # reading chains the list's context into the current one, which should
+  # cost the same regardless of how many bindings came before.
+  sys.setrecursionlimit(20000)
+  print 'chain'
+  print '%10s %10s %12s' % ('entries', 'seconds', 'us/read')
+  insert = parse_program('insert ~ (prev=list, this)')
+  add = parse_program('mylist = (list=mylist value=2 insert)')
+  read = parse_program('(mylist value)')
+  for n in sizes:
+    context = parse_program('mylist = (this)').eval(insert.eval(
+        infixlang.Context()))
+    for _ in xrange(n):
+      context = add.eval(context)
+    t = timed(lambda: [read.eval(context) for _ in xrange(reads)])
+    print '%10d %10.3f %12.3f' % (n, t, 1e6 * t / reads)
+
+def bench_trampoline(sizes=(1000, 10000, 100000)):
+  # loops far deeper than the tree walker's stack allows.
+  print 'trampoline'
+  print '%10s %10s %12s' % ('iterations', 'secs', 'usecs/iter')
+  for n in sizes:
+    tree = parse_program(WHILE % n)
+    t = timed(trampoline.evaluate, tree, infixlang.Context())
+    print '%10d %10.3f %12.3f' % (n, t, 1e6 * t / n)
+
+LIST = """
+  insert ~ (prev=list, this)
+  mylist = (this)
+  """
+LIST_APPEND = 'mylist = (list=mylist value=%d insert)'
+
+ARRAY = """
+  set_element ~ (prev=array, this)
+  get_element ~ (then=(array value)
+                 else~(array=(array prev) get_element)
+                 cond=((array slot) == i)
+                 if)
+  myarray = (this)
+  """
+ARRAY_SET = 'myarray = (array=myarray slot=%d value=%d set_element)'
+ARRAY_GET = '(array=myarray i=%d get_element)'
+
+# the same, with the native maps.
+MAP = 'mymap = map_new\n'
+MAP_SET = 'mymap = (map=mymap key=%d value=%d map_put)'
+MAP_GET = '(map=mymap key=%d map_get)'
+
+def reachable_size(obj):
+  """Returns the number of bytes in the objects reachable from obj, not
+  counting classes, functions and modules."""
+  seen = set()
+  stack = [obj]
+  size = 0
+  while stack:
+    obj = stack.pop()
+    if id(obj) in seen or isinstance(
+        obj, (type, types.ClassType, types.FunctionType, types.ModuleType)):
+      continue
+    seen.add(id(obj))
+    size += sys.getsizeof(obj)
+    stack.extend(gc.get_referents(obj))
+  return size
+
+def memory_used(f, *args):
+  """Calls f and returns its result and the memory it used.
+
+  That's the peak traced by tracemalloc where it's available. Elsewhere it's
+  the size of what the result holds on to.
+  """
+  try:
+    import tracemalloc
+  except ImportError:
+    result = f(*args)
+    return result, reachable_size(result)
+
+  tracemalloc.start()
+  try:
+    result = f(*args)
+    return result, tracemalloc.get_traced_memory()[1]
+  finally:
+    tracemalloc.stop()
+
+def object_size(obj):
+  size = sys.getsizeof(obj)
+  if hasattr(obj, '__dict__'):
+    size += sys.getsizeof(obj.__dict__)
+  return size
+
+def bench_memory(sizes=(100, 200, 400)):
+  # the memory taken by the README's linked list and associative array
+  # examples.
+  sys.setrecursionlimit(20000)
+  print 'memory'
+  context = infixlang.Context(slots={'a': 1})
+  for name, obj in [('Context', context),
+                    ('ValueContext', infixlang.ValueContext(context, 1)),
+                    ('token', infixlang.tokenize('a')[0])]:
+    print '%20s %10d bytes' % (name, object_size(obj))
+
+  print '%20s %10s %12s' % ('program', 'bytes', 'bytes/entry')
+  for n in sizes:
+    program = LIST + '\n'.join(LIST_APPEND % i for i in xrange(n))
+    tree = parse_program(program)
+    _, size = memory_used(tree.eval, infixlang.Context())
+    print '%20s %10d %12d' % ('list %d' % n, size, size / n)
+
+    program = (ARRAY + '\n'.join(ARRAY_SET % (i, i) for i in xrange(n)) +
+               '\n' + ARRAY_GET % 0)
+    tree = parse_program(program)
+    _, size = memory_used(tree.eval, infixlang.Context())
+    print '%20s %10d %12d' % ('array %d' % n, size, size / n)
+
+    tree = parse_program(map_program(n))
+    _, size = memory_used(tree.eval, infixlang.Context())
+    print '%20s %10d %12d' % ('map %d' % n, size, size / n)
+
+def bench_maps(sizes=(100, 200, 400, 800), big=100000, reads=100):
+  # look up the first element set in the README's associative array, which
+  # walks the whole chain of contexts, and in a native map.
+  sys.setrecursionlimit(20000)
+  print 'maps'
+  print '%10s %14s %14s' % ('entries', 'array usecs', 'map usecs')
+  array_get = parse_program(ARRAY_GET % 0)
+  map_get = parse_program(MAP_GET % 0)
+  for n in sizes + (big,):
+    # the same map map_put would build, without running n statements.
+    map_context = infixlang.Context(slots={
+        'mymap': pmap.EMPTY.update(dict((i, i) for i in xrange(n)))})
+    t = timed(lambda: [map_get.eval(map_context) for _ in xrange(reads)])
+    map_usecs = '%14.3f' % (1e6 * t / reads)
+
+    array_usecs = '%14s' % '-'
+    if n != big:
+      array_context = parse_program(
+          ARRAY + '\n'.join(ARRAY_SET % (i, i) for i in xrange(n))).eval(
+              infixlang.Context()).collapse()
+      t = timed(lambda: [array_get.eval(array_context) for _ in xrange(reads)])
+      array_usecs = '%14.3f' % (1e6 * t / reads)
+    print '%10d %s %s' % (n, array_usecs, map_usecs)
+
+FIB = """
+  fib ~ (then=n else~((n=n-1 fib) + (n=n-2 fib)) cond=((n==0) + (n==1)) if)
+  (n=%d fib)
+  """
+
+def bench_memo(sizes=(10, 14, 18, 22)):
+  # a naive fibonacci makes exponentially many calls, and memoized, one per
+  # n.
+  print 'memo'
+  print '%10s %10s %10s %10s' % ('n', 'eval', 'memoized', 'speedup')
+  for n in sizes:
+    tree = parse_program(FIB % n)
+    plain = timed(tree.eval, infixlang.Context())
+    memoized = timed(memo.evaluate, tree, infixlang.Context())
+    print '%10d %10.4f %10.4f %10.0f' % (n, plain, memoized, plain / memoized)
+
+def bench_reactive(sizes=(100, 200, 400, 800)):
+  # a session of n definitions that each read one base variable. rebinding
+  # one base variable reruns the whole session by hand, or recomputes its
+  # one dependent in a reactive sheet.
+  print 'reactive'
+  print '%10s %10s %10s %10s' % ('statements', 'rerun', 'edit', 'speedup')
+  for n in sizes:
+    statements = ['base%d = %d' % (i, i) for i in xrange(n)] + [
+        'derived%d = base%d * 2' % (i, i) for i in xrange(n)]
+    trees = [parse_program(statement) for statement in statements]
+    sheet = reactive.Sheet()
+    for tree in trees:
+      sheet.enter(tree)
+    edit = parse_program('base0 = 1000')
+
+    def rerun():
+      context = edit.eval(infixlang.Context())
+      for tree in trees[1:]:
+        context = tree.eval(context)
+    rerun_time = timed(rerun)
+    edit_time = timed(sheet.enter, edit)
+    print '%10d %10.4f %10.4f %10.0f' % (2 * n, rerun_time, edit_time,
+                                         rerun_time / edit_time)
+
+def bench_prelude(sizes=(100, 200, 400, 800)):
+  # start up from a prelude of n copies of the README's array functions,
+  # from source and precompiled.
+  print 'prelude'
+  print '%10s %10s %12s %12s %10s' % ('functions', 'bytes', 'from source',
+                                      'precompiled', 'speedup')
+  for n in sizes:
+    source = '\n'.join(ARRAY.replace('_element', '_element%d' % i)
+                       for i in xrange(n // 2))
+    data = precompiled.dumps(precompiled.parse_statements(source))
+    from_source = timed(lambda: precompiled.run_statements(
+        precompiled.parse_statements(source)))
+    loaded = timed(lambda: precompiled.run_statements(
+        precompiled.loads(data)))
+    print '%10d %10d %12.3f %12.3f %10.1f' % (
+        n, len(data), from_source, loaded, from_source / loaded)
+
+def bench_batch(sizes=(1000, 10000, 100000)):
+  # evaluate func ~ a+b over n rows of bindings, one row at a time and as
+  # numpy arrays.
+  print 'batch'
+  if batch.numpy is None:
+    print 'numpy is not installed'
+    return
+  print '%10s %10s %12s %10s' % ('rows', 'per row', 'vectorized', 'speedup')
+  context = parse_program('func ~ a+b').eval(infixlang.Context())
+  tree = parse_program('func')
+  for n in sizes:
+    columns = {'a': range(n), 'b': range(n)}
+    rows = timed(batch.evaluate_rows, tree, columns, context)
+    vectorized = timed(batch.evaluate, tree, columns, context)
+    print '%10d %10.3f %12.4f %10.0f' % (n, rows, vectorized,
+                                         rows / vectorized)
+
+# ----- Workloads.
+#
+# each workload maps a size n to a program. the programs are the README's
+# examples, scaled up.
+
+def chain_program(n):
+  return ' + '.join('%d*%d' % (i, i + 1) for i in xrange(n))
+
+def nesting_program(n):
+  return '(' * n + '1' + '+1)' * n
+
+def list_program(n):
+  return (LIST + '\n'.join(LIST_APPEND % i for i in xrange(n)) +
+          '\n(mylist value)')
+
+def array_program(n):
+  # look up the first element set, which walks the whole array.
+  return (ARRAY + '\n'.join(ARRAY_SET % (i, i) for i in xrange(n)) +
+          '\n' + ARRAY_GET % 0)
+
+def map_program(n):
+  return (MAP + '\n'.join(MAP_SET % (i, i) for i in xrange(n)) +
+          '\n' + MAP_GET % 0)
+
+WORKLOADS = [
+    ('chain', chain_program, (100, 200, 400)),
+    ('nesting', nesting_program, (15, 30, 60)),
+    ('factorial', lambda n: FACTORIAL % n, (20, 40, 80)),
+    ('while', lambda n: WHILE % n, (50, 100, 200)),
+    ('list', list_program, (100, 200, 400)),
+    ('array', array_program, (50, 100, 200)),
+    ('map', map_program, (50, 100, 200)),
+    ]
+
+def best_of(repeat, f, *args):
+  """Calls f repeat times. Returns its last result and its fastest time."""
+  times = []
+  for _ in xrange(repeat):
+    start = time.time()
+    result = f(*args)
+    times.append(time.time() - start)
+  return result, min(times)
+
+def run_workload(make_program, n, evaluate, repeat):
+  program = make_program(n)
+  tokens, tokenize_secs = best_of(repeat, infixlang.tokenize, program)
+  (tree, rest), parse_secs = best_of(
+      repeat, lambda: infixlang.expr_sequence.parse(tokens, {}))
+  assert not rest
+  _, eval_secs = best_of(
+      repeat, lambda: evaluate(tree, infixlang.Context()))
+  _, memory = memory_used(evaluate, tree, infixlang.Context())
+  return {
+      'tokens': len(tokens),
+      'tokenize': tokenize_secs,
+      'parse': parse_secs,
+      'eval': eval_secs,
+      'memory': memory,
+      }
+
+STAGES = ('tokenize', 'parse', 'eval')
+
+def run_workloads(names=None, evaluator='tree', repeat=3):
+  """Runs the named workloads, or all of them. Returns a list of results,
+  one per workload and size."""
+  sys.setrecursionlimit(50000)
+  results = []
+  for name, make_program, sizes in WORKLOADS:
+    if names and name not in names:
+      continue
+    for n in sizes:
+      result = run_workload(make_program, n, engines.ENGINES[evaluator],
+                            repeat)
+      result.update(workload=name, n=n, evaluator=evaluator)
+      results.append(result)
+  return results
+
+def print_results(results, baseline=()):
+  # with a baseline, each number is followed by its ratio to the baseline's.
+  # a ratio below 1 is an improvement.
+  baseline = dict(((r['workload'], r['n'], r['evaluator']), r)
+                  for r in baseline)
+  width = 18 if baseline else 12
+  print '%-10s %6s %7s' % ('workload', 'n', 'tokens'), ' '.join(
+      '%*s' % (width, column) for column in STAGES + ('memory',))
+  for result in results:
+    old = baseline.get((result['workload'], result['n'], result['evaluator']))
+    columns = ['%-10s %6d %7d' % (result['workload'], result['n'],
+                                  result['tokens'])]
+    for stage in STAGES:
+      columns.append(compared('%.2fms', 1e3 * result[stage],
+                              old and 1e3 * old[stage]))
+    columns.append(compared('%dB', result['memory'], old and old['memory']))
+    print columns[0], ' '.join('%*s' % (width, c) for c in columns[1:])
+
+def compared(fmt, value, old):
+  if not old:
+    return fmt % value
+  return (fmt + ' x%.2f') % (value, float(value) / old)
+
+def main(argv):
+  flags = argparse.ArgumentParser(description='Benchmarks for infixlang.')
+  flags.add_argument('workloads', nargs='*',
+                     help='the workloads to run: %s. defaults to all of them.'
+                     % ', '.join(name for name, _, _ in WORKLOADS))
+  flags.add_argument('-e', '--evaluator', default='tree',
+                     choices=sorted(engines.ENGINES))
+  flags.add_argument('-r', '--repeat', type=int, default=3,
+                     help='report the fastest of this many runs.')
+  flags.add_argument('-o', '--output', help='save the results to this file.')
+  flags.add_argument('-c', '--compare',
+                     help='compare with the results saved in this file.')
+  flags.add_argument('--micro', action='store_true',
+                     help='run the benchmarks of individual optimizations.')
+  args = flags.parse_args(argv)
+
+  if args.micro:
+    bench_tokenize()
+    bench_parse()
+    bench_parse_statements()
+    bench_parse_chain()
+    bench_incremental()
+    bench_eval()
+    bench_chain()
+    bench_trampoline()
+    bench_memory()
+    bench_maps()
+    bench_memo()
+    bench_reactive()
+    bench_prelude()
+    bench_batch()
+    return
+
+  results = run_workloads(args.workloads, args.evaluator, args.repeat)
+  baseline = ()
+  if args.compare:
+    with open(args.compare) as f:
+      baseline = json.load(f)
+  print_results(results, baseline)
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(results, f, indent=1, sort_keys=True)
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,184 @@
+"""Compiles parse trees into nested Python closures.
+
+Calling a compiled tree on a context returns the same Context as calling
+eval() on the tree. The closures skip the per-node eval dispatch, and keep
+intermediate results that are only needed for their value (the operands of
+arithmetic, the rhs of assignments, the insides of parentheses) as plain
+Python values instead of wrapping each of them in a Context.
+
+Each node is compiled once. The body of a ~ link is compiled the first time
+it's evaluated, and the closure is cached on the body's parse tree, so every
+later evaluation of that body reuses it.
+"""
+import pmap
+import infixlang
+from infixlang import Context, ValueContext, expr_reference, UnknownVariableError
+from infixlang import captured
+
+
+def evaluate(tree, context):
+  return compile_context(tree)(context)
+
+
+def compile_context(node):
+  """Returns a function that maps a context to node.eval(context)."""
+  closure = getattr(node, 'closure', None)
+  if closure is None:
+    closure = node.closure = lookup(context_compilers, node)(node)
+  return closure
+
+
+def compile_value(node):
+  """Returns a function that maps a context to node.eval(context).val."""
+  return lookup(value_compilers, node)(node)
+
+
+def lookup(compilers, node):
+  for cls in type(node).__mro__:
+    if cls in compilers:
+      return compilers[cls]
+  return compilers[None]
+
+
+def call_reference(reference, context):
+  return compile_context(reference.val)(context)
+
+
+def lookup_variable(context, varname):
+  # the same as context[varname], without the method call.
+  if varname == 'this':
+    return context
+
+  leaf = pmap.find(context.bindings.root, hash(varname), varname)
+  if leaf is None:
+    raise UnknownVariableError(context, varname)
+  return leaf.value
+
+
+# ----- Compilers that produce a Context.
+
+def context_fallback(node):
+  # nodes the compiler doesn't know about are evaluated by the tree walker.
+  return node.eval
+
+def context_sequence(node):
+  first = compile_context(node.val[0])
+  rest = compile_context(node.val[-1])
+  def sequence(context):
+    c0 = first(context)
+    if isinstance(c0.val, Context):
+      c0 = c0.chain(c0.val)
+    return rest(c0)
+  return sequence
+
+def context_assignment(node):
+  varname = node.val[0].val
+  rhs = compile_value(node.val[2])
+  def assignment(context):
+    return Context(parent=context, val=None,
+                   slots={varname: captured(rhs(context))})
+  return assignment
+
+def context_link(node):
+  varname = node.val[0].val
+  body = node.val[2]
+  def link(context):
+    rhs_val = expr_reference(body)
+    return Context(parent=context, val=rhs_val, slots={varname: rhs_val})
+  return link
+
+def context_of_value(node):
+  value = compile_value(node)
+  def wrap(context):
+    return ValueContext(context, value(context))
+  return wrap
+
+def context_variable(node):
+  varname = node.val
+  def variable(context):
+    v = lookup_variable(context, varname)
+    if isinstance(v, expr_reference):
+      return call_reference(v, context)
+    return ValueContext(context, v)
+  return variable
+
+def context_if(node):
+  cond = context_variable(infixlang.variable('cond'))
+  then = context_variable(infixlang.variable('then'))
+  else_ = context_variable(infixlang.variable('else'))
+  def if_(context):
+    truth_context = cond(context)
+    if truth_context.val:
+      return then(truth_context)
+    else:
+      try:
+        return else_(truth_context)
+      except UnknownVariableError:
+        return truth_context
+  return if_
+
+def context_builtin(node):
+  apply = node.apply
+  def builtin(context):
+    return ValueContext(context, apply(context))
+  return builtin
+
+context_compilers = {
+    None: context_fallback,
+    infixlang.expr_sequence: context_sequence,
+    infixlang.expr_assignment: context_assignment,
+    infixlang.expr_link: context_link,
+    infixlang.expr_equality: context_of_value,
+    infixlang.parenthesized_expr: context_of_value,
+    infixlang.Value: context_of_value,
+    infixlang.variable: context_variable,
+    infixlang.op_if: context_if,
+    infixlang.builtin: context_builtin,
+    }
+
+
+# ----- Compilers that produce a plain value.
+
+def value_fallback(node):
+  context_closure = compile_context(node)
+  def value(context):
+    return context_closure(context).val
+  return value
+
+def value_binary_op(node):
+  op = node.operators[node.val[1].val]
+  lhs = compile_value(node.val[0])
+  rhs = compile_value(node.val[2])
+  def binary_op(context):
+    return op(lhs(context), rhs(context))
+  return binary_op
+
+def value_parenthesized(node):
+  return compile_value(node.val[1])
+
+def value_constant(node):
+  val = node.val
+  def constant(context):
+    return val
+  return constant
+
+def value_variable(node):
+  varname = node.val
+  def variable(context):
+    v = lookup_variable(context, varname)
+    if isinstance(v, expr_reference):
+      return call_reference(v, context).val
+    return v
+  return variable
+
+def value_builtin(node):
+  return node.apply
+
+value_compilers = {
+    None: value_fallback,
+    infixlang.expr_equality: value_binary_op,
+    infixlang.parenthesized_expr: value_parenthesized,
+    infixlang.Value: value_constant,
+    infixlang.variable: value_variable,
+    infixlang.builtin: value_builtin,
+    }
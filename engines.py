@@ -0,0 +1,27 @@
+"""The ways to evaluate a parse tree.
+
+Every engine maps a tree and a context to the same Context that
+tree.eval(context) returns:
+
+  tree        eval() on the parse tree.
+  closures    the tree compiled to Python closures (closure_compiler).
+  trampoline  the tree walked with an explicit stack (trampoline).
+  vm          the tree compiled to bytecode (vm).
+  memo        eval() with the bodies of ~ links memoized (memo).
+"""
+import closure_compiler
+import memo
+import trampoline
+import vm
+
+ENGINES = {
+    'tree': lambda tree, context: tree.eval(context),
+    'closures': closure_compiler.evaluate,
+    'trampoline': trampoline.evaluate,
+    'vm': vm.evaluate,
+    'memo': memo.evaluate,
+    }
+
+def evaluate(tree, context, engine='tree'):
+  """Evaluates tree in context with the named engine."""
+  return ENGINES[engine](tree, context)
@@ -0,0 +1,260 @@
+"""Incremental tokenizing and parsing of source text that's being edited.
+
+A Source holds a text, its tokens and its parse tree, the same ones
+expr_sequence.parse() makes of the whole text. Editing it only relexes and
+reparses around the edit:
+
+  source = incremental.Source('a = 1\\nb = a + 1\\n')
+  source.edit(4, 5, '10')        # replaces text[4:5] with '10'.
+  source.tree, source.tokens, source.rest
+
+Lexing only looks forward from the start of a token, so relexing starts at
+the token the edit touches, and stops as soon as it reaches the start of a
+token after the edit: everything from there on lexes the same as before, and
+those tokens are kept, with their offsets shifted.
+
+A parse is a sequence of top-level statements. The parse of a statement
+depends on the tokens from its first one to the furthest one the parser
+looked at, which can be past its end. The statements whose tokens the edit
+changed are reparsed, and so are the statements after them until one ends
+where an old statement started, past the edit. From there on, the old
+statements are kept.
+
+Relexing and reparsing cost time proportional to the size of the edit and of
+the statements it touches. What's left is shifting the offsets of the
+tokens after the edit and rebuilding the spine of expr_sequence nodes that
+holds the statements, both linear but much cheaper. Tokens and trees are
+shared with the parses before the edit, so those are only valid until the
+next edit.
+"""
+import parser
+import infixlang
+from infixlang import comma, expr, expr_sequence
+
+
+class Statement(object):
+  """A top-level statement of a Source.
+
+  first is the index of its first token, count the number of tokens it spans,
+  including the comma after it, if any, and reach the number of tokens its
+  parse looked at, counting from first. spine is the expr_sequence node that
+  holds this statement and the ones after it.
+  """
+  __slots__ = ('tree', 'comma', 'first', 'count', 'reach', 'spine')
+
+  def __init__(self, tree, comma, first, count, reach):
+    self.tree = tree
+    self.comma = comma
+    self.first = first
+    self.count = count
+    self.reach = reach
+    self.spine = None
+
+  @property
+  def start(self):
+    return self.tree_tokens()[0].start
+
+  @property
+  def end(self):
+    return self.tree_tokens()[-1].end
+
+  def tree_tokens(self):
+    """Returns the tokens of the statement's tree, in order."""
+    tokens = []
+    stack = [self.tree]
+    while stack:
+      node = stack.pop()
+      if isinstance(node, parser.Terminal):
+        tokens.append(node)
+      else:
+        stack.extend(reversed(node.val))
+    return tokens
+
+
+class WatchedTokens(list):
+  """A list of tokens that remembers the furthest index that was read."""
+
+  def __init__(self, tokens):
+    list.__init__(self, tokens)
+    self.furthest = -1
+
+  def __getitem__(self, i):
+    if type(i) is int and i > self.furthest:
+      self.furthest = i
+    return list.__getitem__(self, i)
+
+
+def first_at_or_after(items, pos, key):
+  """Returns the index of the first of items, sorted by key, whose key is at
+  least pos."""
+  lo, hi = 0, len(items)
+  while lo < hi:
+    mid = (lo + hi) // 2
+    if key(items[mid]) < pos:
+      lo = mid + 1
+    else:
+      hi = mid
+  return lo
+
+
+class Source(object):
+  """The text, tokens, statements and parse tree of a source text.
+
+  rest holds the tokens after the last statement that parsed, like the
+  unconsumed tokens expr_sequence.parse() returns. The text must tokenize,
+  and its first statement must parse.
+  """
+
+  def __init__(self, text=''):
+    self.text = text
+    self.tokens = WatchedTokens(infixlang.tokenize(text))
+    self.statements = []
+    self.tree = None
+    # the most tokens past its end that a statement's parse looked at.
+    self.lookahead = 0
+    self.lexed = len(self.tokens)
+    self.parsed = 0
+    self.reparse(0, 0, [], 0)
+
+  @property
+  def rest(self):
+    if not self.statements:
+      return list(self.tokens)
+    last = self.statements[-1]
+    return self.tokens[last.first + last.count:]
+
+  def edit(self, start, end, replacement):
+    """Replaces text[start:end] with replacement, and updates the tokens and
+    the tree. Raises ParseError, and leaves everything as it was, if the new
+    text doesn't tokenize or its first statement doesn't parse."""
+    text = self.text[:start] + replacement + self.text[end:]
+    delta = len(replacement) - (end - start)
+    old = self.tokens
+
+    # relex from the first token that touches the edit, or from the edit if
+    # it's between tokens.
+    i = first_at_or_after(old, start, lambda token: token.end)
+    pos = start if i == len(old) else min(start, old[i].start)
+    new_end = start + len(replacement)
+    lexed = []
+    k = first_at_or_after(old, end, lambda token: token.start)
+    for token in parser.iter_tokens(text, infixlang.TOKENS, pos):
+      if token.start >= new_end:
+        # lexing from an old token's start gives the old tokens again.
+        while k < len(old) and old[k].start + delta < token.start:
+          k += 1
+        if k < len(old) and old[k].start + delta == token.start:
+          break
+      lexed.append(token)
+    else:
+      k = len(old)
+
+    tokens = WatchedTokens(old[:i] + lexed + old[k:])
+    if delta:
+      for token in old[k:]:
+        token.start += delta
+        token.end += delta
+
+    saved = (self.text, self.tokens, self.statements, self.tree)
+    self.text, self.tokens = text, tokens
+    self.lexed = len(lexed)
+    try:
+      self.reparse(i, k, lexed, len(old))
+    except parser.ParseError:
+      for token in old[k:]:
+        token.start -= delta
+        token.end -= delta
+      self.text, self.tokens, self.statements, self.tree = saved
+      raise
+
+  def reparse(self, i, k, lexed, old_length):
+    """Reparses the statements whose parses depended on old tokens i to k,
+    which were replaced by lexed, and the ones after them until the parse
+    lines up with the old statements again."""
+    statements = self.statements
+    shift = len(lexed) - (k - i)
+
+    # the first statement whose parse looked at a replaced token. only the
+    # statements that end within a lookahead of the edit can have.
+    first = first_at_or_after(statements, i + 1, lambda s: s.first)
+    j = first - 1
+    while j >= 0 and (statements[j].first + statements[j].count +
+                      self.lookahead >= i):
+      if self.depends(statements[j], i, max(k, i + 1), old_length):
+        first = j
+      j -= 1
+    if statements and self.depends(statements[-1], i, max(k, i + 1),
+                                   old_length):
+      first = min(first, len(statements) - 1)
+    kept = statements[:first]
+    if first < len(statements):
+      pos = statements[first].first
+    else:
+      pos = kept[-1].first + kept[-1].count if kept else 0
+
+    tokens = self.tokens
+    new = []
+    tail = []
+    while pos < len(tokens):
+      if pos >= i + len(lexed):
+        # an old statement that starts here parses as it did before, and so
+        # do the ones after it.
+        n = first_at_or_after(statements, pos - shift, lambda s: s.first)
+        if n < len(statements) and statements[n].first == pos - shift:
+          tail = statements[n:]
+          break
+
+      tokens.furthest = pos
+      try:
+        # a memo per statement, so each one's furthest token is its own.
+        tree, stream = expr.parse(parser.TokenStream(tokens, pos), {})
+      except parser.ParseError:
+        if not kept and not new:
+          raise
+        break
+      separator = None
+      if stream and isinstance(stream[0], comma):
+        separator = stream[0]
+        stream = stream[1:]
+      statement = Statement(tree, separator, pos, stream.pos - pos,
+                            max(tokens.furthest + 1, stream.pos) - pos)
+      self.lookahead = max(self.lookahead, statement.reach - statement.count)
+      new.append(statement)
+      pos = stream.pos
+
+    if not tail and (new or kept):
+      last = new[-1] if new else kept[-1]
+      # like expr_sequence, leave a comma that isn't followed by a statement
+      # in the rest. whether one follows depends on every token after it.
+      if last.comma is not None:
+        last.comma = None
+        last.count -= 1
+        last.spine = None
+      last.reach = len(tokens) - last.first
+
+    for s in tail:
+      s.first += shift
+    self.statements = kept + new + tail
+    self.parsed = len(new)
+    self.rebuild_spine(len(kept) + len(new))
+
+  def depends(self, statement, i, k, length):
+    """Returns whether the parse of statement looked at any of tokens i to k
+    of a list of length tokens."""
+    end = statement.first + statement.reach
+    # a parse that reached the last token may have looked for more.
+    return statement.first < k and (i < end or end >= length)
+
+  def rebuild_spine(self, n):
+    """Rebuilds the expr_sequence nodes that hold the first n statements."""
+    statements = self.statements
+    spine = statements[n].spine if n < len(statements) else None
+    for s in reversed(statements[:n]):
+      if spine is None:
+        s.spine = s.tree
+      elif s.comma is not None:
+        s.spine = expr_sequence([s.tree, s.comma, spine])
+      else:
+        s.spine = expr_sequence([s.tree, spine])
+      spine = s.spine
+    self.tree = statements[0].spine if statements else None
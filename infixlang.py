@@ -1,4 +1,8 @@
+import contextlib
+
 import parser
+import pmap
+import pvector
 
 # Some design notes:
 #
@@ -27,42 +31,129 @@ class UnknownVariableError(Error):
     return 'Unknown variable %s.\nStacktrace:\n%s' % (
         self.varname, self.context.stacktrace())
 
+class BuiltinError(Error):
+  """Raised when a builtin gets arguments it can't work with."""
+
+  def __init__(self, context, message):
+    self.context = context
+    self.message = message
+
+  def __repr__(self):
+    return '%s\nStacktrace:\n%s' % (self.message, self.context.stacktrace())
+
+class LimitError(Error):
+  """Raised when an evaluation takes more steps or memory than it's allowed.
+  See trampoline.Evaluation."""
+
+  def __init__(self, context, message):
+    self.context = context
+    self.message = message
+
+  def __repr__(self):
+    return '%s\nStacktrace:\n%s' % (self.message, self.context.stacktrace())
+
 class Context(object):
-  def __init__(self, parent=None, val=None, slots={}):
+  # programs make millions of short lived contexts, so contexts and parse tree
+  # nodes don't carry a __dict__.
+  __slots__ = ('parent', 'val', 'slots', 'bindings')
+
+  def __init__(self, parent=None, val=None, slots=pmap.EMPTY, bindings=None):
     self.parent = parent
     self.val = val
     self.slots = slots
 
+    # bindings is a persistent map of every variable visible from this
+    # context, including the ones inherited from its parents. It shares its
+    # structure with its parent's bindings, so making a context costs
+    # O(log n) per slot, and looking up a variable costs O(log n) regardless
+    # of how deep the chain of parents is.
+    if bindings is None:
+      bindings = parent.bindings if parent else pmap.EMPTY
+      if slots:
+        bindings = bindings.update(slots)
+    self.bindings = bindings
+
+  def chain(self, inner):
+    """Returns a child of this context where the bindings of the context inner
+    take precedence over this context's.
+    """
+    return Context(parent=self, val=inner, slots=inner.bindings,
+                   bindings=self.bindings.merge(inner.bindings))
+
+  def collapse(self, names=None):
+    """Returns a context with the same value and bindings but no parent.
+
+    If names is given, only the bindings of those names are kept. See
+    analysis.live_variables.
+    """
+    bindings = self.bindings
+    if names is not None:
+      bindings = pmap.EMPTY.update(dict(
+          (name, bindings[name]) for name in names if name in bindings))
+    return Context(val=self.val, slots=bindings, bindings=bindings)
+
   def dictify(self):
-    slots = self.parent.dictify() if self.parent else {}
-    slots.update(self.slots)
-    return slots
+    return self.bindings.todict()
 
   def __getitem__(self, name):
     if name == 'this':
       return self
 
-    try:
-      return self.slots[name]
-    except KeyError:
-      if self.parent:
-        return self.parent[name]
+    leaf = pmap.find(self.bindings.root, hash(name), name)
+    if leaf is None:
       raise UnknownVariableError(self, name)
+    return leaf.value
 
   def __contains__(self, name):
-    return name in self.slots or (
-        name in self.parent if self.parent else False)
+    return name in self.bindings
 
   def stacktrace(self, current_depth=0, max_depth=-1):
-    return '%d: ' % current_depth + str(self) + (
-        '\n' + self.parent.stacktrace(current_depth+1, max_depth-1)
-        if self.parent or not max_depth else '')
+    # walk the parents in a loop, so deep chains don't overflow the stack.
+    frames = []
+    context = self
+    while context:
+      frames.append('%d: ' % current_depth + str(context))
+      if not max_depth:
+        break
+      context = context.parent
+      current_depth += 1
+      max_depth -= 1
+    return '\n'.join(frames)
 
   def __str__(self):
     return 'Context(%s){%s}' %( 
         self.val,
         ', '.join('%s:%s' % item for item in self.slots.iteritems()))
 
+def captured(val):
+  """Returns what a variable assigned val gets bound to.
+
+  A context stored in a variable (a struct, an iterator, the value of this)
+  is only ever used for its value and bindings. Its parents only show up in
+  stacktraces, and they hold on to every context that was made on the way to
+  it, so the variable gets a copy without a parent instead. Unlike
+  collapse(), the copy keeps the context's own slots, which are what it
+  prints as.
+  """
+  if isinstance(val, Context):
+    return Context(val=val.val, slots=val.slots, bindings=val.bindings)
+  return val
+
+class ValueContext(Context):
+  """A context that holds a value and binds no variables of its own.
+
+  Arithmetic, constants and variable reads make one of these per result.
+  They share their parent's bindings and skip the work of merging slots into
+  them.
+  """
+  __slots__ = ()
+
+  def __init__(self, parent=None, val=None):
+    self.parent = parent
+    self.val = val
+    self.slots = pmap.EMPTY
+    self.bindings = parent.bindings if parent else pmap.EMPTY
+
 
 # ----- Objects in the parse tree.
 
@@ -70,6 +161,24 @@ class expr(parser.Rule):
   def eval(self, context):
     raise NotImplementedError
 
+  def optimize(self):
+    """Returns a tree that evaluates to the same thing as this one in every
+    context, with constant arithmetic folded. Trees are shared, so this
+    returns new nodes instead of modifying old ones."""
+    return self
+
+  def optimize_value(self):
+    """Like optimize, for a tree whose evaluation is only used for its
+    value."""
+    return self.optimize()
+
+  def rebuilt(self, children):
+    # a copy of this node with new children, or the node itself if the
+    # children didn't change.
+    if all(new is old for new, old in zip(children, self.val)):
+      return self
+    return type(self)(children)
+
   def eval_lhs(self, context):
     return self.eval(context)
 
@@ -78,20 +187,55 @@ class expr(parser.Rule):
 
 class expr_reference(expr):
   def __repr__(self):
-    return "@" + str(self.val)
+    # a ~ body prints as it was written, not as it was optimized.
+    return "@" + str(getattr(self.val, 'source', self.val))
+
+def call(reference, context, varname):
+  """Evaluates the body of a ~ link where the variable varname, which is bound
+  to it, is read. memo and profiler hook this to memoize and to profile the
+  bodies (see hooked)."""
+  return reference.val.eval(context)
+
+@contextlib.contextmanager
+def hooked(owner, name, hook):
+  """Replaces owner.name, like this module's call or one of Context's
+  methods, with hook for the duration of a with block.
+
+  hook is called with what it replaced, and then the arguments of the call,
+  so hooks nest without holding on to each other. The replaced function is
+  put back however the block exits.
+  """
+  inner = vars(owner)[name]
+  def hooked_function(*args, **kwargs):
+    return hook(inner, *args, **kwargs)
+  setattr(owner, name, hooked_function)
+  try:
+    yield
+  finally:
+    setattr(owner, name, inner)
 
 class expr_sequence(expr):
   def eval(self, context):
     c0 = self.val[0].eval(context)
     return self.val[-1].eval(
-        Context(parent=c0, val=c0.val, slots=c0.val.dictify())
-        if isinstance(c0.val, Context) else c0)
+        c0.chain(c0.val) if isinstance(c0.val, Context) else c0)
+
+  def optimize(self):
+    first, last = self.val[0].optimize(), self.val[-1].optimize()
+    # a constant followed by a constant is the second constant.
+    if isinstance(first, integer) and isinstance(last, integer):
+      return last
+    return self.rebuilt([first] + self.val[1:-1] + [last])
 
 class expr_assignment(expr):
   def eval(self, context):
     varname = self.val[0].eval_lhs(context).val
     rhs = self.val[2].eval_rhs(context)
-    return Context(parent=context, val=None, slots={varname: rhs.val})
+    return Context(parent=context, val=None,
+                   slots={varname: captured(rhs.val)})
+
+  def optimize(self):
+    return self.rebuilt(self.val[:2] + [self.val[2].optimize_value()])
 
 class expr_link(expr):
   def eval(self, context):
@@ -100,19 +244,43 @@ class expr_link(expr):
     rhs_val = expr_reference(self.val[2])
     return Context(parent=context, val=rhs_val, slots={varname: rhs_val})
 
+  def optimize(self):
+    body = self.val[2]
+    optimized = body.optimize()
+    if optimized is not body:
+      # the value of the link is the body, and it prints as the source did.
+      optimized.source = getattr(body, 'source', body)
+    return self.rebuilt(self.val[:2] + [optimized])
+
 class expr_equality(expr):
+  operators = {
+    '+': int.__add__,
+    '-': int.__sub__,
+    '*': int.__mul__,
+    '/': int.__div__,
+    '==': lambda x,y: not int.__cmp__(x,y),
+  }
+
   def eval(self, context):
-    op = {
-      '+': int.__add__,
-      '-': int.__sub__,
-      '*': int.__mul__,
-      '/': int.__div__,
-      '==': lambda x,y: not int.__cmp__(x,y),
-    }[self.val[1].val]
+    op = self.operators[self.val[1].val]
 
     lhs = self.val[0].eval(context).val
     rhs = self.val[2].eval(context).val
-    return Context(parent=context, val=op(lhs, rhs))
+    return ValueContext(context, op(lhs, rhs))
+
+  def optimize(self):
+    lhs, rhs = self.val[0].optimize_value(), self.val[2].optimize_value()
+    if isinstance(lhs, integer) and isinstance(rhs, integer):
+      try:
+        val = self.operators[self.val[1].val](lhs.val, rhs.val)
+      except (ArithmeticError, TypeError):
+        # leave the error for eval to raise.
+        val = None
+      # == makes bools, and int operators make NotImplemented when their
+      # rhs is a long. neither is an integer literal.
+      if type(val) in (int, long):
+        return integer(val)
+    return self.rebuilt([lhs, self.val[1], rhs])
 
 class expr_plusminus(expr_equality):
   pass
@@ -122,18 +290,37 @@ class expr_muldiv(expr_equality):
 
 class parenthesized_expr(expr):
   def eval(self, context):
-    return Context(parent=context, val=self.val[1].eval(context).val)
+    return ValueContext(context, self.val[1].eval(context).val)
+
+  def optimize(self):
+    inner = self.val[1].optimize()
+    # parentheses around an expression that makes a ValueContext anyway don't
+    # change its result.
+    if isinstance(inner, (integer, expr_equality, parenthesized_expr)):
+      return inner
+    return self.rebuilt([self.val[0], inner, self.val[2]])
+
+  def optimize_value(self):
+    return self.val[1].optimize_value()
 
 class expr_highest_precedence(expr):
   pass
 
+class expr_binary(parser.OperatorPrecedenceRule):
+  pass
+
 
 
 # ----- The terminal tokens.
 
 class Value(parser.Terminal):
   def eval(self, context):
-    return Context(parent=context, val=self.val)
+    return ValueContext(context, self.val)
+
+  def optimize(self):
+    return self
+
+  optimize_value = optimize
 
   def eval_lhs(self, context):
     return self.eval(context)
@@ -144,33 +331,31 @@ class Value(parser.Terminal):
 
 class integer(Value):
   @classmethod
-  def tokenize(cls, string):
-    num_str = ''
-    while string and string[0].isdigit():
-      num_str += string[0]
-      string = string[1:]
+  def scan(cls, string, pos):
+    end = pos
+    while end < len(string) and string[end].isdigit():
+      end += 1
 
-    return (cls(int(num_str)) if num_str else None), string
+    return (cls(int(string[pos:end])) if end > pos else None), end
 
 
 class variable(Value):
   @classmethod
-  def tokenize(cls, string):
-    varname = ''
-    while string and (string[0].isalnum() or string[0] == '_'):
-      varname += string[0]
-      string = string[1:]
+  def scan(cls, string, pos):
+    end = pos
+    while end < len(string) and (string[end].isalnum() or string[end] == '_'):
+      end += 1
 
-    return (cls(varname) if varname else None), string
+    return (cls(string[pos:end]) if end > pos else None), end
 
   def eval_lhs(self, context):
-    return Context(parent=context, val=self.val)
+    return ValueContext(context, self.val)
 
   def eval_rhs(self, context):
     v = context[self.val]
     if isinstance(v, expr_reference):
-      return v.val.eval(context)
-    return Context(parent=context, val=v)
+      return call(v, context, self.val)
+    return ValueContext(context, v)
 
   def eval(self, context):
     return self.eval_rhs(context)
@@ -197,9 +382,131 @@ class op_if(parser.LiteralToken):
       except UnknownVariableError:
         return truth_context
 
+  def optimize(self):
+    return self
 
-def tokenize(string):
-  return parser.tokenize(string, [
+  optimize_value = optimize
+
+
+# ----- Maps and lists.
+#
+# maps are persistent hash maps and lists are persistent vectors, so
+# "changing" one makes a new one and every context that holds the old one
+# still sees it unchanged. Like if, the builtins that work on them take their
+# arguments from variables:
+#
+#   m = map_new
+#   m = (map=m key=1 value=10 map_put)
+#   (map=m key=1 map_get)
+#
+#   l = (list=list_new value=7 list_push)
+#   (list=l index=0 list_get)
+
+def argument(context, varname):
+  return variable(varname).eval_rhs(context).val
+
+def map_argument(context):
+  m = argument(context, 'map')
+  if not isinstance(m, pmap.PersistentMap):
+    raise BuiltinError(context, '%s is not a map.' % (m,))
+  return m
+
+def list_argument(context):
+  l = argument(context, 'list')
+  if not isinstance(l, pvector.PersistentVector):
+    raise BuiltinError(context, '%s is not a list.' % (l,))
+  return l
+
+def map_get(context):
+  m = map_argument(context)
+  key = argument(context, 'key')
+  leaf = pmap.find(m.root, hash(key), key)
+  if leaf is None:
+    raise BuiltinError(context, 'The map has no key %s.' % (key,))
+  return leaf.value
+
+def list_index(context, l):
+  i = argument(context, 'index')
+  if type(i) not in (int, long) or not 0 <= i < len(l):
+    raise BuiltinError(context, 'The list has no index %s.' % (i,))
+  return i
+
+def list_get(context):
+  l = list_argument(context)
+  return l[list_index(context, l)]
+
+def list_set(context):
+  l = list_argument(context)
+  return l.set(list_index(context, l), argument(context, 'value'))
+
+def list_pop(context):
+  l = list_argument(context)
+  if not l:
+    raise BuiltinError(context, "Can't pop an empty list.")
+  return l.pop()
+
+class builtin(parser.LiteralToken):
+  operations = {
+    'map_new': lambda context: pmap.EMPTY,
+    'map_put': lambda context: map_argument(context).set(
+        argument(context, 'key'), argument(context, 'value')),
+    'map_get': map_get,
+    'map_has': lambda context: argument(context, 'key') in map_argument(
+        context),
+    'map_remove': lambda context: map_argument(context).remove(
+        argument(context, 'key')),
+    'map_size': lambda context: len(map_argument(context)),
+    'list_new': lambda context: pvector.EMPTY,
+    'list_push': lambda context: list_argument(context).append(
+        argument(context, 'value')),
+    'list_get': list_get,
+    'list_set': list_set,
+    'list_pop': list_pop,
+    'list_size': lambda context: len(list_argument(context)),
+  }
+  tokens = set(operations)
+
+  # the variables each builtin reads.
+  arguments = {
+    'map_new': (),
+    'map_put': ('map', 'key', 'value'),
+    'map_get': ('map', 'key'),
+    'map_has': ('map', 'key'),
+    'map_remove': ('map', 'key'),
+    'map_size': ('map',),
+    'list_new': (),
+    'list_push': ('list', 'value'),
+    'list_get': ('list', 'index'),
+    'list_set': ('list', 'index', 'value'),
+    'list_pop': ('list',),
+    'list_size': ('list',),
+  }
+
+  @classmethod
+  def scan(cls, string, pos):
+    # builtins are whole words, so variables can start with their names.
+    token, end = variable.scan(string, pos)
+    if token is not None and token.val in cls.operations:
+      return cls(token.val), end
+    return None, pos
+
+  def apply(self, context):
+    """Returns the value of the builtin in context."""
+    return self.operations[self.val](context)
+
+  def eval(self, context):
+    return ValueContext(context, self.apply(context))
+
+  eval_rhs = eval
+
+  def optimize(self):
+    return self
+
+  optimize_value = optimize
+
+
+# the tokens, in the order the tokenizer tries them.
+TOKENS = [
     integer,
     op_equality,
     op_plusminus,
@@ -207,10 +514,14 @@ def tokenize(string):
     op_assignment,
     op_link,
     op_if,
+    builtin,
     open_paren,
     close_paren,
     comma,
-    variable])
+    variable]
+
+def tokenize(string):
+  return parser.tokenize(string, TOKENS)
 
 
 # ----- The production rules.
@@ -221,12 +532,38 @@ expr_sequence.rules = (
     expr,
     )
 
-expr.rules = (
-    op_if,
-    expr_assignment,
-    expr_link,
-    expr_equality,
-    )
+def optimize(tree):
+  """Returns tree with its constant arithmetic folded and its redundant
+  parentheses removed. See expr.optimize."""
+  return tree.optimize()
+
+# parses source text into optimized expr_sequence trees, remembering the most
+# recently parsed statements.
+parse_cache = parser.ParseCache(tokenize, expr_sequence, optimize=optimize)
+
+# The binary operators are parsed either by the recursive descent rules
+# expr_equality, expr_plusminus and expr_muldiv below, or by the precedence
+# climber expr_binary. Both produce the same kinds of nodes. The precedence
+# climber parses long chains of operators without deep recursion, and makes
+# the operators left associative.
+parser_backends = {
+    'descent': expr_equality,
+    'precedence': expr_binary,
+    }
+
+def set_parser_backend(backend):
+  # the backends don't agree on associativity, so trees parsed by one can't
+  # stand in for the other's.
+  parse_cache.clear()
+  expr.rules = (
+      op_if,
+      builtin,
+      expr_assignment,
+      expr_link,
+      parser_backends[backend],
+      )
+
+set_parser_backend('descent')
 
 expr_assignment.rules = (
     [variable, op_assignment, expr],
@@ -251,6 +588,13 @@ expr_muldiv.rules = (
     expr_highest_precedence
     )
 
+expr_binary.operators = (
+    (op_equality, expr_equality),
+    (op_plusminus, expr_plusminus),
+    (op_muldiv, expr_muldiv),
+    )
+expr_binary.operand = expr_highest_precedence
+
 parenthesized_expr.rules = (
     [open_paren, expr_sequence, close_paren],
     )
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""Measures the latency and throughput of a server.
+
+  python loadtest.py [--port N | --unix PATH] [-c sessions] [-n statements]
+                     [--long N]
+
+opens many sessions at once, and has each of them send statements one at a
+time, waiting for the answer to each before it sends the next. Reports the
+statements answered per second, and percentiles of the time between sending
+a statement and reading its answer. With --long, that many more sessions
+send long running statements over and over, and the statements they send
+don't count.
+
+Without --port or --unix, it starts a server of its own in this process. The
+server's event loop then shares the interpreter with the clients', so for
+numbers that only measure the server, run one with server.py.
+"""
+import argparse
+import asynchat
+import asyncore
+import socket
+import sys
+import threading
+import timeit
+
+import server
+
+clock = timeit.default_timer
+
+# the statements each session repeats.
+SCRIPT = ['a = 1', 'a = a + 1', 'f ~ a * 2 + 1', 'f']
+# what the long sessions repeat. about a second per fib.
+LONG_SCRIPT = ['fib ~ (then=n else~((n=n-1 fib) + (n=n-2 fib)) '
+               'cond=((n==0) + (n==1)) if)', '(n=18 fib)']
+
+
+class Client(asynchat.async_chat):
+  def __init__(self, test, address, statements, script=SCRIPT):
+    asynchat.async_chat.__init__(self, map=test.map)
+    self.test = test
+    self.statements = statements
+    self.script = script
+    self.sent = 0
+    self.start = None
+    self.lines = []
+    self.set_terminator('\n')
+    if isinstance(address, basestring):
+      self.create_socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+      self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.connect(address)
+
+  def handle_connect(self):
+    self.send_next()
+
+  def send_next(self):
+    if self.sent == self.statements:
+      self.test.finished += 1
+      self.close()
+      return
+    statement = self.script[self.sent % len(self.script)]
+    self.sent += 1
+    self.start = clock()
+    self.push(statement + '\n')
+
+  def collect_incoming_data(self, data):
+    self.lines.append(data)
+
+  def found_terminator(self):
+    if self.statements is None:
+      self.lines = []
+      self.send_next()
+      return
+    self.test.latencies.append(clock() - self.start)
+    if ''.join(self.lines).startswith('error'):
+      self.test.errors += 1
+    self.lines = []
+    self.send_next()
+
+  def handle_close(self):
+    if self.statements is not None and self.sent < self.statements:
+      self.test.failed += 1
+    self.close()
+
+  def handle_error(self):
+    if self.statements is not None:
+      self.test.failed += 1
+    self.close()
+
+
+class LoadTest(object):
+  def __init__(self):
+    self.map = {}
+    self.latencies = []
+    self.finished = self.failed = self.errors = 0
+    self.elapsed = 0.0
+
+  def run(self, address, sessions, statements, time_limit=None, long=0):
+    """Runs the sessions to completion, or for time_limit seconds. long
+    more sessions send LONG_SCRIPT until the others are done."""
+    start = clock()
+    for _ in xrange(long):
+      Client(self, address, None, LONG_SCRIPT)
+    for _ in xrange(sessions):
+      Client(self, address, statements)
+    while self.finished + self.failed < sessions:
+      asyncore.loop(0.1, use_poll=True, map=self.map, count=1)
+      if time_limit is not None and clock() - start > time_limit:
+        break
+    self.elapsed = clock() - start
+    for client in self.map.values():
+      client.close()
+
+  def percentile(self, p):
+    """Returns the pth percentile of the latencies."""
+    latencies = sorted(self.latencies)
+    if not latencies:
+      return None
+    return latencies[min(len(latencies) - 1,
+                         int(p / 100.0 * len(latencies)))]
+
+  def report(self, out):
+    print >>out, '%d sessions finished, %d failed, in %.2fs' % (
+        self.finished, self.failed, self.elapsed)
+    print >>out, '%d statements, %d errors, %.0f statements/s' % (
+        len(self.latencies), self.errors,
+        len(self.latencies) / self.elapsed if self.elapsed else 0)
+    if self.latencies:
+      print >>out, 'latency p50 %.2fms p99 %.2fms max %.2fms' % (
+          1e3 * self.percentile(50), 1e3 * self.percentile(99),
+          1e3 * max(self.latencies))
+
+
+def main(argv):
+  flags = argparse.ArgumentParser(description='Load test a server.')
+  flags.add_argument('--port', type=int, help='a server on localhost.')
+  flags.add_argument('--unix', metavar='PATH',
+                     help='a server on a unix socket.')
+  flags.add_argument('-c', '--sessions', type=int, default=1000)
+  flags.add_argument('-n', '--statements', type=int, default=20,
+                     help='the statements each session sends.')
+  flags.add_argument('-j', '--workers', type=int,
+                     help='the workers of the server this starts, if any.')
+  flags.add_argument('--long', type=int, default=0,
+                     help='sessions that send long running statements.')
+  flags.add_argument('--time-limit', type=float,
+                     help='stop after this many seconds.')
+  args = flags.parse_args(argv)
+  server.raise_file_limit()
+
+  local = None
+  if args.unix:
+    address = args.unix
+  elif args.port:
+    address = ('127.0.0.1', args.port)
+  else:
+    local = server.Server(('127.0.0.1', 0), args.workers)
+    address = local.address
+    thread = threading.Thread(target=local.serve_forever, args=(0.05,))
+    thread.daemon = True
+    thread.start()
+
+  test = LoadTest()
+  try:
+    test.run(address, args.sessions, args.statements, args.time_limit,
+             args.long)
+  finally:
+    if local is not None:
+      local.stop()
+      thread.join()
+      local.close()
+  test.report(sys.stdout)
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
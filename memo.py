@@ -0,0 +1,146 @@
+"""Memoizes the bodies of ~ links.
+
+There are no side effects, so evaluating the body of a ~ link twice with the
+same values for the variables it reads gives the same result. A naive
+recursive fibonacci recomputes the same calls exponentially often:
+
+  fib ~ (then=n else~((n=n-1 fib) + (n=n-2 fib)) cond=((n==0) + (n==1)) if)
+
+With memoization, each distinct call is evaluated once:
+
+  context = memo.evaluate(tree, context)
+
+The variables a body reads are found by analysis.free_variables(), which
+walks its tree. A call is keyed on the body and the values those variables
+have in the calling context. When one of them is bound to another ~ body,
+that body's variables are part of the key too, and so on.
+
+A body is only memoized when it doesn't read this, and when the values it
+reads are integers, bools, None or ~ bodies. Contexts, maps and lists can
+hold ~ bodies that read variables the key doesn't cover, so calls that read
+them are evaluated as usual.
+
+The first call with a given key evaluates the body in a context that only
+binds the variables in the key. The result's value and the variables the
+body bound are cached, and every call with the same key returns them on top
+of the calling context. Results are the same as eval()'s, except that the
+stacktraces of errors raised by memoized bodies don't show the caller's
+contexts.
+"""
+import collections
+
+import pmap
+import infixlang
+import analysis
+from infixlang import Context, ValueContext, expr_reference
+
+
+def evaluate(tree, context, memo=None):
+  """Evaluates tree in context, memoizing the bodies of ~ links in memo, or
+  in a new Memo."""
+  if memo is None:
+    memo = Memo()
+  # bodies that aren't in the cache are evaluated by whatever call was there
+  # before, like a profiler's.
+  with infixlang.hooked(infixlang, 'call', memo.call):
+    return tree.eval(context)
+
+
+# ----- The cache.
+
+# the value of a free variable that isn't bound.
+MISSING = object()
+
+# the types of values a key can hold.
+KEYABLE = (int, long, bool, type(None))
+
+
+class Memo(object):
+  """A bounded LRU cache of the results of calls to ~ bodies.
+
+  hits and misses count the calls that were and weren't found in the cache,
+  skipped counts the calls that couldn't be memoized, and evictions counts
+  the results dropped to make room for new ones.
+  """
+
+  def __init__(self, maxsize=10000):
+    self.maxsize = maxsize
+    self.results = collections.OrderedDict()
+    # the free variables of each body, by the body's tree.
+    self.free = {}
+    self.hits = self.misses = self.skipped = self.evictions = 0
+
+  def __len__(self):
+    return len(self.results)
+
+  def clear(self):
+    self.results.clear()
+
+  def free_variables(self, body):
+    try:
+      return self.free[body]
+    except KeyError:
+      names = self.free[body] = analysis.free_variables(body)
+      return names
+
+  def key(self, body, context):
+    """Returns the key for calling body in context, and the values of the
+    variables in the key. Returns None and None if the call can't be
+    memoized."""
+    key = [body]
+    env = {}
+    root = context.bindings.root
+    pending = [body]
+    seen = set(pending)
+    while pending:
+      names = self.free_variables(pending.pop())
+      if names is None:
+        return None, None
+      for name in names:
+        if name in env:
+          continue
+        leaf = pmap.find(root, hash(name), name)
+        if leaf is None:
+          key.append((name, MISSING))
+          continue
+        v = env[name] = leaf.value
+        if isinstance(v, expr_reference):
+          # references are keyed on their body, not on the reference object,
+          # which is made anew each time the ~ link is evaluated.
+          key.append((name, v.val))
+          if v.val not in seen:
+            seen.add(v.val)
+            pending.append(v.val)
+        elif type(v) in KEYABLE:
+          # True == 1, but the two print differently.
+          key.append((name, type(v), v))
+        else:
+          return None, None
+    return tuple(key), env
+
+  def call(self, inner, reference, context, varname=None):
+    """Like infixlang.call, with memoization. The calls that aren't in the
+    cache are evaluated with inner, the call this one is hooked over."""
+    body = reference.val
+    key, env = self.key(body, context)
+    if key is None:
+      self.skipped += 1
+      return inner(reference, context, varname)
+
+    try:
+      val, bound = self.results.pop(key)
+      self.hits += 1
+    except KeyError:
+      self.misses += 1
+      result = inner(reference, Context(slots=env), varname)
+      val = result.val
+      bound = dict((name, v) for name, v in result.bindings.iteritems()
+                   if env.get(name, MISSING) is not v)
+      if len(self.results) >= self.maxsize:
+        self.results.popitem(last=False)
+        self.evictions += 1
+    self.results[key] = val, bound
+
+    if not bound:
+      return ValueContext(context, val)
+    return Context(parent=context, val=val, slots=bound)
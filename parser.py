@@ -1,23 +1,101 @@
+import collections
+import itertools
+
+
+class TokenStream(object):
+  """A read-only view of a list of tokens, starting at position pos.
+
+  Slicing tokens off the front of a stream returns a new view of the same
+  list instead of copying it, so consuming a token costs O(1). The list must
+  not be modified while views of it are in use.
+  """
+  __slots__ = ('tokens', 'pos')
+
+  def __init__(self, tokens, pos=0):
+    self.tokens = tokens
+    self.pos = pos
+
+  def __len__(self):
+    return len(self.tokens) - self.pos
+
+  def __nonzero__(self):
+    return self.pos < len(self.tokens)
+
+  def __getitem__(self, i):
+    if isinstance(i, slice):
+      if i.stop is None and i.step is None and (i.start or 0) >= 0:
+        return TokenStream(self.tokens,
+                           min(self.pos + (i.start or 0), len(self.tokens)))
+      return self.tolist()[i]
+
+    if i < 0:
+      i += len(self)
+    if not 0 <= i < len(self):
+      raise IndexError('token stream index out of range')
+    return self.tokens[self.pos + i]
+
+  def __iter__(self):
+    return itertools.islice(self.tokens, self.pos, None)
+
+  def __eq__(self, other):
+    return list(self) == list(other)
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __repr__(self):
+    return repr(self.tolist())
+
+  def tolist(self):
+    return self.tokens[self.pos:]
+
+
 class ParseError(Exception):
   def __init__(self, message='', rule=None, stream=None):
     self.message = message
     self.rule = rule
-    self.stream = stream
+    # record where the error happened instead of holding on to a copy of the
+    # rest of the stream.
+    if isinstance(stream, TokenStream):
+      self.tokens, self.position = stream.tokens, stream.pos
+    else:
+      self.tokens, self.position = stream or [], 0
     self.original_stream = None
 
+  @property
+  def stream(self):
+    return self.tokens[self.position:]
+
   def __str__(self):
     msg = self.message
     if self.original_stream:
+      # original_stream is the token list the parse started from. when the
+      # error carries a position into that same list, this is the position.
       msg += '\nError at token %d:' % (
-          len(self.original_stream) - len(self.stream))
+          len(self.original_stream) - len(self.tokens) + self.position)
 
-    msg += '\n' + ''.join(str(s) for s in self.stream)
+    msg += '\n' + ''.join(
+        str(s) for s in itertools.islice(self.tokens, self.position, None))
     if self.rule:
       msg += '\nFailed rule: ' + str(self.rule)
     return msg
 
 
+class SlottedRule(type):
+  """Gives each rule class an empty __slots__ unless it declares its own, so
+  parse tree nodes don't carry a __dict__."""
+
+  def __new__(mcs, name, bases, namespace):
+    namespace.setdefault('__slots__', ())
+    return type.__new__(mcs, name, bases, namespace)
+
+
 class Rule(object):
+  __metaclass__ = SlottedRule
+  # closure and code are where the closure compiler and the bytecode compiler
+  # cache what they compile a node into (see closure_compiler and vm). source
+  # is the tree an optimized ~ body was made from (see infixlang.expr_link).
+  __slots__ = ('val', 'closure', 'code', 'source')
   rules = None
 
   def __init__(self, val):
@@ -27,7 +105,43 @@ class Rule(object):
     return ' '.join(str(v) for v in self.val)
 
   @classmethod
-  def parse(cls, stream):
+  def parse(cls, stream, memo=None):
+    """Parse a prefix of the token stream according to this rule.
+
+    Returns the parse tree and the unconsumed tokens. The stream can be a
+    list of tokens, in which case the unconsumed tokens are returned as a
+    list, or a TokenStream, in which case they're returned as a TokenStream.
+
+    Passing a dict as memo turns on packrat parsing: the outcome of each rule
+    at each position of the stream is recorded in memo, so no rule is tried
+    twice at the same position. A memo table is only valid for one list of
+    tokens.
+    """
+    if isinstance(stream, TokenStream):
+      return cls.parse_stream(stream, memo)
+
+    tree, rest = cls.parse_stream(TokenStream(stream), memo)
+    return tree, rest.tolist()
+
+  @classmethod
+  def parse_stream(cls, stream, memo):
+    if memo is None:
+      return cls.parse_productions(stream, memo)
+
+    key = (cls, stream.pos)
+    if key not in memo:
+      try:
+        memo[key] = cls.parse_productions(stream, memo)
+      except ParseError as e:
+        memo[key] = e
+
+    result = memo[key]
+    if isinstance(result, ParseError):
+      raise result
+    return result
+
+  @classmethod
+  def parse_productions(cls, stream, memo):
     for rule in cls.rules:
       try:
         if hasattr(rule, '__iter__'):
@@ -36,12 +150,12 @@ class Rule(object):
           parse = []
           new_stream = stream
           for r in rule:
-            v, new_stream = r.parse(new_stream) 
+            v, new_stream = r.parse_stream(new_stream, memo)
             parse.append(v)
           return cls(parse), new_stream
         else:
           # the rule is an alias for another rule. just report its result.
-          return rule.parse(stream)
+          return rule.parse_stream(stream, memo)
       except ParseError:
         pass
 
@@ -49,58 +163,183 @@ class Rule(object):
     raise ParseError(message='No grammar rule matched', rule=cls, stream=stream)
 
 
+class OperatorPrecedenceRule(Rule):
+  """Parses chains of binary operators by precedence climbing.
+
+  operators lists (operator terminal, node class) pairs from the lowest to
+  the highest precedence. A chain of operators at one level is parsed into
+  left associative node_class([lhs, operator, rhs]) nodes. operand is the
+  rule for the operands of the operators. A chain is consumed by a loop, so
+  long chains don't recurse deeply.
+  """
+  operators = ()
+  operand = None
+
+  @classmethod
+  def parse_productions(cls, stream, memo):
+    levels = dict((op, (level, node_class))
+                  for level, (op, node_class) in enumerate(cls.operators))
+    return cls.climb(stream, 0, levels, memo)
+
+  @classmethod
+  def climb(cls, stream, min_level, levels, memo):
+    lhs, stream = cls.operand.parse_stream(stream, memo)
+    while stream:
+      op = stream[0]
+      level, node_class = levels.get(type(op), (-1, None))
+      if level < min_level:
+        break
+
+      try:
+        rhs, rest = cls.climb(stream[1:], level + 1, levels, memo)
+      except ParseError:
+        # a dangling operator isn't part of this expression.
+        break
+
+      lhs, stream = node_class([lhs, op, rhs]), rest
+    return lhs, stream
+
+
 class Terminal(Rule):
+  # start and end are the offsets of the token in the source string. they're
+  # set by tokenize().
+  __slots__ = ('start', 'end')
+
+  def __init__(self, val):
+    self.val = val
+    self.start = self.end = None
+
   def __repr__(self):
     return str(self.val)
 
   @classmethod
   def tokenize(cls, string):
-    raise NotImplementedError
+    token, end = cls.scan(string, 0)
+    return token, string[end:]
 
   @classmethod
-  def parse(cls, stream):
-    if not stream:
-      raise ParseError(rule=cls, stream=stream)
+  def scan(cls, string, pos):
+    """Recognize a token that starts at string[pos].
+
+    Returns the token and the offset just past it, or (None, pos) if the
+    token isn't there.
+    """
+    raise NotImplementedError
 
-    if not isinstance(stream[0], cls):
+  @classmethod
+  def parse_stream(cls, stream, memo):
+    tokens, pos = stream.tokens, stream.pos
+    if pos >= len(tokens) or not isinstance(tokens[pos], cls):
       raise ParseError(rule=cls, stream=stream)
 
-    return stream[0], stream[1:]
+    return tokens[pos], TokenStream(tokens, pos + 1)
 
 
 class LiteralToken(Terminal):
   tokens = {}
 
   @classmethod
-  def tokenize(cls, string):
+  def scan(cls, string, pos):
     for token in cls.tokens:
-      if string.startswith(token):
-        return cls(token), string[len(token):]
-    return None, string
+      if string.startswith(token, pos):
+        return cls(token), pos + len(token)
+    return None, pos
+
 
+# support for tokenizing the input. The tokenizer walks a cursor over the
+# input instead of slicing it, so tokenizing is linear in the length of the
+# input.
 
-# support for tokenizing the input
+def skip_whitespace(string, pos):
+  while pos < len(string) and string[pos].isspace():
+    pos += 1
+  return pos
 
 def eat_whitespace(string):
-  while string and string[0].isspace():
-    string = string[1:]
-  return string
+  return string[skip_whitespace(string, 0):]
 
 def tokenize(string, acceptable_tokens):
   parsed_tokens = []
-  while string:
-    string = eat_whitespace(string)
-    if not string:
-      break
+  try:
+    for token in iter_tokens(string, acceptable_tokens):
+      parsed_tokens.append(token)
+  except ParseError as e:
+    e.tokens = parsed_tokens
+    raise
+  return parsed_tokens
 
+def iter_tokens(string, acceptable_tokens, pos=0):
+  """Yields the tokens of string that start at or after offset pos, which
+  must not be inside a token. Lexing only looks forward, so lexing can
+  resume from the start of any token."""
+  pos = skip_whitespace(string, pos)
+  while pos < len(string):
     for tok in acceptable_tokens:
-      token, string = tok.tokenize(string)
+      token, end = tok.scan(string, pos)
       if token:
-        parsed_tokens.append(token)
+        token.start, token.end = pos, end
+        yield token
         break
 
     if not token:
-      raise ParseError(message='Unrecognized:' + string,
-                       stream=parsed_tokens)
+      raise ParseError(message='Unrecognized:' + string[pos:])
 
-  return parsed_tokens
+    pos = skip_whitespace(string, end)
+
+
+class ParseCache(object):
+  """A bounded LRU cache from source text to parse trees.
+
+  parse() tokenizes and parses a string with the given tokenize function and
+  rule, and remembers the result, so parsing the same statement again skips
+  both. Strings that only differ in how much whitespace separates their
+  tokens share an entry. The start and end offsets of the tokens in a cached
+  tree refer to the string that was parsed first.
+
+  Cached trees are shared by every caller that parses the same text, so
+  nothing may modify a parse tree after it's built. Parse errors aren't
+  cached.
+
+  If optimize is given, it's applied to each tree once, when the tree is
+  parsed.
+  """
+
+  def __init__(self, tokenize, rule, maxsize=1024, optimize=None):
+    self.tokenize = tokenize
+    self.rule = rule
+    self.optimize = optimize
+    self.maxsize = maxsize
+    self.entries = collections.OrderedDict()
+    self.hits = self.misses = 0
+
+  def __len__(self):
+    return len(self.entries)
+
+  def clear(self):
+    self.entries.clear()
+
+  def parse(self, string):
+    """Returns the parse tree of string and a list of the tokens that weren't
+    parsed. Raises ParseError if string doesn't tokenize or parse."""
+    key = ' '.join(string.split())
+    try:
+      tree, rest = self.entries.pop(key)
+    except KeyError:
+      self.misses += 1
+      tokens = self.tokenize(string)
+      try:
+        tree, rest = self.rule.parse(tokens, {})
+      except ParseError as e:
+        e.original_stream = tokens
+        raise
+      if self.optimize:
+        tree = self.optimize(tree)
+
+      while self.entries and len(self.entries) >= self.maxsize:
+        self.entries.popitem(last=False)
+    else:
+      self.hits += 1
+
+    if self.maxsize > 0:
+      self.entries[key] = tree, rest
+    return tree, list(rest)
@@ -0,0 +1,339 @@
+"""Persistent hash maps.
+
+A PersistentMap is an immutable mapping. Setting a key returns a new map that
+shares all but O(log n) of its structure with the old one, so maps derived
+from each other are cheap to make and to keep around.
+
+The maps are hash array mapped tries. Each level of the trie consumes 5 bits
+of the keys' hashes. Keys whose hashes are equal share a Collision bucket.
+Merging two maps that share structure only visits the parts where they
+differ.
+"""
+
+BITS = 5
+MASK = (1 << BITS) - 1
+
+
+def popcount(x):
+  return bin(x).count('1')
+
+
+class Leaf(object):
+  __slots__ = ('hash', 'key', 'value')
+  size = 1
+
+  def __init__(self, hash, key, value):
+    self.hash = hash
+    self.key = key
+    self.value = value
+
+  def leaves(self):
+    return (self,)
+
+
+class Collision(object):
+  __slots__ = ('hash', 'items')
+
+  def __init__(self, hash, items):
+    self.hash = hash
+    self.items = items
+
+  @property
+  def size(self):
+    return len(self.items)
+
+  def leaves(self):
+    return self.items
+
+
+class Node(object):
+  __slots__ = ('bitmap', 'children', 'size')
+
+  def __init__(self, bitmap, children, size):
+    self.bitmap = bitmap
+    self.children = children
+    self.size = size
+
+
+def find(node, h, key, shift=0):
+  """Returns the leaf for key under node, or None."""
+  while type(node) is Node:
+    bitmap = node.bitmap
+    bit = 1 << ((h >> shift) & MASK)
+    if not bitmap & bit:
+      return None
+    node = node.children[bin(bitmap & (bit - 1)).count('1')]
+    shift += BITS
+
+  if type(node) is Leaf:
+    if node.hash == h and (node.key is key or node.key == key):
+      return node
+    return None
+
+  if node is None:
+    return None
+  for leaf in node.items:
+    if leaf.hash == h and (leaf.key is key or leaf.key == key):
+      return leaf
+  return None
+
+
+def pair(a, b, shift):
+  """Returns a node that holds a and b, two leaves or collisions whose hashes
+  differ."""
+  ia = (a.hash >> shift) & MASK
+  ib = (b.hash >> shift) & MASK
+  if ia == ib:
+    return Node(1 << ia, (pair(a, b, shift + BITS),), a.size + b.size)
+  return Node((1 << ia) | (1 << ib), (a, b) if ia < ib else (b, a),
+              a.size + b.size)
+
+
+def assoc(node, shift, leaf):
+  """Returns node with leaf added to it, replacing any leaf with the same
+  key."""
+  if node is None:
+    return leaf
+
+  t = type(node)
+  if t is Node:
+    bit = 1 << ((leaf.hash >> shift) & MASK)
+    i = popcount(node.bitmap & (bit - 1))
+    children = node.children
+    if not node.bitmap & bit:
+      return Node(node.bitmap | bit, children[:i] + (leaf,) + children[i:],
+                  node.size + 1)
+
+    child = children[i]
+    new_child = assoc(child, shift + BITS, leaf)
+    if new_child is child:
+      return node
+    return Node(node.bitmap, children[:i] + (new_child,) + children[i + 1:],
+                node.size + new_child.size - child.size)
+
+  if node.hash != leaf.hash:
+    return pair(node, leaf, shift)
+
+  items = node.leaves()
+  for i, old in enumerate(items):
+    if old.key is leaf.key or old.key == leaf.key:
+      if old.value is leaf.value:
+        return node
+      if t is Leaf:
+        return leaf
+      return Collision(leaf.hash, items[:i] + (leaf,) + items[i + 1:])
+  return Collision(leaf.hash, items + (leaf,))
+
+
+def dissoc(node, shift, h, key):
+  """Returns node without the leaf for key. Returns node itself if it has no
+  such leaf, and None if nothing is left."""
+  if node is None:
+    return None
+
+  t = type(node)
+  if t is Node:
+    bit = 1 << ((h >> shift) & MASK)
+    if not node.bitmap & bit:
+      return node
+    i = popcount(node.bitmap & (bit - 1))
+    children = node.children
+    child = children[i]
+    new_child = dissoc(child, shift + BITS, h, key)
+    if new_child is child:
+      return node
+    if new_child is not None:
+      return Node(node.bitmap, children[:i] + (new_child,) + children[i + 1:],
+                  node.size - 1)
+
+    children = children[:i] + children[i + 1:]
+    if not children:
+      return None
+    if len(children) == 1 and type(children[0]) is not Node:
+      # a lone leaf or collision can stand in for its parent.
+      return children[0]
+    return Node(node.bitmap ^ bit, children, node.size - 1)
+
+  items = tuple(leaf for leaf in node.leaves()
+                if not (leaf.hash == h and (leaf.key is key or leaf.key == key)))
+  if len(items) == node.size:
+    return node
+  if not items:
+    return None
+  if len(items) == 1:
+    return items[0]
+  return Collision(node.hash, items)
+
+
+def merge(a, b, shift):
+  """Returns a node with the leaves of a and b. The leaves of b win."""
+  if a is b or b is None:
+    return a
+  if a is None:
+    return b
+
+  if type(b) is not Node:
+    for leaf in b.leaves():
+      a = assoc(a, shift, leaf)
+    return a
+
+  if type(a) is not Node:
+    for leaf in a.leaves():
+      if find(b, leaf.hash, leaf.key, shift) is None:
+        b = assoc(b, shift, leaf)
+    return b
+
+  # both are nodes. merge them child by child.
+  children = []
+  size = 0
+  ia = ib = 0
+  for i in xrange(1 << BITS):
+    bit = 1 << i
+    ca = cb = None
+    if a.bitmap & bit:
+      ca = a.children[ia]
+      ia += 1
+    if b.bitmap & bit:
+      cb = b.children[ib]
+      ib += 1
+    if ca is not None or cb is not None:
+      child = merge(ca, cb, shift + BITS)
+      children.append(child)
+      size += child.size
+
+  children = tuple(children)
+  if children == b.children:
+    return b
+  return Node(a.bitmap | b.bitmap, children, size)
+
+
+def diff(a, b, shift):
+  """Yields the keys whose leaves differ between a and b: the keys in only
+  one of them, and the keys bound to different values. Subtrees that a and b
+  share are skipped, so maps derived from each other are compared in time
+  proportional to their differences."""
+  if a is b:
+    return
+
+  if type(a) is Node and type(b) is Node:
+    ia = ib = 0
+    for i in xrange(1 << BITS):
+      bit = 1 << i
+      ca = cb = None
+      if a.bitmap & bit:
+        ca = a.children[ia]
+        ia += 1
+      if b.bitmap & bit:
+        cb = b.children[ib]
+        ib += 1
+      if ca is not cb:
+        for key in diff(ca, cb, shift + BITS):
+          yield key
+    return
+
+  # one side is a leaf, a collision or empty. compare the leaves.
+  old = dict((leaf.key, leaf.value) for leaf in iterleaves(a))
+  for leaf in iterleaves(b):
+    if old.pop(leaf.key, diff) is not leaf.value:
+      yield leaf.key
+  for key in old:
+    yield key
+
+
+def iterleaves(node):
+  stack = [node] if node is not None else []
+  while stack:
+    node = stack.pop()
+    if type(node) is Node:
+      stack.extend(reversed(node.children))
+    else:
+      for leaf in node.leaves():
+        yield leaf
+
+
+class PersistentMap(object):
+  __slots__ = ('root',)
+
+  def __init__(self, root=None):
+    self.root = root
+
+  def __len__(self):
+    return self.root.size if self.root is not None else 0
+
+  def __getitem__(self, key):
+    leaf = find(self.root, hash(key), key)
+    if leaf is None:
+      raise KeyError(key)
+    return leaf.value
+
+  def get(self, key, default=None):
+    leaf = find(self.root, hash(key), key)
+    return default if leaf is None else leaf.value
+
+  def __contains__(self, key):
+    return find(self.root, hash(key), key) is not None
+
+  def set(self, key, value):
+    root = assoc(self.root, 0, Leaf(hash(key), key, value))
+    return self if root is self.root else PersistentMap(root)
+
+  def remove(self, key):
+    """Returns a map without key."""
+    root = dissoc(self.root, 0, hash(key), key)
+    return self if root is self.root else PersistentMap(root)
+
+  def update(self, items):
+    """Returns a map with the items of a mapping added to this one."""
+    if isinstance(items, PersistentMap):
+      return self.merge(items)
+
+    root = self.root
+    for key, value in items.iteritems():
+      root = assoc(root, 0, Leaf(hash(key), key, value))
+    return self if root is self.root else PersistentMap(root)
+
+  def merge(self, other):
+    """Returns a map with the items of both maps. The items of other win."""
+    root = merge(self.root, other.root, 0)
+    if root is self.root:
+      return self
+    if root is other.root:
+      return other
+    return PersistentMap(root)
+
+  def diff(self, other):
+    """Yields the keys that are in only one of the maps, or that the maps
+    bind to different values."""
+    return diff(self.root, other.root, 0)
+
+  def iteritems(self):
+    for leaf in iterleaves(self.root):
+      yield leaf.key, leaf.value
+
+  def iterkeys(self):
+    for leaf in iterleaves(self.root):
+      yield leaf.key
+
+  def itervalues(self):
+    for leaf in iterleaves(self.root):
+      yield leaf.value
+
+  __iter__ = iterkeys
+
+  def keys(self):
+    return list(self.iterkeys())
+
+  def values(self):
+    return list(self.itervalues())
+
+  def items(self):
+    return list(self.iteritems())
+
+  def todict(self):
+    return dict(self.iteritems())
+
+  def __repr__(self):
+    return '{%s}' % ', '.join('%r: %r' % item for item in self.iteritems())
+
+
+EMPTY = PersistentMap()
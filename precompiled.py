@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+"""A compact binary format for parse trees.
+
+A precompiled script is a list of statements that were parsed ahead of time,
+so loading it skips tokenizing and parsing. It's meant for preludes of ~
+definitions that every process loads at startup:
+
+  python precompiled.py prelude.ifx prelude.ifxc
+
+  context = precompiled.load_prelude('prelude.ifxc')
+
+The format is a header, a table of the strings the tokens hold, and the trees
+in prefix order:
+
+  header:    'IFXC' magic, then a version byte.
+  strings:   a count, then each string as a length and its bytes.
+  trees:     a count, then each tree.
+  node:      an opcode byte naming the node's class, then
+               for integer tokens, the value, zigzag encoded,
+               for other tokens, the index of their text in the string table,
+               for every other node, the number of children and the children.
+             An optimized ~ link has the body it was optimized from, which
+             is what it prints as, as a fourth child.
+
+Counts, lengths, indices and values are unsigned LEB128 varints.
+"""
+import StringIO
+import mmap
+import sys
+
+import parser
+import infixlang
+import repl
+
+MAGIC = 'IFXC'
+VERSION = 2
+
+# the opcode of each kind of node is its index in this list. append new
+# classes at the end, and bump VERSION if an existing opcode changes meaning.
+NODE_CLASSES = [
+    infixlang.expr_sequence,
+    infixlang.expr_assignment,
+    infixlang.expr_link,
+    infixlang.expr_equality,
+    infixlang.expr_plusminus,
+    infixlang.expr_muldiv,
+    infixlang.parenthesized_expr,
+    infixlang.integer,
+    infixlang.variable,
+    infixlang.op_assignment,
+    infixlang.op_link,
+    infixlang.op_plusminus,
+    infixlang.op_equality,
+    infixlang.op_muldiv,
+    infixlang.comma,
+    infixlang.open_paren,
+    infixlang.close_paren,
+    infixlang.op_if,
+    infixlang.builtin,
+    ]
+OPCODES = dict((cls, i) for i, cls in enumerate(NODE_CLASSES))
+
+
+# ----- Writing.
+
+def write_varint(out, n):
+  while n > 0x7f:
+    out.append(chr(0x80 | (n & 0x7f)))
+    n >>= 7
+  out.append(chr(n))
+
+def zigzag(n):
+  return 2 * n if n >= 0 else -2 * n - 1
+
+def dumps(trees):
+  """Returns the precompiled form of a list of parse trees."""
+  strings = {}
+  body = []
+  write_varint(body, len(trees))
+  for tree in trees:
+    # walk the tree in prefix order without recursing, so deeply nested trees
+    # don't overflow the stack.
+    stack = [tree]
+    while stack:
+      node = stack.pop()
+      cls = type(node)
+      if cls not in OPCODES:
+        raise ValueError("Can't precompile a %s node" % cls.__name__)
+      body.append(chr(OPCODES[cls]))
+
+      if cls is infixlang.integer:
+        write_varint(body, zigzag(node.val))
+      elif isinstance(node, parser.Terminal):
+        write_varint(body, strings.setdefault(node.val, len(strings)))
+      else:
+        children = node.val
+        if cls is infixlang.expr_link and hasattr(node.val[2], 'source'):
+          children = children + [node.val[2].source]
+        write_varint(body, len(children))
+        stack.extend(reversed(children))
+
+  out = [MAGIC, chr(VERSION)]
+  write_varint(out, len(strings))
+  for string in sorted(strings, key=strings.get):
+    if isinstance(string, unicode):
+      string = string.encode('utf-8')
+    write_varint(out, len(string))
+    out.append(string)
+  return ''.join(out + body)
+
+def save(trees, path):
+  with open(path, 'wb') as f:
+    f.write(dumps(trees))
+
+
+# ----- Reading.
+
+class Reader(object):
+  """Decodes the precompiled form in data, a string or a memory map."""
+
+  def __init__(self, data):
+    self.data = data
+    self.pos = 0
+
+  def varint(self):
+    data, pos = self.data, self.pos
+    n = shift = 0
+    while True:
+      byte = ord(data[pos])
+      pos += 1
+      n |= (byte & 0x7f) << shift
+      shift += 7
+      if byte < 0x80:
+        self.pos = pos
+        return n
+
+  def bytes(self, n):
+    s = self.data[self.pos:self.pos + n]
+    self.pos += n
+    return s
+
+  def trees(self):
+    if self.bytes(len(MAGIC)) != MAGIC:
+      raise ValueError('Not a precompiled script')
+    version = ord(self.bytes(1))
+    if version != VERSION:
+      raise ValueError('Unsupported precompiled script version %d' % version)
+
+    strings = [self.bytes(self.varint()) for _ in xrange(self.varint())]
+    return [self.tree(strings) for _ in xrange(self.varint())]
+
+  def tree(self, strings):
+    data = self.data
+    # each entry is a node class, the number of children it still needs, and
+    # the children read so far.
+    stack = []
+    while True:
+      cls = NODE_CLASSES[ord(data[self.pos])]
+      self.pos += 1
+
+      if cls is infixlang.integer:
+        n = self.varint()
+        node = cls(n >> 1 if not n & 1 else -((n + 1) >> 1))
+      elif issubclass(cls, parser.Terminal):
+        node = cls(strings[self.varint()])
+      else:
+        stack.append((cls, self.varint(), []))
+        continue
+
+      # hand the node to its parent, and build every parent this completes.
+      while stack:
+        parent_cls, count, children = stack[-1]
+        children.append(node)
+        if len(children) < count:
+          break
+        stack.pop()
+        if len(children) == 4:
+          # an optimized link, and the source of its body.
+          children[2].source = children.pop()
+        node = parent_cls(children)
+      if not stack:
+        return node
+
+def loads(data):
+  """Returns the list of parse trees precompiled in data."""
+  return Reader(data).trees()
+
+def load(path):
+  """Returns the list of parse trees precompiled in the file at path. The
+  file is memory mapped when that's possible."""
+  with open(path, 'rb') as f:
+    try:
+      data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, EnvironmentError):
+      # empty files and some special files can't be mapped.
+      return loads(f.read())
+
+    try:
+      return loads(data)
+    finally:
+      data.close()
+
+
+# ----- Preludes.
+
+def parse_statements(source):
+  """Returns the optimized parse trees of the statements in source, in
+  order. Statements are split the way repl --run splits them (see
+  repl.read_statements), and each one is parsed as a sequence."""
+  trees = []
+  for statement in repl.read_statements(StringIO.StringIO(source)):
+    tokens = infixlang.tokenize(statement)
+    try:
+      tree, rest = infixlang.expr_sequence.parse(tokens, {})
+      if rest:
+        raise parser.ParseError('Stuff unparsed in the statement:',
+                                stream=rest)
+    except parser.ParseError as e:
+      e.original_stream = tokens
+      raise
+    trees.append(infixlang.optimize(tree))
+  return trees
+
+def compile_source(source, path):
+  """Parses the statements in source and saves them precompiled to path."""
+  save(parse_statements(source), path)
+
+def run_statements(trees, context=None):
+  """Evaluates the statements one after the other, the way the repl
+  evaluates lines, and returns the resulting context."""
+  if context is None:
+    context = infixlang.Context()
+  for tree in trees:
+    context = tree.eval(context).collapse()
+  return context
+
+def load_prelude(path, context=None):
+  """Returns the context that results from running the precompiled prelude
+  at path in context, or in an empty context."""
+  return run_statements(load(path), context)
+
+
+if __name__ == '__main__':
+  if len(sys.argv) != 3:
+    print >>sys.stderr, 'usage: %s source.ifx output.ifxc' % sys.argv[0]
+    sys.exit(2)
+  with open(sys.argv[1]) as f:
+    compile_source(f.read(), sys.argv[2])
@@ -0,0 +1,211 @@
+"""Attributes evaluation time and allocations to ~ definitions.
+
+Python's profilers see expr.eval and Context.__getitem__, not which infixlang
+definition is slow. This profiler records, for each ~ body and the variable
+it was called through:
+
+  calls       how many times the body was evaluated.
+  inclusive   the time spent in the body, including the bodies it called.
+  exclusive   the time spent in the body itself.
+  contexts    the number of Contexts made, inclusive and exclusive.
+
+  with profiler.Profiler() as p:
+    tree.eval(context)
+  p.report(sys.stdout)
+  p.write_stacks(open('out.folded', 'w'))
+
+write_stacks() writes the collapsed stack format that flamegraph.pl and
+speedscope read, in microseconds of exclusive time per stack of calls.
+
+Calls go through infixlang.call, which eval() uses to evaluate ~ bodies, and
+the profiler only hooks it, and counts allocations, while it's enabled (see
+infixlang.hooked). Disabled, it costs nothing. The other engines inline their
+calls, so only eval() (and memo, which the profiler sees through) can be
+profiled.
+"""
+import contextlib
+import timeit
+
+import parser
+import infixlang
+from infixlang import Context, ValueContext
+
+clock = timeit.default_timer
+
+# the name of the outermost frame, where the code outside any ~ body runs.
+TOP = '<top>'
+
+
+class Stats(object):
+  __slots__ = ('name', 'body', 'calls', 'inclusive', 'exclusive',
+               'inclusive_contexts', 'exclusive_contexts', 'active')
+
+  def __init__(self, name, body):
+    self.name = name
+    self.body = body
+    self.calls = 0
+    self.inclusive = self.exclusive = 0.0
+    self.inclusive_contexts = self.exclusive_contexts = 0
+    # how many calls of the body are in progress. only the outermost one
+    # counts towards the inclusive totals of a recursive body.
+    self.active = 0
+
+
+class StackNode(object):
+  """A node in the tree of the stacks of calls seen, with the exclusive time
+  spent at the top of its stack."""
+  __slots__ = ('children', 'exclusive')
+
+  def __init__(self):
+    self.children = {}
+    self.exclusive = 0.0
+
+
+class Frame(object):
+  __slots__ = ('stats', 'node', 'start', 'child_time', 'start_contexts',
+               'child_contexts')
+
+  def __init__(self, stats, node, start, start_contexts):
+    self.stats = stats
+    self.node = node
+    self.start = start
+    self.child_time = 0.0
+    self.start_contexts = start_contexts
+    self.child_contexts = 0
+
+
+class Profiler(object):
+  def __init__(self):
+    # Stats by variable name and body.
+    self.stats = {}
+    self.stacks = StackNode()
+    self.frames = []
+    self.contexts = 0
+    # the with block of hooks() while the profiler is enabled.
+    self.enabled = None
+
+  # ----- Turning it on and off.
+
+  def enable(self):
+    if self.enabled is not None:
+      raise RuntimeError('The profiler is already enabled')
+    self.frames = [Frame(None, self.stacks, clock(), self.contexts)]
+    self.enabled = self.hooks()
+    self.enabled.__enter__()
+
+  def disable(self):
+    if self.enabled is None:
+      return
+    enabled, self.enabled = self.enabled, None
+    try:
+      self.leave(self.frames[0], clock())
+    finally:
+      enabled.__exit__(None, None, None)
+
+  def __enter__(self):
+    self.enable()
+    return self
+
+  def __exit__(self, *exc_info):
+    self.disable()
+
+  @contextlib.contextmanager
+  def hooks(self):
+    with infixlang.hooked(infixlang, 'call', self.call):
+      with infixlang.hooked(Context, '__init__', self.counting):
+        with infixlang.hooked(ValueContext, '__init__', self.counting):
+          yield
+
+  def counting(self, init, context, *args, **kwargs):
+    self.contexts += 1
+    init(context, *args, **kwargs)
+
+  # ----- Recording calls.
+
+  def call(self, inner, reference, context, varname):
+    body = reference.val
+    key = varname, body
+    stats = self.stats.get(key)
+    if stats is None:
+      stats = self.stats[key] = Stats(varname, body)
+    caller = self.frames[-1]
+    node = caller.node.children.get(varname)
+    if node is None:
+      node = caller.node.children[varname] = StackNode()
+
+    stats.calls += 1
+    stats.active += 1
+    frame = Frame(stats, node, clock(), self.contexts)
+    self.frames.append(frame)
+    try:
+      return inner(reference, context, varname)
+    finally:
+      self.frames.pop()
+      self.leave(frame, clock())
+
+  def leave(self, frame, end):
+    elapsed = end - frame.start
+    contexts = self.contexts - frame.start_contexts
+    exclusive = elapsed - frame.child_time
+    frame.node.exclusive += exclusive
+
+    stats = frame.stats
+    if stats is not None:
+      stats.active -= 1
+      stats.exclusive += exclusive
+      stats.exclusive_contexts += contexts - frame.child_contexts
+      if not stats.active:
+        stats.inclusive += elapsed
+        stats.inclusive_contexts += contexts
+
+    if self.frames and frame is not self.frames[0]:
+      caller = self.frames[-1]
+      caller.child_time += elapsed
+      caller.child_contexts += contexts
+
+  # ----- Reports.
+
+  def report(self, out, limit=None):
+    """Writes a table of the bodies, the slowest first."""
+    rows = sorted(self.stats.itervalues(), key=lambda s: -s.exclusive)
+    print >>out, '%8s %10s %10s %10s %10s  %s' % (
+        'calls', 'incl secs', 'excl secs', 'incl ctxs', 'excl ctxs',
+        'definition')
+    for s in rows[:limit]:
+      print >>out, '%8d %10.4f %10.4f %10d %10d  %s ~ %s%s' % (
+          s.calls, s.inclusive, s.exclusive, s.inclusive_contexts,
+          s.exclusive_contexts, s.name, abbreviated(s.body), span(s.body))
+
+  def write_stacks(self, out):
+    """Writes the collapsed stacks of the calls, with their exclusive time in
+    microseconds."""
+    pending = [((TOP,), self.stacks)]
+    while pending:
+      path, node = pending.pop()
+      usecs = int(round(node.exclusive * 1e6))
+      if usecs:
+        print >>out, '%s %d' % (';'.join(path), usecs)
+      for name, child in sorted(node.children.iteritems(), reverse=True):
+        pending.append((path + (name,), child))
+
+
+def abbreviated(tree, width=40):
+  text = repr(tree)
+  return text if len(text) <= width else text[:width - 3] + '...'
+
+def span(tree):
+  """Returns the offsets of the source text tree was parsed from, as a
+  string, or '' if they aren't known."""
+  starts, ends = [], []
+  stack = [tree]
+  while stack:
+    node = stack.pop()
+    if isinstance(node, parser.Terminal):
+      if node.start is not None:
+        starts.append(node.start)
+        ends.append(node.end)
+    else:
+      stack.extend(node.val)
+  if not starts:
+    return ''
+  return ' [%d:%d]' % (min(starts), max(ends))
@@ -0,0 +1,150 @@
+"""Persistent vectors.
+
+A PersistentVector is an immutable sequence. Appending, popping and setting
+an element return a new vector that shares all but O(log n) of its structure
+with the old one.
+
+The elements live in a trie of tuples with up to 32 children each, indexed by
+5 bits of the element's index per level, plus a tail tuple that holds the
+last 1 to 32 elements. Appends go to the tail until it's full, and only then
+copy a path of the trie, so most appends copy one short tuple.
+"""
+
+BITS = 5
+WIDTH = 1 << BITS
+MASK = WIDTH - 1
+
+
+def new_path(shift, node):
+  """Returns node under shift / BITS levels of single child nodes."""
+  while shift > 0:
+    node = (node,)
+    shift -= BITS
+  return node
+
+
+class PersistentVector(object):
+  __slots__ = ('count', 'shift', 'root', 'tail')
+
+  def __init__(self, count=0, shift=BITS, root=(), tail=()):
+    self.count = count
+    self.shift = shift
+    self.root = root
+    self.tail = tail
+
+  def tail_offset(self):
+    # the index of the first element in the tail.
+    if self.count < WIDTH:
+      return 0
+    return ((self.count - 1) >> BITS) << BITS
+
+  def leaf_for(self, i):
+    """Returns the tuple that holds element i."""
+    if i >= self.tail_offset():
+      return self.tail
+    node = self.root
+    shift = self.shift
+    while shift > 0:
+      node = node[(i >> shift) & MASK]
+      shift -= BITS
+    return node
+
+  def __len__(self):
+    return self.count
+
+  def __getitem__(self, i):
+    if not 0 <= i < self.count:
+      raise IndexError(i)
+    return self.leaf_for(i)[i & MASK]
+
+  def __iter__(self):
+    for start in xrange(0, self.count, WIDTH):
+      for v in self.leaf_for(start):
+        yield v
+
+  def append(self, value):
+    """Returns a vector with value added at the end."""
+    if len(self.tail) < WIDTH:
+      return PersistentVector(self.count + 1, self.shift, self.root,
+                              self.tail + (value,))
+
+    # the tail is full. move it into the trie.
+    shift = self.shift
+    if (self.count >> BITS) > (1 << shift):
+      # the trie is full too. grow it a level.
+      root = (self.root, new_path(shift, self.tail))
+      shift += BITS
+    else:
+      root = self.push_tail(shift, self.root)
+    return PersistentVector(self.count + 1, shift, root, (value,))
+
+  def push_tail(self, shift, node):
+    i = ((self.count - 1) >> shift) & MASK
+    if shift == BITS:
+      child = self.tail
+    elif i < len(node):
+      child = self.push_tail(shift - BITS, node[i])
+    else:
+      child = new_path(shift - BITS, self.tail)
+    return node[:i] + (child,) + node[i + 1:]
+
+  def set(self, i, value):
+    """Returns a vector with element i replaced by value."""
+    if not 0 <= i < self.count:
+      raise IndexError(i)
+    if i >= self.tail_offset():
+      j = i & MASK
+      return PersistentVector(self.count, self.shift, self.root,
+                              self.tail[:j] + (value,) + self.tail[j + 1:])
+    return PersistentVector(self.count, self.shift,
+                            self.set_in(self.shift, self.root, i, value),
+                            self.tail)
+
+  def set_in(self, shift, node, i, value):
+    j = (i >> shift) & MASK
+    if shift == 0:
+      child = value
+    else:
+      child = self.set_in(shift - BITS, node[j], i, value)
+    return node[:j] + (child,) + node[j + 1:]
+
+  def pop(self):
+    """Returns a vector without its last element."""
+    if not self.count:
+      raise IndexError('pop from an empty vector')
+    if self.count == 1:
+      return EMPTY
+    if len(self.tail) > 1:
+      return PersistentVector(self.count - 1, self.shift, self.root,
+                              self.tail[:-1])
+
+    # the tail is empty now. the last leaf of the trie becomes the tail.
+    tail = self.leaf_for(self.count - 2)
+    root = self.pop_tail(self.shift, self.root) or ()
+    shift = self.shift
+    if shift > BITS and len(root) == 1:
+      root = root[0]
+      shift -= BITS
+    return PersistentVector(self.count - 1, shift, root, tail)
+
+  def pop_tail(self, shift, node):
+    i = ((self.count - 2) >> shift) & MASK
+    if shift > BITS:
+      child = self.pop_tail(shift - BITS, node[i])
+      if child is None:
+        return node[:i] or None
+      return node[:i] + (child,)
+    return node[:i] or None
+
+  def __repr__(self):
+    return '[%s]' % ', '.join(repr(v) for v in self)
+
+
+EMPTY = PersistentVector()
+
+
+def from_iterable(values):
+  v = EMPTY
+  for value in values:
+    v = v.append(value)
+  return v
@@ -0,0 +1,267 @@
+"""Reactive recomputation of the statements of a repl session.
+
+In an ordinary session a statement is evaluated once, with the values its
+variables had when it was entered. A Sheet keeps the statements that bind
+global variables, spreadsheet style, and when a variable is rebound, the
+statements that read it are evaluated again, and the statements that read
+what those bind, and so on:
+
+  a = 1
+  b = a + 1
+  a = 5         b is recomputed, and is 6 now.
+
+While a statement is evaluated, the sheet records the global variables it
+reads, including the ones read by the ~ bodies it calls and the ones it looks
+for and doesn't find. Reads of variables the statement binds itself, like
+the arguments it passes to a body, aren't recorded. When a variable changes,
+only the statements that read it are recomputed, in topological order, and
+only if what they read changed, so an edit costs time proportional to its
+dependents rather than to the length of the session. A statement that reads
+this depends on every variable.
+
+The newest statement that binds a variable defines it. A statement whose
+variables have all been redefined by newer ones can't affect anything any
+more, and is dropped. Statements that depend on each other in a cycle are
+recomputed at most once per edit. If recomputing a statement raises an
+error, the variables it defines are unbound until it's recomputed
+successfully.
+"""
+import pmap
+import infixlang
+import analysis
+from infixlang import Context, expr_reference
+
+# the value of a variable that isn't bound.
+MISSING = object()
+
+# the types of values compared by value, rather than by identity, to tell
+# whether a variable changed.
+SCALARS = (int, long, bool, type(None))
+
+
+def same(a, b):
+  """Returns whether a variable that changed from a to b is unchanged for the
+  statements that read it."""
+  if a is b:
+    return True
+  if type(a) is not type(b):
+    return False
+  if type(a) in SCALARS:
+    return a == b
+  # a ~ link makes a new reference each time it's evaluated.
+  return type(a) is expr_reference and a.val is b.val
+
+
+class Cell(object):
+  """A statement in a sheet, with the variables it read and defines and its
+  latest result."""
+  __slots__ = ('number', 'tree', 'reads', 'defines', 'result', 'error', 'live')
+
+  def __init__(self, number, tree):
+    # the order the statement was entered in.
+    self.number = number
+    self.tree = tree
+    self.reads = frozenset()
+    self.defines = set()
+    self.result = None
+    self.error = None
+    self.live = True
+
+
+class Sheet(object):
+  def __init__(self):
+    # the values of the global variables.
+    self.globals = pmap.EMPTY
+    # the cell that defines each global variable.
+    self.definitions = {}
+    # the cells that read each variable.
+    self.readers = {}
+    self.count = 0
+    # how many statements have been recomputed in total.
+    self.recomputed = 0
+
+  def context(self):
+    """Returns a context that binds the global variables."""
+    return Context(slots=self.globals, bindings=self.globals)
+
+  def enter(self, tree):
+    """Evaluates a statement and recomputes the statements that depend on the
+    variables it binds.
+
+    Returns the statement's result, the names of the other variables whose
+    values changed, and the errors raised by the statements that were
+    recomputed. An error in the statement itself is raised, and leaves the
+    sheet as it was.
+    """
+    cell = Cell(self.count, tree)
+    self.count += 1
+    cell.result, bound = self.evaluate(cell)
+
+    changed, errors = [], []
+    if bound:
+      self.watch(cell)
+      self.propagate(self.define(cell, bound), cell, changed, errors)
+    return cell.result, changed, errors
+
+  def evaluate(self, cell):
+    """Evaluates a cell's statement in the global context and records the
+    global variables it reads. Returns its result and the variables it
+    bound."""
+    reads = set()
+    root = self.globals.root
+
+    def recording_getitem(getitem, context, name):
+      if name == 'this':
+        reads.add(name)
+      else:
+        h = hash(name)
+        # the variable is global if it's the same leaf as in the globals,
+        # or missing from both.
+        if pmap.find(context.bindings.root, h, name) is pmap.find(
+            root, h, name):
+          reads.add(name)
+      return getitem(context, name)
+
+    try:
+      with infixlang.hooked(Context, '__getitem__', recording_getitem):
+        result = cell.tree.eval(self.context())
+    finally:
+      cell.reads = frozenset(reads)
+
+    # the statement bound the variables whose values it changed, and the
+    # ones it assigned, which may have the values they had before.
+    bindings = result.bindings
+    names = set(self.globals.diff(bindings))
+    try:
+      names.update(analysis.reads(cell.tree, frozenset(), set()))
+    except analysis.Unanalyzable:
+      pass
+    return result, dict((name, bindings[name]) for name in names
+                        if name in bindings)
+
+  # ----- Dependencies.
+
+  def watch(self, cell):
+    for name in cell.reads:
+      self.readers.setdefault(name, set()).add(cell)
+
+  def unwatch(self, cell):
+    for name in cell.reads:
+      readers = self.readers[name]
+      readers.discard(cell)
+      if not readers:
+        del self.readers[name]
+
+  def readers_of(self, names):
+    """Returns the cells that read any of names, the oldest first."""
+    cells = set(self.readers.get('this', ()))
+    for name in names:
+      cells.update(self.readers.get(name, ()))
+    return sorted(cells, key=lambda cell: cell.number)
+
+  def dependents(self, names, done):
+    """Returns the cells that read names, and the cells that read what those
+    define, and so on, in topological order. Skips the cells in done."""
+    # a depth first search, without recursion, so long chains of definitions
+    # don't overflow the stack. the reversed postorder is topological, and
+    # in a cycle, it starts from the oldest cell the search reached.
+    order = []
+    visited = set(done)
+    stack = [(None, iter(self.readers_of(names)))]
+    while stack:
+      cell, children = stack[-1]
+      for child in children:
+        if child not in visited:
+          visited.add(child)
+          stack.append((child, iter(self.readers_of(child.defines))))
+          break
+      else:
+        stack.pop()
+        if cell is not None:
+          order.append(cell)
+    order.reverse()
+    return order
+
+  # ----- Updates.
+
+  def define(self, cell, bound):
+    """Makes cell define the variables in bound that no newer cell defines,
+    and unbinds the ones it defined and doesn't bind any more. Returns the
+    names whose values changed."""
+    changed = self.unbind(cell, cell.defines.difference(bound))
+    for name, value in bound.iteritems():
+      owner = self.definitions.get(name, cell)
+      if owner.number > cell.number:
+        continue
+      if owner is not cell:
+        owner.defines.discard(name)
+        if not owner.defines:
+          self.drop(owner)
+      self.definitions[name] = cell
+      cell.defines.add(name)
+      if not same(self.globals.get(name, MISSING), value):
+        self.globals = self.globals.set(name, value)
+        changed.append(name)
+    return changed
+
+  def unbind(self, cell, names):
+    """Unbinds names, which cell defined, and stops it defining them.
+    Returns the names that were bound."""
+    unbound = []
+    for name in list(names):
+      cell.defines.discard(name)
+      del self.definitions[name]
+      if name in self.globals:
+        self.globals = self.globals.remove(name)
+        unbound.append(name)
+    return unbound
+
+  def drop(self, cell):
+    """Forgets a cell that defines nothing."""
+    cell.live = False
+    self.unwatch(cell)
+
+  def recompute(self, cell, errors):
+    """Evaluates a cell again. Returns the names whose values changed."""
+    self.recomputed += 1
+    self.unwatch(cell)
+    try:
+      cell.result, bound = self.evaluate(cell)
+      cell.error = None
+    except infixlang.Error as e:
+      cell.result, cell.error = None, e
+      errors.append(e)
+    finally:
+      self.watch(cell)
+
+    if cell.error is not None:
+      # keep defining the variables, so the cell binds them again when it's
+      # fixed, but don't leave their old values around.
+      unbound = [name for name in cell.defines if name in self.globals]
+      for name in unbound:
+        self.globals = self.globals.remove(name)
+      return unbound
+    return self.define(cell, bound)
+
+  def propagate(self, names, source, changed, errors):
+    """Recomputes the cells that depend on names, which source changed.
+    Appends the names of the variables that changed to changed, and the
+    errors raised to errors."""
+    done = set([source])
+    while names:
+      dirty = set(names)
+      names = []
+      for cell in self.dependents(dirty, done):
+        if not cell.live or not ('this' in cell.reads or
+                                 not dirty.isdisjoint(cell.reads)):
+          continue
+        done.add(cell)
+        new = self.recompute(cell, errors)
+        dirty.update(new)
+        names.extend(new)
+      for name in names:
+        if name not in changed:
+          changed.append(name)
+      # a recomputed cell can bind variables it didn't before, and those can
+      # have readers the search didn't reach, so search again from the
+      # variables that changed.
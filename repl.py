@@ -1,13 +1,35 @@
 #!/usr/bin/env python
+"""The infixlang repl.
 
+  python repl.py                  an interactive session.
+  python repl.py --run script     runs a script, or stdin with --run -.
+
+With --incremental, a session recomputes the statements that depend on a
+variable when it's rebound, like a spreadsheet (see reactive).
+
+With --profile, a report of the time spent in each ~ definition is printed
+when the session or the script ends (see profiler).
+"""
+import argparse
 import sys
-import readline
 
 import parser
 import infixlang
+import profiler
+import reactive
+
+# how many statements --run evaluates between collapses of the global
+# context, and how many values it prints per write.
+COLLAPSE_EVERY = 64
+FLUSH_EVERY = 256
 
-def repl(istream=None, ostream=sys.stdout, estream=sys.stderr):
+# a line that ends with one of these continues on the next line.
+CONTINUATION = '+-*/=~,'
+
+def repl(istream=None, ostream=sys.stdout, estream=sys.stderr,
+         incremental=False):
   global_context = infixlang.Context()
+  sheet = reactive.Sheet() if incremental else None
 
   while True:
     try:
@@ -21,24 +43,33 @@ def repl(istream=None, ostream=sys.stdout, estream=sys.stderr):
       # ignore blank lines. they're not in the language grammar
       continue 
 
-    # tokenize the line
-    try:
-      tokens = infixlang.tokenize(ln)
-    except parser.ParseError as e:
-      print >>estream, e
-      continue
-
-    # generate a parse tree for the line
+    # generate a parse tree for the line. repeated lines come from the cache.
     try:
-      parse_tree, tokens = infixlang.expr_sequence.parse(tokens)
+      parse_tree, tokens = infixlang.parse_cache.parse(ln)
     except parser.ParseError as e:
-      e.original_stream = tokens
       print >>estream, e
       continue
 
     if tokens:
       print >>estream, 'Warning: stuff unparsed on the line:', tokens
 
+    if sheet is not None:
+      try:
+        result, changed, errors = sheet.enter(parse_tree)
+      except infixlang.Error as e:
+        print >>estream, e
+        continue
+
+      if result.val is not None:
+        print >>ostream, result.val
+      for e in errors:
+        print >>estream, e
+      # show the variables that changed because of the line.
+      for name in changed:
+        if name in sheet.globals:
+          print >>ostream, '%s = %s' % (name, sheet.globals[name])
+      continue
+
     # evaluate the line in the global context
     try:
       global_context = parse_tree.eval(global_context)
@@ -47,19 +78,146 @@ def repl(istream=None, ostream=sys.stdout, estream=sys.stderr):
       continue
 
     # collapse the global context to avoid chaining one context per command line
-    global_context = infixlang.Context(val=global_context.val,
-                                       slots=global_context.dictify())
+    global_context = global_context.collapse()
 
     if global_context.val is not None:
       print >>ostream, global_context.val
 
-if __name__ == '__main__':
-  import pdb, traceback, sys
+def read_statements(istream):
+  """Yields the statements in a stream as soon as they're complete.
+
+  A statement ends at the end of a line where its parentheses are balanced,
+  unless the line ends with an operator, =, ~ or a comma.
+  """
+  lines = []
+  depth = 0
+  for ln in istream:
+    if not lines and ln.isspace():
+      continue
+    lines.append(ln)
+    depth += ln.count('(') - ln.count(')')
+    ln = ln.rstrip()
+    if depth <= 0 and not (ln and ln[-1] in CONTINUATION):
+      yield ''.join(lines)
+      lines = []
+      depth = 0
+
+  if lines:
+    yield ''.join(lines)
+
+def run(istream, ostream=sys.stdout, estream=sys.stderr,
+        collapse_every=COLLAPSE_EVERY, flush_every=FLUSH_EVERY):
+  """Runs the statements in a stream, printing their values like the repl.
+
+  Statements are evaluated as they're read, so the stream can be arbitrarily
+  long. The global context is collapsed every collapse_every statements
+  instead of after each one, which keeps the chain of contexts short without
+  paying for it on every statement. Values are written out flush_every at a
+  time. Returns the global context.
+  """
+  global_context = infixlang.Context()
+  output = []
+  # the global contexts since the last collapse. the repl collapses the
+  # global context after every line, and this can make one of them a value,
+  # so those are printed collapsed, the way the repl prints them.
+  uncollapsed = set()
+
+  def flush():
+    if output:
+      ostream.write('\n'.join(output) + '\n')
+      del output[:]
+
+  try:
+    for count, statement in enumerate(read_statements(istream), 1):
+      try:
+        parse_tree, tokens = infixlang.parse_cache.parse(statement)
+      except parser.ParseError as e:
+        flush()
+        print >>estream, e
+        continue
+
+      if tokens:
+        flush()
+        print >>estream, 'Warning: stuff unparsed on the line:', tokens
+
+      try:
+        uncollapsed.add(id(global_context))
+        global_context = parse_tree.eval(global_context)
+      except infixlang.Error as e:
+        flush()
+        print >>estream, e
+        continue
+
+      val = global_context.val
+      if isinstance(val, infixlang.Context) and id(val) in uncollapsed:
+        val = val.collapse()
+
+      if count % collapse_every == 0:
+        global_context = global_context.collapse()
+        uncollapsed.clear()
+
+      if val is not None:
+        output.append(str(val))
+        if len(output) >= flush_every:
+          flush()
+  finally:
+    # write what was computed before an unexpected exception too.
+    flush()
+  return global_context.collapse()
 
+def main(argv):
+  flags = argparse.ArgumentParser(description='The infixlang repl.')
+  flags.add_argument('--run', metavar='SCRIPT', nargs='?', const='-',
+                     help='run a script instead of starting a session. - '
+                     'reads the script from stdin.')
+  flags.add_argument('--collapse-every', type=int, default=COLLAPSE_EVERY,
+                     help='with --run, collapse the global context every '
+                     'this many statements.')
+  flags.add_argument('--incremental', action='store_true',
+                     help='in an interactive session, recompute the '
+                     'statements that read a variable when it changes.')
+  flags.add_argument('--profile', action='store_true',
+                     help='report the time spent in each ~ definition.')
+  flags.add_argument('--flamegraph', metavar='FILE',
+                     help='profile, and save the stacks of calls to FILE in '
+                     'the collapsed format flamegraph.pl reads.')
+  args = flags.parse_args(argv)
+
+  if not (args.profile or args.flamegraph):
+    session(args)
+    return
+
+  p = profiler.Profiler()
   try:
-    repl()
+    with p:
+      session(args)
+  finally:
+    p.report(sys.stderr)
+    if args.flamegraph:
+      with open(args.flamegraph, 'w') as f:
+        p.write_stacks(f)
+
+def session(args):
+  if args.run:
+    istream = sys.stdin if args.run == '-' else open(args.run)
+    try:
+      run(istream, sys.stdout, sys.stderr, collapse_every=args.collapse_every)
+    finally:
+      istream.close()
+    return
+
+  import pdb, traceback
+  if sys.stdin.isatty():
+    # line editing for the interactive session.
+    import readline
+
+  try:
+    repl(incremental=args.incremental)
   except:
     extype, value, tb = sys.exc_info()
     traceback.print_exc()
     pdb.post_mortem(tb)
 
+if __name__ == '__main__':
+  main(sys.argv[1:])
+
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+"""Runs many independent scripts on a pool of worker processes.
+
+  python runner.py [-j processes] [-t timeout] scripts_dir
+  python runner.py [-j processes] [-t timeout] - < scripts
+
+Each script runs from an empty context, one statement after another like
+lines typed into the repl, and its result is the value of its last
+statement. Scripts are read from the files in a directory, in order of their
+names, or from a stream where they're separated by lines that only hold ---.
+
+The scripts are parsed once, here, and shipped to the workers precompiled
+(see precompiled), in chunks. Results and errors come back in the order the
+scripts were given.
+"""
+import argparse
+import collections
+import multiprocessing
+import os
+import signal
+import sys
+
+import parser
+import infixlang
+import analysis
+import engines
+import precompiled
+
+SEPARATOR = '---'
+
+Result = collections.namedtuple('Result', 'name value error')
+
+
+class Timeout(Exception):
+  pass
+
+
+def read_directory(path):
+  """Yields the name and text of each file in a directory."""
+  for name in sorted(os.listdir(path)):
+    filename = os.path.join(path, name)
+    if os.path.isfile(filename):
+      with open(filename) as f:
+        yield name, f.read()
+
+def read_stream(stream):
+  """Yields a name and the text of each script in a stream."""
+  lines = []
+  count = 0
+  for line in stream:
+    if line.strip() == SEPARATOR:
+      yield 'script %d' % count, ''.join(lines)
+      lines = []
+      count += 1
+    else:
+      lines.append(line)
+  if any(not line.isspace() for line in lines):
+    yield 'script %d' % count, ''.join(lines)
+
+
+# ----- The workers.
+
+def start_worker():
+  if hasattr(signal, 'setitimer'):
+    signal.signal(signal.SIGALRM, raise_timeout)
+
+def raise_timeout(signum, frame):
+  raise Timeout()
+
+def run_precompiled(job):
+  """Runs a precompiled script. Returns its value and None, or None and an
+  error message."""
+  data, engine, timeout = job
+  evaluate = engines.ENGINES[engine]
+  timer = timeout and hasattr(signal, 'setitimer')
+  if timer:
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+  try:
+    context = infixlang.Context()
+    trees = precompiled.loads(data)
+    # only the value of the last statement is returned, so each statement
+    # only needs to leave behind the bindings the ones after it can read.
+    for tree, names in zip(trees, analysis.live_variables(trees)):
+      context = evaluate(tree, context).collapse(names)
+    return printable(context.val), None
+  except Timeout:
+    return None, 'Timed out after %gs' % timeout
+  except (infixlang.Error, Exception) as e:
+    return None, str(e) or type(e).__name__
+  finally:
+    if timer:
+      signal.setitimer(signal.ITIMER_REAL, 0)
+
+def printable(val):
+  # contexts and parse trees are big, and only make sense in this process.
+  if val is None or type(val) in (int, long, bool):
+    return val
+  return str(val)
+
+
+# ----- Spreading scripts over the workers.
+
+def run_scripts(scripts, processes=None, timeout=None, engine='tree',
+                chunksize=None):
+  """Runs (name, text) scripts on a pool of processes. Returns a list of
+  Results in the order of the scripts.
+
+  timeout is the number of seconds each script may run for. It's enforced
+  where the platform has interval timers.
+  """
+  names, jobs, results = [], [], []
+  # scripts are often copies of each other, so each text is parsed once.
+  compiled = {}
+  for name, text in scripts:
+    names.append(name)
+    if text not in compiled:
+      try:
+        compiled[text] = precompiled.dumps(precompiled.parse_statements(text))
+      except parser.ParseError as e:
+        compiled[text] = e
+    if isinstance(compiled[text], parser.ParseError):
+      results.append(Result(name, None, str(compiled[text])))
+      continue
+    results.append(None)
+    jobs.append((compiled[text], engine, timeout))
+
+  pool = multiprocessing.Pool(processes, initializer=start_worker)
+  try:
+    if chunksize is None:
+      # a few chunks per worker, so fast workers can pick up the slack.
+      chunksize = max(1, len(jobs) // (4 * (processes or
+                                            multiprocessing.cpu_count())))
+    outcomes = pool.imap(run_precompiled, jobs, chunksize)
+    for i, name in enumerate(names):
+      if results[i] is None:
+        value, error = next(outcomes)
+        results[i] = Result(name, value, error)
+  finally:
+    pool.terminate()
+    pool.join()
+  return results
+
+
+def main(argv):
+  flags = argparse.ArgumentParser(
+      description='Run infixlang scripts on a pool of processes.')
+  flags.add_argument('scripts',
+                     help='a directory of scripts, or - to read them from '
+                     'stdin, separated by lines of %s.' % SEPARATOR)
+  flags.add_argument('-j', '--processes', type=int,
+                     help='defaults to the number of cores.')
+  flags.add_argument('-t', '--timeout', type=float,
+                     help='the seconds each script may run for.')
+  flags.add_argument('-c', '--chunksize', type=int,
+                     help='the number of scripts to send a worker at once.')
+  flags.add_argument('-e', '--engine', default='tree',
+                     choices=sorted(engines.ENGINES))
+  args = flags.parse_args(argv)
+
+  if args.scripts == '-':
+    scripts = read_stream(sys.stdin)
+  else:
+    scripts = read_directory(args.scripts)
+
+  failed = False
+  for result in run_scripts(scripts, args.processes, args.timeout,
+                            args.engine, args.chunksize):
+    if result.error is not None:
+      failed = True
+      print '%s: error: %s' % (result.name,
+                               result.error.strip().replace('\n', '\n  '))
+    else:
+      print '%s: %s' % (result.name, result.value)
+  return 1 if failed else 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,92 @@
+"""Runs many evaluations in one process, a slice of steps at a time.
+
+  scheduler = Scheduler(max_steps=10 ** 6)
+  scheduler.submit(tree, context)
+  for task in scheduler.run():
+    task.result, task.error
+
+Each task is a trampoline.Evaluation, which can stop after a number of steps
+and pick up from there later. run_slice() runs one task for a slice of SLICE
+steps, so a task that runs away only holds up the others for a slice at a
+time, and fails when it reaches the limits it's given.
+
+Tasks that haven't had a slice yet go first, and the ones that have take
+turns. So a short task waits for at most one slice of a long one, and for
+the other new tasks ahead of it, however many long tasks there are. Long
+tasks only wait while new ones keep coming.
+"""
+import collections
+import time
+
+import infixlang
+import runner
+import trampoline
+
+# steps per slice. a few milliseconds.
+SLICE = 1000
+
+
+class Task(object):
+  """An evaluation, and once it's done, its result or error.
+
+  data is anything the caller wants to keep with the task.
+  """
+
+  def __init__(self, evaluation, deadline=None, data=None):
+    self.evaluation = evaluation
+    self.deadline = deadline
+    self.data = data
+    self.result = None
+    self.error = None
+
+  @property
+  def steps(self):
+    return self.evaluation.steps
+
+
+class Scheduler(object):
+  def __init__(self, slice=SLICE, max_steps=None, max_frames=None):
+    self.slice = slice
+    self.max_steps = max_steps
+    self.max_frames = max_frames
+    # the tasks that haven't run yet, and the ones that have and aren't done.
+    self.fresh = collections.deque()
+    self.running = collections.deque()
+
+  def __len__(self):
+    return len(self.fresh) + len(self.running)
+
+  def submit(self, tree, context, deadline=None, data=None):
+    """Adds a task that evaluates tree in context. deadline is a time.time()
+    after which it fails with a runner.Timeout."""
+    task = Task(trampoline.Evaluation(tree, context, self.max_steps,
+                                      self.max_frames), deadline, data)
+    self.fresh.append(task)
+    return task
+
+  def run_slice(self):
+    """Runs the next task for a slice. Returns it if it's done, or None."""
+    queue = self.fresh or self.running
+    if not queue:
+      return None
+    task = queue.popleft()
+    try:
+      task.result = task.evaluation.run(self.slice)
+    except (infixlang.Error, Exception) as e:
+      task.error = e
+      return task
+    if task.evaluation.done:
+      return task
+    if task.deadline is not None and time.time() > task.deadline:
+      task.error = runner.Timeout()
+      return task
+    self.running.append(task)
+    return None
+
+  def run(self):
+    """Runs the tasks until they're all done. Yields each one as it's
+    done."""
+    while self:
+      task = self.run_slice()
+      if task is not None:
+        yield task
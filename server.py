@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+"""Serves infixlang sessions over a socket.
+
+  python server.py [--port N | --unix PATH] [-j workers] [-t timeout]
+                   [--max-steps N] [--max-frames N]
+
+Each connection is a session with its own global context, like a repl. The
+protocol is a line per statement, and the server answers each line in order
+with one of
+
+  ok               the statement has no value.
+  ok VALUE         its value.
+  error MESSAGE    it failed, and the session's context is unchanged.
+
+The event loop only moves lines between the sockets and a pool of worker
+processes, so a long evaluation doesn't hold up the other sessions. The
+contexts live in the workers, and each session always runs on the same
+worker, which evaluates its statements in order.
+
+Each worker evaluates the statements of all its sessions a slice of steps at
+a time (see scheduler), so a statement that runs for long only holds up the
+short statements of the other sessions for a slice at a time. The answers
+are the same as the repl's, except that statements too deep for eval() work.
+With --max-steps and --max-frames, statements that take more steps, or nest
+more calls that aren't tail calls, fail instead of running away.
+
+A session can send lines without waiting for their answers, but the server
+stops reading from it while it has --pipeline statements waiting, or while
+its worker has --backlog statements waiting, and the kernel's buffers push
+back on the client from there. With -t, a statement that hasn't finished
+that many seconds after the server read it, including the time it spent
+waiting for its worker, fails with a timeout. Evaluations look at the time
+between slices.
+
+See loadtest for a client that measures the server's latency.
+"""
+import argparse
+import asynchat
+import asyncore
+import collections
+import multiprocessing
+import os
+import resource
+import select
+import signal
+import socket
+import sys
+import time
+
+import infixlang
+import runner
+import scheduler
+
+# the statements a session, and all the sessions of a worker, can have
+# waiting before the server stops reading from them.
+PIPELINE = 16
+BACKLOG = 1024
+
+# the longest line the server reads.
+MAX_LINE = 65536
+
+
+def raise_file_limit():
+  """Lets the process open as many files as it's allowed to, so it can have
+  thousands of sockets open."""
+  soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+  if soft < hard:
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def reply(val):
+  """Returns the line that answers a statement with the value val."""
+  if val is None:
+    return 'ok'
+  return 'ok ' + one_line(str(runner.printable(val)))
+
+def error_reply(message):
+  return 'error ' + one_line(message)
+
+def one_line(text):
+  # messages end with stacktraces, which don't fit the protocol.
+  lines = text.strip().splitlines()
+  return lines[0] if lines else ''
+
+
+# ----- The workers.
+#
+# the server talks to each worker over a socket pair, a line per message, so
+# its end is one more channel of the event loop, and the loop never blocks on
+# a worker that's busy.
+#
+#   SESSION DEADLINE SOURCE    evaluate SOURCE in the session's context.
+#                              DEADLINE is a time.time(), or - for none.
+#   SESSION                    the session is over.
+#
+# workers answer with SESSION ANSWER lines.
+
+def serve_worker(sock, inherited=(), max_steps=None, max_frames=None):
+  """Evaluates the statements sent over sock, and sends back the answers,
+  until sock is closed."""
+  # the ends of the other workers' sockets that the server holds. they'd
+  # keep those workers from seeing the server close them.
+  for other in inherited:
+    other.close()
+  # a ^C in the server's terminal is for the server, which stops the
+  # workers.
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+  sessions = Sessions(scheduler.Scheduler(max_steps=max_steps,
+                                          max_frames=max_frames))
+  data = ''
+  while True:
+    # only wait for lines when there's nothing to evaluate.
+    timeout = 0 if sessions.scheduler else None
+    answers = []
+    if select.select([sock], [], [], timeout)[0]:
+      chunk = sock.recv(65536)
+      if not chunk:
+        return
+      lines = (data + chunk).split('\n')
+      data = lines.pop()
+      for line in lines:
+        answers.extend(sessions.handle(line))
+    answers.extend(sessions.run_slice())
+    if answers:
+      sock.sendall(''.join('%d %s\n' % answer for answer in answers))
+
+
+class Sessions(object):
+  """The contexts of the sessions of a worker, and their statements.
+
+  Each session has at most one statement on the scheduler at a time, which
+  evaluates in the context the statement before it left. The others wait
+  their turn in queues. Methods return the (session, answer) pairs that are
+  ready.
+  """
+
+  def __init__(self, scheduler):
+    self.scheduler = scheduler
+    self.contexts = {}
+    # the statements waiting behind the one each session has on the
+    # scheduler. None stands for the end of the session.
+    self.queues = {}
+
+  def handle(self, line):
+    fields = line.split(' ', 2)
+    session = int(fields[0])
+    if len(fields) == 1:
+      item = None
+    else:
+      item = (fields[2], None if fields[1] == '-' else float(fields[1]))
+    if session in self.queues:
+      self.queues[session].append(item)
+      return []
+    self.queues[session] = collections.deque([item])
+    answers = []
+    self.advance(session, answers)
+    return answers
+
+  def run_slice(self):
+    task = self.scheduler.run_slice()
+    if task is None:
+      return []
+    session = task.data
+    if task.error is not None:
+      answers = [(session, error_answer(task.error))]
+    else:
+      self.contexts[session] = task.result.collapse()
+      answers = [(session, reply(task.result.val))]
+    self.advance(session, answers)
+    return answers
+
+  def advance(self, session, answers):
+    """Puts the next statement of a session on the scheduler, answering the
+    ones that fail before they start."""
+    queue = self.queues[session]
+    while queue:
+      item = queue.popleft()
+      if item is None:
+        self.contexts.pop(session, None)
+        continue
+      source, deadline = item
+      if deadline is not None and time.time() > deadline:
+        answers.append((session, error_reply('Timed out before it started')))
+        continue
+      try:
+        tree, tokens = infixlang.parse_cache.parse(source)
+      except (infixlang.Error, Exception) as e:
+        answers.append((session, error_answer(e)))
+        continue
+      if tokens:
+        answers.append((session, error_reply(
+            'Stuff unparsed on the line: %s' % (tokens,))))
+        continue
+      context = self.contexts.get(session) or infixlang.Context()
+      self.scheduler.submit(tree, context, deadline, session)
+      return
+    del self.queues[session]
+
+def error_answer(e):
+  if isinstance(e, runner.Timeout):
+    return error_reply('Timed out')
+  return error_reply(str(e) or type(e).__name__)
+
+
+class Worker(asynchat.async_chat):
+  """The server's end of the socket to a worker process."""
+
+  def __init__(self, server):
+    sock, child = socket.socketpair()
+    inherited = [sock] + [worker.socket for worker in server.workers]
+    self.process = multiprocessing.Process(
+        target=serve_worker,
+        args=(child, inherited, server.max_steps, server.max_frames))
+    self.process.daemon = True
+    self.process.start()
+    child.close()
+
+    asynchat.async_chat.__init__(self, sock, map=server.map)
+    self.server = server
+    self.lines = []
+    # the statements sent and not answered yet.
+    self.waiting = 0
+    self.set_terminator('\n')
+
+  def submit(self, session, source, deadline):
+    if source is None:
+      self.push('%d\n' % session)
+      return
+    self.push('%d %s %s\n' % (session, '-' if deadline is None
+                              else repr(deadline), source))
+    self.waiting += 1
+
+  def collect_incoming_data(self, data):
+    self.lines.append(data)
+
+  def found_terminator(self):
+    number, answer = ''.join(self.lines).split(' ', 1)
+    self.lines = []
+    self.waiting -= 1
+    session = self.server.sessions.get(int(number))
+    if session is not None:
+      session.answer(answer)
+
+  def handle_close(self):
+    # the worker died.
+    self.server.close()
+
+  def close(self):
+    # the worker stops when it reads the end of the socket.
+    asynchat.async_chat.close(self)
+    self.process.join(1)
+    if self.process.is_alive():
+      self.process.terminate()
+
+
+# ----- The sessions.
+
+class Session(asynchat.async_chat):
+  def __init__(self, server, sock, number):
+    asynchat.async_chat.__init__(self, sock, map=server.map)
+    self.server = server
+    self.number = number
+    self.worker = server.workers[number % len(server.workers)]
+    self.lines = []
+    self.length = 0
+    # the statements sent to the worker and not answered yet.
+    self.waiting = 0
+    self.set_terminator('\n')
+
+  def readable(self):
+    return (self.waiting < self.server.pipeline and
+            self.worker.waiting < self.server.backlog and
+            len(self.producer_fifo) < self.server.pipeline)
+
+  def collect_incoming_data(self, data):
+    if self.length > MAX_LINE:
+      # the session is closing.
+      return
+    self.length += len(data)
+    if self.length > MAX_LINE:
+      self.push(error_reply('Line too long') + '\n')
+      self.close_when_done()
+      return
+    self.lines.append(data)
+
+  def found_terminator(self):
+    source = ''.join(self.lines)
+    self.lines = []
+    self.length = 0
+    if not source or source.isspace():
+      return
+    deadline = None
+    if self.server.timeout:
+      deadline = time.time() + self.server.timeout
+    self.waiting += 1
+    self.worker.submit(self.number, source, deadline)
+
+  def answer(self, line):
+    self.waiting -= 1
+    self.push(line + '\n')
+
+  def handle_close(self):
+    self.close()
+
+  def close(self):
+    if self.server.sessions.pop(self.number, None) is not None:
+      # the worker forgets the session's context after answering the
+      # statements it has waiting.
+      self.worker.submit(self.number, None, None)
+    asynchat.async_chat.close(self)
+
+
+class Server(asyncore.dispatcher):
+  """Listens on address, a path for a unix socket, or a (host, port)
+  tuple."""
+
+  def __init__(self, address, workers=None, timeout=None, pipeline=PIPELINE,
+               backlog=BACKLOG, max_steps=None, max_frames=None):
+    self.map = {}
+    asyncore.dispatcher.__init__(self, map=self.map)
+    self.timeout = timeout
+    self.max_steps = max_steps
+    self.max_frames = max_frames
+    self.pipeline = pipeline
+    self.backlog = backlog
+    self.sessions = {}
+    self.count = 0
+    self.running = False
+    # the workers are started first, so they don't inherit the socket.
+    self.workers = []
+    for _ in xrange(workers or multiprocessing.cpu_count()):
+      self.workers.append(Worker(self))
+
+    if isinstance(address, basestring):
+      if os.path.exists(address):
+        os.unlink(address)
+      self.create_socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+      self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+      self.set_reuse_addr()
+    self.bind(address)
+    # socket.SOMAXCONN is often lower than the kernel's limit, which caps
+    # this anyway.
+    self.listen(4096)
+    self.address = self.socket.getsockname()
+
+  def handle_accept(self):
+    # accept every connection that's waiting, not one per turn of the loop,
+    # or a burst of them waits on the loop's other work.
+    while True:
+      pair = self.accept()
+      if pair is None:
+        return
+      sock, _ = pair
+      self.sessions[self.count] = Session(self, sock, self.count)
+      self.count += 1
+
+  def serve_forever(self, poll_interval=0.5):
+    """Serves until close() is called."""
+    self.running = True
+    while self.running:
+      asyncore.loop(poll_interval, use_poll=True, map=self.map, count=1)
+
+  def stop(self):
+    """Makes serve_forever() return."""
+    self.running = False
+
+  def close(self):
+    self.running = False
+    for session in self.sessions.values():
+      session.close()
+    for worker in self.workers:
+      worker.close()
+    self.workers = []
+    asyncore.dispatcher.close(self)
+    if isinstance(self.address, basestring) and os.path.exists(self.address):
+      os.unlink(self.address)
+
+
+def main(argv):
+  flags = argparse.ArgumentParser(description='Serve infixlang sessions.')
+  flags.add_argument('--port', type=int, default=7000,
+                     help='the TCP port to listen on, on localhost.')
+  flags.add_argument('--unix', metavar='PATH',
+                     help='listen on a unix socket instead.')
+  flags.add_argument('-j', '--workers', type=int,
+                     help='the number of worker processes. defaults to the '
+                     'number of cores.')
+  flags.add_argument('-t', '--timeout', type=float,
+                     help='the seconds each statement may take.')
+  flags.add_argument('--pipeline', type=int, default=PIPELINE,
+                     help='the statements a session can have waiting.')
+  flags.add_argument('--backlog', type=int, default=BACKLOG,
+                     help='the statements a worker can have waiting.')
+  flags.add_argument('--max-steps', type=int,
+                     help='the steps each statement may take.')
+  flags.add_argument('--max-frames', type=int,
+                     help='the stack frames each statement may use.')
+  args = flags.parse_args(argv)
+  raise_file_limit()
+
+  address = args.unix or ('127.0.0.1', args.port)
+  server = Server(address, args.workers, args.timeout, args.pipeline,
+                  args.backlog, args.max_steps, args.max_frames)
+  print >>sys.stderr, 'Serving on', server.address
+  signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.close()
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
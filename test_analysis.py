@@ -0,0 +1,64 @@
+import analysis
+import infixlang
+import precompiled
+from testing import parse
+
+C = infixlang.Context
+
+def test_free_variables():
+  def free(string):
+    return analysis.free_variables(parse(string))
+  assert free('a + b * 2') == ('a', 'b')
+  assert free('a = 1, a + b') == ('b',)
+  assert free('a = a + 1') == ('a',)
+  # the body of f might be called before x is bound.
+  assert free('f ~ (x + y), x = 1, f') == ('x', 'y')
+  assert free('cond = 1, if') == ('else', 'then')
+  assert free('map = map_new, key = 1 map_get') == ()
+  assert free('(a=1, b) a') == ('a', 'b')
+  assert free('a = this') is None
+
+def test_link_bodies():
+  bodies = analysis.link_bodies(parse('f ~ (g ~ x, y) a = (h ~ z)'))
+  assert sorted(repr(b) for b in bodies) == ['( g ~ x , y )', 'x', 'z']
+
+def test_live_variables():
+  statements = precompiled.parse_statements("""
+    a = 1
+    b = a + 1
+    f ~ (b * c)
+    c = 3
+    d = 4
+    e = f
+  """)
+  live = analysis.live_variables(statements)
+  # f's body reads b and c, so they're live all along.
+  assert live == [frozenset(names) for names in (
+      'abcf', 'bcf', 'bcf', 'bcf', 'bcf', 'bc')]
+
+  # the names read from a context captured with this are in the program too.
+  assert analysis.live_variables(precompiled.parse_statements(
+      's = (a = 1, this)\nb = 2\n(s a)')) == [
+          frozenset('as'), frozenset('as'), frozenset()]
+
+  # this reads every binding made before it.
+  assert analysis.live_variables(precompiled.parse_statements(
+      'a = 1\nb = 2\nthis\nc = a')) == [None, None, frozenset('a'), frozenset()]
+
+def test_pruned_program():
+  source = """
+    iterate ~ (i=i+1, sum=sum+i, stop=(i==8), this)
+    iterator = (i=0 sum=0 iterate)
+    iterator = (iterator iterate)
+    tmp = 5 * 5
+    x = tmp + 1
+    (iterator sum) + x
+  """
+  statements = precompiled.parse_statements(source)
+  context = C()
+  for tree, names in zip(statements, analysis.live_variables(statements)):
+    context = tree.eval(context).collapse(names)
+    if names is not None:
+      assert set(context.bindings.keys()) <= names
+  assert context.val == precompiled.run_statements(statements).val == 29
+  assert 'tmp' not in context
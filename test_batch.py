@@ -0,0 +1,66 @@
+import pytest
+
+import infixlang
+import batch
+from testing import parse
+
+C = infixlang.Context
+
+def define(string):
+  return parse(string).eval(C())
+
+def rows(columns):
+  names = sorted(columns)
+  return [dict(zip(names, row)) for row in zip(*[columns[n] for n in names])]
+
+def check(tree, columns, context=None):
+  # batch evaluation agrees with evaluating each row with eval().
+  context = context or C()
+  expected = [tree.eval(C(parent=context, slots=row)).val
+              for row in rows(columns)]
+  assert list(batch.evaluate(tree, columns, context)) == expected
+  assert batch.evaluate_rows(tree, columns, context) == expected
+  return expected
+
+COLUMNS = {'a': range(-20, 20), 'b': range(40, 0, -1)}
+
+@pytest.mark.parametrize('string', [
+    'a + b', 'a * b - 3', 'a / 3', '(a == b) + 1', 'a == 3', '7',
+    'x = a + 1, x * 2', 'c ~ (a * 2) c + c',
+    '(cond=(a == 3) then=1 else=2 if)',
+    '(cond=a then~(a + b) if)',
+    ])
+def test_matches_eval(string):
+  check(parse(string), COLUMNS)
+
+def test_functions():
+  context = define("""
+    func ~ a + b
+    factorial ~ (then ~ i*(i=i-1 factorial) else=1 cond=i if)
+    """)
+  check(parse('func'), COLUMNS, context)
+  check(parse('i=a factorial'), {'a': range(15)}, context)
+
+def test_fallback():
+  context = define('f ~ this')
+  # this, division by zero and integers too large for numpy are all
+  # evaluated a row at a time.
+  check(parse('(f a)'), {'a': [1, 2]}, context)
+  check(parse('a * a'), {'a': [2 ** 40, 2 ** 62]})
+  with pytest.raises(ZeroDivisionError):
+    batch.evaluate(parse('1 / a'), {'a': [1, 0]})
+  with pytest.raises(infixlang.UnknownVariableError):
+    batch.evaluate(parse('a + z'), {'a': [1, 0]})
+
+def test_vectorized():
+  numpy = pytest.importorskip('numpy')
+  columns = {'a': numpy.arange(100000), 'b': numpy.arange(100000)}
+  result = batch.Vectorizer(C()).evaluate(parse('a * 2 + b'), columns)
+  assert (result == 3 * numpy.arange(100000)).all()
+
+  result = batch.Vectorizer(C()).evaluate(
+      parse('cond=(a == 5) then=1 else=0 if'), columns)
+  assert result.sum() == 1 and result[5] == 1
+
+  with pytest.raises(batch.Unsupported):
+    batch.Vectorizer(C()).evaluate(parse('this'), columns)
@@ -0,0 +1,32 @@
+import infixlang
+import closure_compiler
+import testing
+from testing import parse
+
+C = infixlang.Context
+
+# run the evaluator's test suite with the compiler in place of eval().
+test_infixlang_suite = testing.engine_suite(closure_compiler.evaluate)
+
+def test_same_results():
+  for string in ['2+3*4 == 14',
+                 'a = 2 * 3, c = (b = a + 2, 2*b)',
+                 'con = (a=1, (b=2, this)) (c=3, con, a+b+c)',
+                 'cond=0 then=1 if',
+                 'cond ~ (x=0) then=1 else~x if']:
+    tree = parse(string)
+    expected = tree.eval(C())
+    compiled = closure_compiler.evaluate(tree, C())
+    assert compiled.val == expected.val
+    assert compiled.dictify().keys() == expected.dictify().keys()
+
+def test_compiled_once():
+  tree = parse("""
+    factorial ~ (then ~ i*(i=i-1 factorial) else=1 cond=i if)
+    (i=5 factorial)
+    """)
+  body = tree.val[0].val[2]
+  assert closure_compiler.evaluate(tree, C()).val == 120
+  closure = body.closure
+  assert closure_compiler.evaluate(tree, C()).val == 120
+  assert body.closure is closure
@@ -0,0 +1,112 @@
+import random
+
+import pytest
+
+import bench
+import incremental
+import infixlang
+import parser
+
+def shape(node):
+  if node is None:
+    return None
+  if isinstance(node, parser.Terminal):
+    return (type(node).__name__, node.val, node.start, node.end)
+  return (type(node).__name__, [shape(child) for child in node.val])
+
+def token_shapes(tokens):
+  return [shape(token) for token in tokens]
+
+def assert_matches_full_parse(source):
+  tokens = infixlang.tokenize(source.text)
+  assert token_shapes(source.tokens) == token_shapes(tokens)
+  tree, rest = None, tokens
+  if tokens:
+    tree, rest = infixlang.expr_sequence.parse(tokens, {})
+  assert shape(source.tree) == shape(tree)
+  assert token_shapes(source.rest) == token_shapes(rest)
+
+def parses(text):
+  try:
+    tokens = infixlang.tokenize(text)
+    if tokens:
+      infixlang.expr_sequence.parse(tokens, {})
+  except parser.ParseError:
+    return False
+  return True
+
+@pytest.mark.parametrize('text', [
+    '', 'a = 1', 'a = 1, b = 2,', 'a = 1 b = 2 *',
+    bench.FACTORIAL % 5, bench.WHILE % 5])
+def test_same_as_full_parse(text):
+  assert_matches_full_parse(incremental.Source(text))
+
+def test_edits():
+  source = incremental.Source('a = 1\nb = a + 2\n')
+  source.edit(4, 5, '10')
+  assert source.text == 'a = 10\nb = a + 2\n'
+  assert_matches_full_parse(source)
+  # appending extends the last statement.
+  source.edit(len(source.text), len(source.text), ' * 3')
+  assert_matches_full_parse(source)
+  assert source.statements[-1].end == len(source.text)
+  # a trailing comma is left in the rest, until a statement follows it.
+  source.edit(len(source.text), len(source.text), ',')
+  assert_matches_full_parse(source)
+  assert len(source.rest) == 1
+  source.edit(len(source.text), len(source.text), 'c = 4')
+  assert_matches_full_parse(source)
+  assert not source.rest
+
+def test_failures():
+  source = incremental.Source('a = 1\nb = 2\nc = 3\n')
+  # a statement that doesn't parse ends the sequence, and the tokens from
+  # there on are the rest.
+  source.edit(10, 11, '*')
+  assert_matches_full_parse(source)
+  # a = 1, and b.
+  assert len(source.statements) == 2
+  source.edit(10, 11, '2')
+  assert_matches_full_parse(source)
+  assert len(source.statements) == 3
+
+  # edits that don't parse or tokenize change nothing.
+  for start, end, replacement in [(0, 1, ')'), (2, 3, '^')]:
+    with pytest.raises(parser.ParseError):
+      source.edit(start, end, replacement)
+    assert source.text == 'a = 1\nb = 2\nc = 3\n'
+    assert_matches_full_parse(source)
+
+def test_random_edits():
+  rng = random.Random(2)
+  pieces = ['a', 'b', '12', ' ', '\n', '=', '+', '*', '==', '~', '(', ')',
+            ',', 'if', 'x = 1 ', '(a, b)', 'f ~ a + 1\n', ' - ', 'this']
+  for _ in xrange(30):
+    source = incremental.Source('a = 1\nb = a + 2\nc ~ (b * 3, a)\n'
+                                'd = (a=2 c)\n')
+    for _ in xrange(20):
+      start = rng.randint(0, len(source.text))
+      end = min(len(source.text), start + rng.choice([0, 1, 2, 5]))
+      replacement = ''.join(rng.choice(pieces)
+                            for _ in xrange(rng.choice([0, 1, 2])))
+      text = source.text[:start] + replacement + source.text[end:]
+      if parses(text):
+        source.edit(start, end, replacement)
+      else:
+        with pytest.raises(parser.ParseError):
+          source.edit(start, end, replacement)
+      assert_matches_full_parse(source)
+
+def test_edit_cost_is_proportional_to_edit():
+  n = 2000
+  text = ''.join('v%d = v%d + %d\n' % (i, i, i) for i in xrange(n))
+  source = incremental.Source(text)
+  assert source.parsed == n
+  middle = text.index('v1000 =')
+  source.edit(middle, middle + len('v1000'), 'w')
+  assert source.lexed == 1 and source.parsed <= 2
+  source.edit(middle, middle, '(x = 1)\n')
+  assert source.lexed <= 7 and source.parsed <= 3
+  assert len(source.statements) == n + 1
+  statement = source.statements[1000]
+  assert source.text[statement.start:statement.end] == '(x = 1)'
@@ -30,6 +30,55 @@ def parse(production_rule_root, stream):
 
 
 
+def test_context_bindings():
+  c = C(slots={'a': 1, 'b': 2})
+  c = C(parent=c, slots={'b': 3})
+  c = C(parent=c, val=4)
+  assert (c['a'], c['b']) == (1, 3)
+  assert 'a' in c and 'z' not in c
+  assert c.dictify() == {'a': 1, 'b': 3}
+  assert c['this'] is c
+  try:
+    c['z']
+    assert False
+  except infixlang.UnknownVariableError:
+    pass
+
+  inner = C(slots={'b': 10, 'c': 11})
+  chained = c.chain(inner)
+  assert chained.dictify() == {'a': 1, 'b': 10, 'c': 11}
+  assert chained.val is inner and chained.parent is c
+
+  collapsed = chained.collapse()
+  assert collapsed.parent is None and collapsed.val is inner
+  assert collapsed.dictify() == chained.dictify()
+
+
+def test_compact_objects():
+  c = C(slots={'a': 1})
+  v = infixlang.ValueContext(c, 2)
+  assert v.val == 2 and v.parent is c and v['a'] == 1
+  assert v.bindings is c.bindings and not v.slots
+
+  tree, _ = infixlang.expr_sequence.parse(T('a=1 (a+2)'))
+  for obj in [c, v, tree, tree.val[0], tree.val[0].val[0]]:
+    assert not hasattr(obj, '__dict__')
+
+
+def test_deep_context_chain():
+  c = C(slots={'x': 0})
+  for i in xrange(1, 50000):
+    c = C(parent=c, slots={'y': i})
+  assert c['x'] == 0 and c['y'] == 49999
+
+  try:
+    c['z']
+    assert False
+  except infixlang.UnknownVariableError as e:
+    assert len(repr(e).split('\n')) == 50000 + 2
+    assert len(e.context.stacktrace(max_depth=2).split('\n')) == 3
+
+
 def test_tokenize():
   def check(string):
     stringified = ''.join(str(tok) for tok in T(string))
@@ -48,6 +97,20 @@ def test_tokenize():
 
   print 'OK tokenize'
 
+def test_tokenize_offsets():
+  string = 'foo = 23 * 2\n  bar=(foo==46)'
+  tokens = T(string)
+  assert [string[tok.start:tok.end] for tok in tokens] == [
+      'foo', '=', '23', '*', '2', 'bar', '=', '(', 'foo', '==', '46', ')']
+
+def test_tokenize_single_terminal():
+  tok, rest = infixlang.integer.tokenize('12+3')
+  assert tok.val == 12 and rest == '+3'
+  tok, rest = infixlang.variable.tokenize('a_1 b')
+  assert tok.val == 'a_1' and rest == ' b'
+  tok, rest = infixlang.op_equality.tokenize('+3')
+  assert tok is None and rest == '+3'
+
 
 def test_parse():
   def check(string, expected_value):
@@ -69,6 +132,120 @@ def test_parse():
   print 'OK parse'
 
 
+def test_packrat_parse():
+  for string in ['2+3*4 == 14',
+                 'a = 2* 3, c = (b = a + 2, 2*b)',
+                 'factorial ~ (then ~ i*(i=i-1 factorial) else=1 cond=i if)',
+                 '((((1+2)*3)-4)/5) x=(a b c)']:
+    tokens = T(string)
+    p, rest = infixlang.expr_sequence.parse(tokens)
+    memo_p, memo_rest = infixlang.expr_sequence.parse(tokens, memo={})
+    assert repr(p) == repr(memo_p)
+    assert rest == memo_rest
+
+def test_packrat_deep_nesting():
+  depth = 40
+  tokens = T('(' * depth + '1' + '+1)' * depth)
+  memo = {}
+  p, rest = infixlang.expr_sequence.parse(tokens, memo=memo)
+  assert not rest
+  assert p.eval(C()).val == depth + 1
+  # each rule is tried at most once per position.
+  assert len(memo) <= len(tokens) * 20
+
+def test_parse_cache():
+  cache = parser.ParseCache(infixlang.tokenize, infixlang.expr_sequence,
+                            maxsize=2)
+  tree, rest = cache.parse('a = 1 + 2')
+  assert rest == [] and (cache.hits, cache.misses) == (0, 1)
+  assert cache.parse('  a  =  1 +\t2\n')[0] is tree
+  assert (cache.hits, cache.misses) == (1, 1)
+
+  # the least recently used entry goes first.
+  cache.parse('b = 1')
+  cache.parse('a = 1 + 2')
+  cache.parse('c = 1')
+  assert len(cache) == 2
+  assert cache.parse('a = 1 + 2')[0] is tree
+  assert cache.parse('b = 1')[0] is not None
+  assert (cache.hits, cache.misses) == (3, 4)
+
+  # the cached tree evaluates like a fresh one.
+  assert tree.eval(C())['a'] == 3
+
+  try:
+    cache.parse('= 1')
+    assert False
+  except parser.ParseError as e:
+    assert e.original_stream is not None
+  assert cache.misses == 5 and '= 1' not in cache.entries
+
+
+def test_token_stream():
+  tokens = T('a = 2 * 3')
+  stream = parser.TokenStream(tokens)
+  assert len(stream) == 5 and stream[0] is tokens[0] and stream[-1] is tokens[-1]
+  rest = stream[2:]
+  assert rest.pos == 2 and rest.tokens is tokens
+  assert rest == tokens[2:]
+  assert not stream[5:] and not stream[7:]
+
+  p, rest = infixlang.expr.parse(stream)
+  assert isinstance(rest, parser.TokenStream) and not rest
+  p, rest = infixlang.expr.parse(tokens)
+  assert rest == []
+
+def test_parse_error_position():
+  tokens = T('a = 2 * ')
+  try:
+    parse(infixlang.expr, tokens)
+    assert False
+  except parser.ParseError as e:
+    assert e.stream == tokens[3:]
+    assert str(e).startswith("Couldn't parse the entire stream\nError at token 3:")
+
+  stream = parser.TokenStream(tokens, 1)
+  e = parser.ParseError(message='oops', stream=stream)
+  e.original_stream = tokens
+  assert e.position == 1
+  assert str(e) == 'oops\nError at token 1:\n=2*'
+
+def test_precedence_backend():
+  strings = ['2+3*4', '2 *  3 +4', '(2+3)*4', '(2+3) == 5', '2+3*4 == 14',
+             'a = 2* 3, c = (b = a + 2, 2*b), c']
+  descent = [parse(infixlang.expr_sequence, T(s)) for s in strings]
+  infixlang.set_parser_backend('precedence')
+  try:
+    precedence = [parse(infixlang.expr_sequence, T(s)) for s in strings]
+    # minus and divide are left associative.
+    assert parse(infixlang.expr, T('8-2-1')).eval(C()).val == 5
+    assert parse(infixlang.expr, T('8/2/2')).eval(C()).val == 2
+    assert parse(infixlang.expr, T('2*3-1-1 == 4')).eval(C()).val
+    # a dangling operator is left unparsed.
+    p, rest = infixlang.expr.parse(T('a = 2 *'))
+    assert repr(p) == 'a = 2' and len(rest) == 1
+  finally:
+    infixlang.set_parser_backend('descent')
+
+  for d, p in zip(descent, precedence):
+    assert repr(d) == repr(p)
+    assert type(d) == type(p)
+    assert d.eval(C()).val == p.eval(C()).val
+
+def test_precedence_backend_long_chain():
+  n = 10000
+  infixlang.set_parser_backend('precedence')
+  try:
+    p = parse(infixlang.expr_sequence, T('+'.join(['1'] * n)))
+  finally:
+    infixlang.set_parser_backend('descent')
+
+  depth = 1
+  while isinstance(p, infixlang.expr_plusminus):
+    p = p.val[0]
+    depth += 1
+  assert depth == n
+
 def test_assignment_1():
   context = parse(infixlang.expr, T('foo = 2 * 23')).eval(C())
   assert context['foo'] == 46
@@ -191,6 +368,13 @@ def test_context_9():
   except infixlang.UnknownVariableError:
     pass # it should raise.
 
+def test_context_10():
+  # this in a ~ body is the context it's called from, with its own slots.
+  context = parse(infixlang.expr_sequence,
+            T('f ~ this, s = (a=1, f)')).eval(C())
+  assert str(context['s']) == 'Context(None){a:1}'
+  assert context['s']['a'] == 1
+
 
 def test_if_1():
   tokens = T("""
@@ -404,3 +588,66 @@ def test_arrays():
   assert context['item_1'] == 10
   assert context['item_2'] == 20
   assert context['item_3'] == 30
+
+def test_native_maps():
+  tokens = T("""
+  mymap = map_new
+  mymap = (map=mymap key=1000 value=10 map_put)
+  mymap = (map=mymap key=2000 value=20 map_put)
+  old = mymap
+  mymap = (map=mymap key=3000 value=30 map_put)
+  mymap = (map=mymap key=1000 value=11 map_put)
+
+  item_1 = (map=mymap key=1000 map_get)
+  item_3 = (map=mymap key=3000 map_get)
+  old_1 = (map=old key=1000 map_get)
+  has_3 = (map=mymap key=3000 map_has)
+  old_has_3 = (map=old key=3000 map_has)
+  size = (map=mymap map_size)
+  removed_size = (map=(map=mymap key=2000 map_remove) map_size)
+  """)
+  context = parse(infixlang.expr_sequence, tokens).eval(C())
+  assert (context['item_1'], context['item_3'], context['old_1']) == (
+      11, 30, 10)
+  assert context['has_3'] and not context['old_has_3']
+  assert (context['size'], context['removed_size']) == (3, 2)
+
+def test_native_lists():
+  tokens = T("""
+  push ~ (list=mylist list_push)
+  mylist = list_new
+  mylist = (value=2 push)
+  mylist = (value=3 push)
+  old = mylist
+  mylist = (value=7 push)
+
+  item_0 = (list=mylist index=0 list_get)
+  item_2 = (list=mylist index=2 list_get)
+  changed = (list=mylist index=0 value=5 list_set)
+  changed_0 = (list=changed index=0 list_get)
+  size = (list=mylist list_size)
+  old_size = (list=old list_size)
+  popped_size = (list=(list=mylist list_pop) list_size)
+  """)
+  context = parse(infixlang.expr_sequence, tokens).eval(C())
+  assert (context['item_0'], context['item_2'], context['changed_0']) == (
+      2, 7, 5)
+  assert (context['size'], context['old_size'], context['popped_size']) == (
+      3, 2, 2)
+  assert list(context['mylist']) == [2, 3, 7]
+
+def test_builtin_errors():
+  for source in ['(map=map_new key=1 map_get)',
+                 '(map=1 key=1 map_get)',
+                 '(list=list_new index=0 list_get)',
+                 '(list=list_new list_pop)',
+                 '(list=map_new list_size)']:
+    try:
+      parse(infixlang.expr_sequence, T(source)).eval(C())
+      assert False, source
+    except infixlang.BuiltinError:
+      pass
+
+def test_builtin_names_are_words():
+  assert [type(t) for t in T('map_new map_newer list_size1')] == [
+      infixlang.builtin, infixlang.variable, infixlang.variable]
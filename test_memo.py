@@ -0,0 +1,77 @@
+import functools
+
+import pytest
+
+import infixlang
+import memo
+import testing
+from testing import parse
+
+C = infixlang.Context
+
+FIB = """
+  fib ~ (then=n else~((n=n-1 fib) + (n=n-2 fib)) cond=((n==0) + (n==1)) if)
+  """
+
+# run the evaluator's test suite with every call memoized.
+test_infixlang_suite = testing.infixlang_suite(
+    lambda monkeypatch: monkeypatch.setattr(
+        infixlang, 'call', functools.partial(memo.Memo().call, infixlang.call)))
+
+def test_fib():
+  program = FIB + '(n=20 fib)'
+  m = memo.Memo()
+  assert memo.evaluate(parse(program), C(), m).val == 6765
+  # each n is evaluated once.
+  assert m.misses < 50
+  assert m.hits < 50
+  assert m.skipped == 0
+
+def test_same_results():
+  for string in [FIB + '(n=10 fib)',
+                 FIB + 'n=10 fib',
+                 'f ~ (a = a + 1, b = a * 2) a = 1 f f a + b',
+                 'g ~ (x + y) f ~ (y = 2, g) x = 1 f (x = 5 f)',
+                 'count ~ (cnt = cnt + 1, this) cnt = 0 count count cnt',
+                 'f ~ (cond=flag then=1 if) flag=0 (f) (flag=1 f)',
+                 'f ~ (cond=flag then=1 else=2 if) flag=True (f) (flag=1 f)',
+                 ]:
+    tree = parse(string)
+    expected = tree.eval(C())
+    got = memo.evaluate(tree, C())
+    assert repr(got.val) == repr(expected.val), string
+    assert got.dictify().keys() == expected.dictify().keys(), string
+
+def test_replays_bindings():
+  # setx reads nothing, so every call shares one result, which has to bind x
+  # again on top of the caller's x.
+  m = memo.Memo()
+  context = memo.evaluate(parse(
+      'setx ~ x = 1  a = (x=1 setx x)  b = (x=5 setx x)'), C(), m)
+  assert (context['a'], context['b']) == (1, 1)
+  assert m.hits == 1
+
+def test_unmemoizable_calls():
+  m = memo.Memo()
+  context = memo.evaluate(parse(
+      'f ~ (a + 1) g ~ (this) h ~ map_size a = 1 x = f y = (g a) (map=map_new h)'),
+      C(), m)
+  assert context['x'] == 2
+  # g reads this, and the last call reads a map.
+  assert m.skipped == 2
+
+def test_eviction():
+  m = memo.Memo(maxsize=2)
+  tree = parse('f ~ (n * 2) a = (n=1 f) b = (n=2 f) c = (n=3 f) d = (n=1 f)')
+  context = memo.evaluate(tree, C(), m)
+  assert context['d'] == 2
+  assert len(m) == 2
+  assert (m.misses, m.hits, m.evictions) == (4, 0, 2)
+
+def test_errors():
+  call = infixlang.call
+  with pytest.raises(infixlang.UnknownVariableError):
+    memo.evaluate(parse('f ~ (a + 1) f'), C())
+  # the hook is restored.
+  assert infixlang.call is call
+  assert parse('f ~ 1, f').eval(C()).val == 1
@@ -0,0 +1,90 @@
+import sys
+
+import parser
+import infixlang
+import testing
+
+T = infixlang.tokenize
+C = infixlang.Context
+
+# the tests of test_infixlang that evaluate programs, as opposed to the ones
+# that look at the shape of parse trees.
+EVAL_TESTS = [
+    name for name in testing.SUITE
+    if name.startswith(('test_assignment', 'test_expr_sequence',
+                        'test_context', 'test_if', 'test_variable',
+                        'test_factorial', 'test_accumulate',
+                        'test_next_factorial', 'test_iterator',
+                        'test_while', 'test_lists', 'test_arrays'))]
+
+def optimize_parses(monkeypatch):
+  original_parse = parser.Rule.parse.im_func
+  def parse(cls, stream, memo=None):
+    tree, rest = original_parse(cls, stream, memo)
+    return infixlang.optimize(tree), rest
+  monkeypatch.setattr(parser.Rule, 'parse', classmethod(parse))
+
+# run the evaluator's tests on optimized trees.
+test_infixlang_suite = testing.infixlang_suite(optimize_parses, EVAL_TESTS)
+
+def optimized(string):
+  tree, rest = infixlang.expr_sequence.parse(T(string))
+  assert not rest
+  return infixlang.optimize(tree)
+
+def test_fold():
+  assert repr(optimized('2 * 3 + 4')) == '10'
+  assert repr(optimized('a = (2 * (3 + 4)) - 1')) == 'a = 13'
+  assert repr(optimized('f ~ (x + 2 * 3)')) == 'f ~ x + 6'
+  assert repr(optimized('1 2')) == '2'
+
+def test_no_fold():
+  # folding these would change what eval does.
+  for string in ['1 / 0', '1 == 1', '2 * %d' % (sys.maxint + 1),
+                 '%d * 2' % (sys.maxint + 1),
+                 'a = (b = 1)', '(a = 1)', '(this)', '(f)', '1 this']:
+    tree = optimized(string)
+    assert not isinstance(tree, infixlang.integer), string
+
+def test_if_as_a_value():
+  # if is a token, but it can be evaluated where a value is expected.
+  assert repr(optimized('x = if')) == repr(
+      infixlang.expr_sequence.parse(T('x = if'))[0])
+  tree, _ = infixlang.parse_cache.parse('x = if')
+  assert isinstance(tree.val[2], infixlang.op_if)
+
+def test_bodies_print_as_written():
+  # a ~ body is folded, but its value prints as the source does.
+  for string, body in [('f ~ (a+b)*2', '( a + b ) * 2'),
+                       ('f ~ 10 - (3 - 1)', '10 - ( 3 - 1 )'),
+                       ('f ~ (g ~ (2 * 3), g)', '( g ~ ( 2 * 3 ) , g )')]:
+    tree = optimized(string)
+    assert repr(tree.eval(C()).val) == '@' + body
+  assert repr(optimized('f ~ 10 - (3 - 1)')) == 'f ~ 8'
+  # optimizing an optimized tree keeps the source.
+  tree = infixlang.optimize(optimized('f ~ ((1 + 2))'))
+  assert repr(tree.eval(C()).val) == '@( ( 1 + 2 ) )'
+
+def test_same_results():
+  for string in ['2 * 3 + 4', '(1 + 2) * (3 - 1)', 'a = (b = 1)', '(a = 1)',
+                 '(2 * 3) this', 'x = (1 2 3) x', '((4))', '(((4)) 5)',
+                 '1 == 1', '7 - 3 - 2', '8 / 2 / 2']:
+    tree, _ = infixlang.expr_sequence.parse(T(string))
+    expected = tree.eval(C(slots={'b': 1}))
+    result = infixlang.optimize(tree).eval(C(slots={'b': 1}))
+    assert result.val == expected.val or (
+        isinstance(result.val, C) and result.val.val == expected.val.val)
+    assert result.dictify() == expected.dictify()
+
+def test_trees_are_not_modified():
+  tree, _ = infixlang.expr_sequence.parse(T('a = 2 * 3 + 4'))
+  before = repr(tree)
+  infixlang.optimize(tree)
+  assert repr(tree) == before
+
+  tree, _ = infixlang.expr_sequence.parse(T('a = b'))
+  assert infixlang.optimize(tree) is tree
+
+def test_parse_cache_optimizes():
+  tree, _ = infixlang.parse_cache.parse('x = 6 * 7')
+  assert repr(tree) == 'x = 42'
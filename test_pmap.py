@@ -0,0 +1,99 @@
+import pmap
+
+class BadHash(object):
+  # keys with colliding hashes.
+  def __init__(self, name, h):
+    self.name = name
+    self.h = h
+
+  def __hash__(self):
+    return self.h
+
+  def __eq__(self, other):
+    return self.name == other.name
+
+def test_set_get():
+  m = pmap.EMPTY
+  maps = []
+  for i in xrange(1000):
+    m = m.set('k%d' % i, i)
+    maps.append(m)
+
+  assert len(m) == 1000
+  for i in xrange(1000):
+    assert m['k%d' % i] == i
+  # older maps are unchanged.
+  assert len(maps[9]) == 10 and 'k10' not in maps[9]
+  assert maps[9].get('k10', 'missing') == 'missing'
+  assert sorted(maps[2].items()) == [('k0', 0), ('k1', 1), ('k2', 2)]
+
+  m2 = m.set('k5', 'five')
+  assert m2['k5'] == 'five' and m['k5'] == 5 and len(m2) == 1000
+  assert m.set('k5', 5) is m
+
+def test_negative_hashes():
+  m = pmap.EMPTY
+  for i in xrange(-500, 500):
+    m = m.set(i, -i)
+  assert len(m) == 1000
+  assert all(m[i] == -i for i in xrange(-500, 500))
+
+def test_collisions():
+  a, b, c = BadHash('a', 7), BadHash('b', 7), BadHash('c', 7 + 32)
+  m = pmap.EMPTY.set(a, 1).set(b, 2).set(c, 3)
+  assert len(m) == 3
+  assert (m[a], m[b], m[c]) == (1, 2, 3)
+  m = m.set(b, 20)
+  assert (m[a], m[b], m[c]) == (1, 20, 3) and len(m) == 3
+  assert BadHash('d', 7) not in m
+
+def test_merge():
+  base = pmap.EMPTY.update(dict(('k%d' % i, i) for i in xrange(200)))
+  left = base.set('k1', 'left').set('only_left', 1)
+  right = base.set('k1', 'right').set('k2', 'right').set('only_right', 2)
+  merged = left.merge(right)
+  assert len(merged) == 202
+  assert merged['k1'] == 'right' and merged['k2'] == 'right'
+  assert merged['only_left'] == 1 and merged['only_right'] == 2
+  assert merged['k100'] == 100
+  assert merged.todict() == dict(left.todict(), **right.todict())
+
+  assert base.merge(base) is base
+  assert pmap.EMPTY.merge(base) is base
+  assert base.merge(pmap.EMPTY) is base
+
+def test_remove():
+  m = pmap.EMPTY.update(dict(('k%d' % i, i) for i in xrange(500)))
+  for i in xrange(0, 500, 2):
+    m = m.remove('k%d' % i)
+  assert len(m) == 250
+  assert m.todict() == dict(('k%d' % i, i) for i in xrange(1, 500, 2))
+  assert m.remove('k0') is m
+  for i in xrange(1, 500, 2):
+    m = m.remove('k%d' % i)
+  assert len(m) == 0 and m.root is None
+
+  a, b, c = BadHash('a', 7), BadHash('b', 7), BadHash('c', 7 + 32)
+  m = pmap.EMPTY.set(a, 1).set(b, 2).set(c, 3)
+  assert m.remove(b).todict() == {a: 1, c: 3}
+  assert m.remove(a).remove(c).todict() == {b: 2}
+  assert m.remove(BadHash('d', 7)) is m
+  # a map that lost keys can grow again.
+  m = m.remove(c).set(BadHash('e', 7 + 64), 5)
+  assert len(m) == 3 and m[BadHash('e', 7 + 64)] == 5
+
+def test_diff():
+  m = pmap.EMPTY.update(dict(('k%d' % i, i) for i in xrange(500)))
+  assert list(m.diff(m)) == []
+  n = m.set('k1', 'x').set('new', 1).remove('k2')
+  assert sorted(m.diff(n)) == ['k1', 'k2', 'new']
+  assert sorted(n.diff(m)) == ['k1', 'k2', 'new']
+  # values are compared by identity.
+  big = m.set('big', int('100000'))
+  assert list(big.diff(big.set('big', int('100000')))) == ['big']
+  assert sorted(pmap.EMPTY.diff(m)) == sorted(m)
+
+  a, b, c = BadHash('a', 7), BadHash('b', 7), BadHash('c', 7 + 32)
+  m = pmap.EMPTY.set(a, 1).set(b, 2)
+  assert list(m.diff(m.set(c, 3))) == [c]
+  assert list(m.diff(m.set(b, 4))) == [b]
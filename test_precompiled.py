@@ -0,0 +1,88 @@
+import StringIO
+
+import pytest
+
+import parser
+import infixlang
+import precompiled
+import repl
+
+PRELUDE = """
+  set_element ~ (prev=array, this)
+  get_element ~ (then=(array value)
+                 else~(array=(array prev) get_element)
+                 cond=((array slot) == i)
+                 if)
+  myarray = (this)
+  myarray = (array=myarray slot=1000 value=10 set_element)
+  myarray = (array=myarray slot=2000 value=20 set_element)
+  """
+
+def test_round_trip():
+  trees = precompiled.parse_statements(
+      PRELUDE + 'x = (1 + 2) * 3 - 4 / 2 m = (map=map_new key=1 value=x map_put)')
+  data = precompiled.dumps(trees)
+  assert data.startswith(precompiled.MAGIC)
+  loaded = precompiled.loads(data)
+  assert [repr(t) for t in loaded] == [repr(t) for t in trees]
+  assert [type(t) for t in loaded] == [type(t) for t in trees]
+  # ~ bodies still print as they were written.
+  assert (str(precompiled.run_statements(loaded)['get_element']) ==
+          str(precompiled.run_statements(trees)['get_element']))
+  [link] = precompiled.loads(precompiled.dumps(
+      precompiled.parse_statements('f ~ (1 + 2) * x')))
+  assert repr(link) == 'f ~ 3 * x'
+  assert repr(link.eval(infixlang.Context()).val) == '@( 1 + 2 ) * x'
+
+  context = precompiled.run_statements(loaded)
+  assert context['x'] == 7
+  assert context['m'][1] == 7
+
+def test_integers():
+  for n in [0, 1, -1, 127, 128, -129, 2**40, -2**70]:
+    [tree] = precompiled.loads(precompiled.dumps([infixlang.integer(n)]))
+    assert tree.val == n
+
+def test_deep_tree():
+  depth = 5000
+  tree = infixlang.integer(1)
+  for _ in xrange(depth):
+    tree = infixlang.parenthesized_expr(
+        [infixlang.open_paren('('), tree, infixlang.close_paren(')')])
+  [loaded] = precompiled.loads(precompiled.dumps([tree]))
+  for _ in xrange(depth):
+    loaded = loaded.val[1]
+  assert loaded.val == 1
+
+def test_load_prelude(tmpdir):
+  path = str(tmpdir.join('prelude.ifxc'))
+  precompiled.compile_source(PRELUDE, path)
+  context = precompiled.load_prelude(path)
+  tree, _ = infixlang.expr_sequence.parse(
+      infixlang.tokenize('(array=myarray i=1000 get_element)'))
+  assert tree.eval(context).val == 10
+
+def test_bad_files(tmpdir):
+  with pytest.raises(ValueError):
+    precompiled.loads('IFXP\x01')
+  with pytest.raises(ValueError):
+    precompiled.loads(precompiled.MAGIC + chr(precompiled.VERSION + 1))
+
+  path = tmpdir.join('empty.ifxc')
+  path.write('')
+  with pytest.raises(ValueError):
+    precompiled.load(str(path))
+
+def test_statements_are_sequences():
+  # like in the repl, a context that starts a line is chained into the rest
+  # of the line.
+  source = 's = (a=1, this)\ns a\nb = 2, b + (s a)\n'
+  context = precompiled.run_statements(precompiled.parse_statements(source))
+  assert context.val == 3
+  output = StringIO.StringIO()
+  repl.repl(StringIO.StringIO(source), output, output)
+  assert output.getvalue().splitlines()[-1] == '3'
+
+def test_unparsed_statements():
+  with pytest.raises(parser.ParseError):
+    precompiled.parse_statements('a = 1\nb = 2 )\n')
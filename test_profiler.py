@@ -0,0 +1,114 @@
+import StringIO
+
+import pytest
+
+import infixlang
+import memo
+import profiler
+import repl
+from testing import parse
+
+C = infixlang.Context
+
+FIB = """
+  fib ~ (then=n else~((n=n-1 fib) + (n=n-2 fib)) cond=((n==0) + (n==1)) if)
+  (n=10 fib)
+  """
+
+def stats_by_name(p):
+  return dict((s.name, s) for s in p.stats.itervalues())
+
+def test_counts():
+  tree = parse(FIB)
+  with profiler.Profiler() as p:
+    assert tree.eval(C()).val == 55
+
+  stats = stats_by_name(p)
+  # fib(10) makes 177 calls, 88 of which take the else branch.
+  assert stats['fib'].calls == 177
+  assert stats['else'].calls == 88
+  for s in stats.values():
+    assert s.inclusive >= s.exclusive > 0
+    assert s.inclusive_contexts >= s.exclusive_contexts > 0
+  # the outermost fib includes everything else.
+  assert stats['fib'].inclusive >= stats['else'].inclusive
+  assert stats['fib'].inclusive_contexts > stats['else'].inclusive_contexts
+
+def test_disabled():
+  call, init = infixlang.call, vars(C)['__init__']
+  p = profiler.Profiler()
+  with p:
+    assert infixlang.call != call
+  assert infixlang.call is call and vars(C)['__init__'] is init
+  parse(FIB).eval(C())
+  assert not p.stats
+
+def test_stacks():
+  with profiler.Profiler() as p:
+    parse(FIB).eval(C())
+  out = StringIO.StringIO()
+  p.write_stacks(out)
+  stacks = {}
+  for line in out.getvalue().splitlines():
+    stack, usecs = line.rsplit(' ', 1)
+    stacks[stack] = int(usecs)
+  assert '<top>;fib' in stacks
+  assert '<top>;fib;else;fib;else;fib' in stacks
+  assert all(s.startswith('<top>') for s in stacks)
+
+def test_report():
+  with profiler.Profiler() as p:
+    parse(FIB).eval(C())
+  out = StringIO.StringIO()
+  p.report(out)
+  lines = out.getvalue().splitlines()
+  assert lines[0].split()[0] == 'calls'
+  assert len(lines) == 3
+  assert any(line.split()[0] == '177' and 'fib ~ ( then = n' in line
+             for line in lines)
+
+def test_with_memo():
+  with profiler.Profiler() as p:
+    assert memo.evaluate(parse(FIB), C()).val == 55
+  # memoized, fib is only evaluated once per n.
+  assert stats_by_name(p)['fib'].calls < 25
+
+def test_hooks_are_restored():
+  call, init = infixlang.call, vars(C)['__init__']
+  value_init = vars(infixlang.ValueContext)['__init__']
+  p = profiler.Profiler()
+  with p:
+    m = memo.Memo()
+    with pytest.raises(infixlang.UnknownVariableError):
+      memo.evaluate(parse(FIB + '(n=3 f)'), C(), m)
+    assert memo.evaluate(parse(FIB), C(), m).val == 55
+  assert (infixlang.call, vars(C)['__init__'],
+          vars(infixlang.ValueContext)['__init__']) == (call, init, value_init)
+
+  # the memo made while profiling doesn't call the profiler any more.
+  m.clear()
+  calls = stats_by_name(p)['fib'].calls
+  assert memo.evaluate(parse(FIB), C(), m).val == 55
+  assert stats_by_name(p)['fib'].calls == calls
+  assert parse(FIB).eval(C()).val == 55
+  assert not p.frames[1:]
+
+def test_errors():
+  p = profiler.Profiler()
+  try:
+    with p:
+      parse('f ~ (a + 1) f').eval(C())
+  except infixlang.UnknownVariableError:
+    pass
+  assert stats_by_name(p)['f'].calls == 1
+  assert not p.frames[1:]
+
+def test_repl_profile(tmpdir, capsys):
+  script = tmpdir.join('fib.ifx')
+  script.write(FIB)
+  stacks = tmpdir.join('fib.folded')
+  repl.main(['--run', str(script), '--flamegraph', str(stacks)])
+  out, err = capsys.readouterr()
+  assert out.splitlines()[-1] == '55'
+  assert 'excl secs' in err and 'fib ~' in err
+  assert stacks.read().startswith('<top>')
@@ -0,0 +1,58 @@
+import random
+
+import pytest
+
+import pvector
+
+
+def test_append_get():
+  v = pvector.EMPTY
+  vectors = []
+  for i in xrange(5000):
+    v = v.append(i)
+    vectors.append(v)
+
+  assert len(v) == 5000 and list(v) == range(5000)
+  assert all(v[i] == i for i in xrange(5000))
+  # older vectors are unchanged.
+  assert list(vectors[40]) == range(41)
+  assert list(vectors[1055]) == range(1056)
+  with pytest.raises(IndexError):
+    v[5000]
+  with pytest.raises(IndexError):
+    v[-1]
+
+def test_set():
+  v = pvector.from_iterable(xrange(2000))
+  for i in (0, 31, 32, 1023, 1024, 1999):
+    w = v.set(i, 'x')
+    assert w[i] == 'x' and v[i] == i
+    assert list(w) == range(i) + ['x'] + range(i + 1, 2000)
+
+def test_pop():
+  v = pvector.from_iterable(xrange(2000))
+  for n in xrange(2000, 0, -1):
+    assert len(v) == n and v[n - 1] == n - 1
+    v = v.pop()
+  assert v is pvector.EMPTY
+  with pytest.raises(IndexError):
+    v.pop()
+
+def test_matches_list():
+  rng = random.Random(1)
+  v, l = pvector.EMPTY, []
+  for _ in xrange(20000):
+    r = rng.random()
+    if r < 0.6 or not l:
+      x = rng.randint(0, 100)
+      v = v.append(x)
+      l.append(x)
+    elif r < 0.8:
+      v = v.pop()
+      l.pop()
+    else:
+      i = rng.randrange(len(l))
+      v = v.set(i, -i)
+      l[i] = -i
+    assert len(v) == len(l)
+  assert list(v) == l
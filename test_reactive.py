@@ -0,0 +1,152 @@
+import StringIO
+
+import infixlang
+import reactive
+import repl
+
+def enter(sheet, source):
+  return sheet.enter(infixlang.parse_cache.parse(source)[0])
+
+def value(sheet, name):
+  return sheet.globals[name]
+
+def test_recomputes_dependents():
+  sheet = reactive.Sheet()
+  enter(sheet, 'a = 1')
+  enter(sheet, 'b = a + 1')
+  enter(sheet, 'c = b * 10')
+  enter(sheet, 'd = 7')
+  result, changed, errors = enter(sheet, 'a = 5')
+  assert changed == ['b', 'c'] and errors == []
+  assert value(sheet, 'b') == 6 and value(sheet, 'c') == 60
+  assert sheet.recomputed == 2
+
+  # the same value again changes nothing.
+  _, changed, _ = enter(sheet, 'a = 5')
+  assert changed == [] and sheet.recomputed == 2
+  # b's result is cached, and only c reads it.
+  _, changed, _ = enter(sheet, 'b = 0')
+  assert changed == ['c'] and value(sheet, 'c') == 0
+  assert sheet.recomputed == 3
+
+def test_stops_where_values_dont_change():
+  sheet = reactive.Sheet()
+  enter(sheet, 'a = 1')
+  enter(sheet, 'b = (a == 0)')
+  enter(sheet, 'c = b + 1')
+  _, changed, _ = enter(sheet, 'a = 2')
+  assert changed == [] and sheet.recomputed == 1
+
+def test_links_and_calls():
+  # what the bodies a statement calls read counts, and the arguments it
+  # binds for them don't.
+  sheet = reactive.Sheet()
+  enter(sheet, 'scale = 2')
+  enter(sheet, 'f ~ x * scale')
+  enter(sheet, 'y = (x=3 f)')
+  enter(sheet, 'x = 100')
+  assert value(sheet, 'y') == 6 and sheet.recomputed == 0
+  _, changed, _ = enter(sheet, 'scale = 3')
+  assert changed == ['y'] and value(sheet, 'y') == 9
+  _, changed, _ = enter(sheet, 'f ~ x + scale')
+  assert changed == ['y']
+  assert value(sheet, 'y') == 6
+
+def test_topological_order():
+  # d reads b and c, which both read a. d is recomputed once, after both.
+  sheet = reactive.Sheet()
+  enter(sheet, 'a = 1')
+  enter(sheet, 'd0 = 0')
+  enter(sheet, 'b = a + 1')
+  enter(sheet, 'c = a + 2')
+  enter(sheet, 'd = b * c + d0')
+  _, changed, _ = enter(sheet, 'a = 2')
+  assert sorted(changed[:2]) == ['b', 'c'] and changed[2:] == ['d']
+  assert value(sheet, 'd') == 12 and sheet.recomputed == 3
+
+def test_redefinitions():
+  sheet = reactive.Sheet()
+  enter(sheet, 'a = 1')
+  enter(sheet, 'b = a + 1')
+  # a reads the old a, and replaces it.
+  enter(sheet, 'a = a + 10')
+  assert value(sheet, 'a') == 11 and value(sheet, 'b') == 12
+  assert sheet.definitions['a'].number == 2
+  # a statement that reads its own variable isn't recomputed by itself.
+  assert sheet.recomputed == 1
+  # a newer definition of b wins over recomputing the old one.
+  enter(sheet, 'b = 0')
+  enter(sheet, 'a = 1')
+  assert value(sheet, 'b') == 0
+
+def test_unknown_variables_and_errors():
+  sheet = reactive.Sheet()
+  enter(sheet, 'y = (cond=0 then=1 if)')
+  assert value(sheet, 'y') == 0
+  # y looked for else, and didn't find it.
+  _, changed, _ = enter(sheet, 'else = 5')
+  assert changed == ['y'] and value(sheet, 'y') == 5
+
+  enter(sheet, 'a = 1')
+  enter(sheet, 'b = a + 1')
+  _, changed, errors = enter(sheet, 'a ~ missing')
+  assert len(errors) == 1 and isinstance(errors[0],
+                                         infixlang.UnknownVariableError)
+  assert 'b' not in sheet.globals and changed == ['b']
+  # b comes back when what it reads is fixed.
+  _, changed, errors = enter(sheet, 'missing = 41')
+  assert value(sheet, 'b') == 42 and errors == []
+
+  # an error in the statement entered changes nothing, and leaves contexts
+  # as they were.
+  getitem = vars(infixlang.Context)['__getitem__']
+  try:
+    enter(sheet, 'b = nothing')
+  except infixlang.UnknownVariableError:
+    pass
+  assert value(sheet, 'b') == 42
+  assert vars(infixlang.Context)['__getitem__'] is getitem
+
+def test_this():
+  sheet = reactive.Sheet()
+  enter(sheet, 'a = 1')
+  enter(sheet, 's = (k=2 this)')
+  enter(sheet, 'z = (s a + k)')
+  _, changed, _ = enter(sheet, 'a = 2')
+  assert value(sheet, 'z') == 4 and 's' in changed
+
+def test_edit_cost_is_proportional_to_dependents():
+  # many independent chains. an edit at the start of one recomputes that one
+  # chain only.
+  sheet = reactive.Sheet()
+  chains, length = 50, 10
+  for i in xrange(chains):
+    enter(sheet, 'v%d_0 = %d' % (i, i))
+    for j in xrange(1, length):
+      enter(sheet, 'v%d_%d = v%d_%d + 1' % (i, j, i, j - 1))
+  assert sheet.recomputed == 0
+
+  _, changed, _ = enter(sheet, 'v7_0 = 100')
+  assert len(changed) == length - 1 and sheet.recomputed == length - 1
+  assert value(sheet, 'v7_%d' % (length - 1)) == 100 + length - 1
+
+def test_long_chain():
+  sheet = reactive.Sheet()
+  enter(sheet, 'v0 = 0')
+  for i in xrange(1, 2000):
+    enter(sheet, 'v%d = v%d + 1' % (i, i - 1))
+  enter(sheet, 'v0 = 1')
+  assert value(sheet, 'v1999') == 2000
+
+def test_repl():
+  istream = StringIO.StringIO("""
+    a = 2
+    b = a * 3
+    a = 5
+    b
+  """)
+  ostream = StringIO.StringIO()
+  estream = StringIO.StringIO()
+  repl.repl(istream, ostream, estream, incremental=True)
+  assert ostream.getvalue() == 'b = 15\n15\n'
+  assert estream.getvalue() == ''
@@ -1,4 +1,6 @@
 import StringIO
+import bench
+import infixlang
 import repl
 
 def interaction(in_string, expected_output_string, expected_error_string):
@@ -19,6 +21,23 @@ def test_variables():
   """
   interaction(in_string, '46\n', '')
 
+def test_structs_print_their_own_slots():
+  in_string = """
+    x = 5
+    s = (a=1, this)
+    s
+    (s x)
+  """
+  interaction(in_string, 'Context(None){a:1}\n5\n', '')
+
+def test_links_print_as_written():
+  in_string = """
+    func ~ (a+b)*2
+    f ~ 10 - (3 - 1)
+    f
+  """
+  interaction(in_string, '@( a + b ) * 2\n@10 - ( 3 - 1 )\n8\n', '')
+
 def test_error():
   in_string = """
     4 ^ 7
@@ -59,3 +78,99 @@ def test_counting():
   assert olines[2] == '3'
   assert olines[3] == '3'
   assert olines[4] == '4'
+
+def test_repeated_lines_are_cached():
+  infixlang.parse_cache.clear()
+  hits = infixlang.parse_cache.hits
+  in_string = """
+    a = 0
+    a = a + 1
+    a = a + 1
+    a = a + 1
+    a
+  """
+  interaction(in_string, '3\n', '')
+  assert infixlang.parse_cache.hits == hits + 2
+
+def run(in_string, **kwargs):
+  ostream = StringIO.StringIO()
+  estream = StringIO.StringIO()
+  repl.run(StringIO.StringIO(in_string), ostream, estream, **kwargs)
+  return ostream.getvalue(), estream.getvalue()
+
+def test_run_matches_repl():
+  in_string = """
+    counter_state = 0
+    cnt = 0
+    count ~ (counter_state, cnt=cnt+1, this)
+    counter_state = count
+    (counter_state cnt)
+    4 ^ 7
+    counter_state = count
+    (counter_state cnt)
+    """
+  ostream = StringIO.StringIO()
+  estream = StringIO.StringIO()
+  repl.repl(StringIO.StringIO(in_string), ostream, estream)
+  for collapse_every in (1, 2, 1000):
+    assert run(in_string, collapse_every=collapse_every) == (
+        ostream.getvalue(), estream.getvalue())
+
+def test_run_prints_contexts_like_repl():
+  # this is the global context, which the repl collapses after every line.
+  in_string = 'a = 1\nb = 2\nthis\nx = 5\ns = (c=3, this)\ns\n(this)\n'
+  ostream = StringIO.StringIO()
+  repl.repl(StringIO.StringIO(in_string), ostream, StringIO.StringIO())
+  for collapse_every in (1, 2, 3, 64):
+    assert run(in_string, collapse_every=collapse_every) == (
+        ostream.getvalue(), '')
+
+def test_run_statements_across_lines():
+  in_string = """
+    a = 2 *
+      3
+    f ~ (
+      a = a + 1,
+      a
+    )
+    f
+    (1
+     2) b = a
+    b
+  """
+  assert run(in_string) == ('@( a = a + 1 , a )\n7\n6\n', '')
+
+def test_run_buffers_output():
+  in_string = ''.join('a = %d\na\n' % i for i in range(1000))
+  output, errors = run(in_string, flush_every=7, collapse_every=3)
+  assert output == ''.join('%d\n' % i for i in range(1000))
+  assert errors == ''
+
+def test_run_flushes_on_unexpected_errors():
+  ostream = StringIO.StringIO()
+  try:
+    repl.run(StringIO.StringIO('1\n2\n1 / 0\n3\n'), ostream,
+             StringIO.StringIO())
+    assert False, 'expected a ZeroDivisionError'
+  except ZeroDivisionError:
+    pass
+  assert ostream.getvalue() == '1\n2\n'
+
+def test_read_statements():
+  lines = ['\n', 'a = (1 +\n', '2)\n', 'b = a\n', '  \n', 'c =']
+  assert list(repl.read_statements(lines)) == ['a = (1 +\n2)\n', 'b = a\n',
+                                               'c =']
+
+def test_run_memory_is_flat():
+  # stepping the README's iterator captures a new context each time. the old
+  # ones, and the contexts made along the way, are garbage.
+  def final_size(steps):
+    script = """
+      iterate ~ (i=i+1, sum=sum+i, stop=(i==8), this)
+      iterator = (i=0 sum=0 iterate)
+      """ + 'iterator = (iterator iterate)\n' * steps
+    context = repl.run(StringIO.StringIO(script), StringIO.StringIO(),
+                       StringIO.StringIO())
+    assert context['iterator']['i'] == steps + 1
+    return bench.reachable_size(context)
+  assert final_size(1000) == final_size(500)
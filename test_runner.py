@@ -0,0 +1,66 @@
+import StringIO
+
+import repl
+import runner
+
+SCRIPTS = [
+    ('sum', 'a = 1\nb = a + 2\nb * 10'),
+    ('bad parse', 'a = (1'),
+    ('unknown', 'a = b'),
+    ('factorial', """
+      factorial ~ (then ~ i*(i=i-1 factorial) else=1 cond=i if)
+      (i=5 factorial)
+      """),
+    ('context', 'x = 1, this'),
+    ]
+
+def test_run_scripts():
+  results = runner.run_scripts(SCRIPTS * 5, processes=2, chunksize=3)
+  assert [r.name for r in results] == [name for name, _ in SCRIPTS] * 5
+  for i in range(0, len(results), len(SCRIPTS)):
+    total, bad_parse, unknown, factorial, context = results[i:i + 5]
+    assert (total.value, total.error) == (30, None)
+    assert bad_parse.value is None and bad_parse.error
+    assert 'Unknown variable b' in unknown.error
+    assert factorial.value == 120
+    assert context.value.startswith('Context(')
+
+def repl_value(text):
+  output = StringIO.StringIO()
+  repl.repl(StringIO.StringIO(text), output, StringIO.StringIO())
+  return output.getvalue().splitlines()[-1]
+
+def test_same_as_repl():
+  scripts = [
+      ('struct', 's = (a=1, this)\ns a\n'),
+      ('chained', 'x = 5\ns = (a=1, b=2, this)\ns a + b + x\n'),
+      ('sequence', 'a = 1, b = a + 1\nb * 10\n'),
+      ('factorial', SCRIPTS[3][1]),
+      # nothing but this reads a and b, and it prints them.
+      ('this', 'a = 1\nb = 2\nthis'),
+      ('link', 'func ~ (a+b)*2\n'),
+      ('later this', 'a = 1\nb = a + 1\nc = 3\nthis\nd = 4\nthis'),
+      ]
+  results = runner.run_scripts(scripts, processes=1)
+  for (name, text), result in zip(scripts, results):
+    assert result.error is None, name
+    assert str(result.value) == repl_value(text), name
+
+def test_timeout():
+  # a tail call that never ends, which the vm runs in constant space.
+  results = runner.run_scripts([('loop', 'loop ~ loop\nloop'),
+                                ('fine', '1 + 1')],
+                               processes=1, timeout=0.2, engine='vm')
+  assert results[0].error == 'Timed out after 0.2s'
+  assert results[1].value == 2
+
+def test_read_stream():
+  stream = StringIO.StringIO('a = 1\na\n---\n2\n---\n\n')
+  assert list(runner.read_stream(stream)) == [
+      ('script 0', 'a = 1\na\n'), ('script 1', '2\n')]
+
+def test_read_directory(tmpdir):
+  tmpdir.join('b.ifx').write('2')
+  tmpdir.join('a.ifx').write('1')
+  assert list(runner.read_directory(str(tmpdir))) == [
+      ('a.ifx', '1'), ('b.ifx', '2')]
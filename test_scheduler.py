@@ -0,0 +1,53 @@
+import time
+
+import infixlang
+import runner
+import scheduler
+from testing import parse
+
+C = infixlang.Context
+
+LOOP = """
+  loop ~ (then=i else~(i=i+1 loop) cond=(i==n) if)
+  (i=0 n=%d loop)
+  """
+
+def test_runs_every_task():
+  s = scheduler.Scheduler(slice=100)
+  tasks = [s.submit(parse(LOOP % n), C(), data=n) for n in (300, 10, 100)]
+  done = list(s.run())
+  assert [task.data for task in done] == [10, 100, 300]
+  assert [task.result.val for task in tasks] == [300, 10, 100]
+  assert not s
+
+def test_short_tasks_go_first():
+  s = scheduler.Scheduler(slice=100)
+  for _ in xrange(20):
+    s.submit(parse(LOOP % 10 ** 6), C())
+  # every long task has had a slice.
+  for _ in xrange(20):
+    assert s.run_slice() is None
+  short = s.submit(parse('1 + 2'), C())
+  assert s.run_slice() is short and short.result.val == 3
+
+def test_errors():
+  s = scheduler.Scheduler(slice=100, max_steps=5000)
+  unknown = s.submit(parse('a + 1'), C())
+  forever = s.submit(parse(LOOP % 10 ** 9), C())
+  late = s.submit(parse(LOOP % 10 ** 6), C(), deadline=time.time() - 1)
+  fine = s.submit(parse(LOOP % 10), C())
+  list(s.run())
+  assert isinstance(unknown.error, infixlang.UnknownVariableError)
+  assert isinstance(forever.error, infixlang.LimitError)
+  assert forever.steps >= 5000
+  assert isinstance(late.error, runner.Timeout)
+  assert fine.error is None and fine.result.val == 10
+
+def test_frame_limit_across_slices():
+  s = scheduler.Scheduler(slice=100, max_frames=1000)
+  task = s.submit(parse("""
+    sum ~ (then ~ i+(i=i-1 sum) else=0 cond=i if)
+    (i=5000 sum)
+    """), C())
+  list(s.run())
+  assert isinstance(task.error, infixlang.LimitError)
@@ -0,0 +1,130 @@
+import socket
+import threading
+import time
+
+import pytest
+
+import loadtest
+import server
+
+FIB = ('fib ~ (then=n else~((n=n-1 fib) + (n=n-2 fib)) '
+       'cond=((n==0) + (n==1)) if)')
+
+@pytest.fixture
+def serving(request):
+  servers = []
+
+  def start(address=('127.0.0.1', 0), **kwargs):
+    s = server.Server(address, workers=2, **kwargs)
+    thread = threading.Thread(target=s.serve_forever, args=(0.05,))
+    thread.start()
+    servers.append((s, thread))
+    return s
+
+  def stop():
+    for s, thread in servers:
+      s.stop()
+      thread.join()
+      s.close()
+  request.addfinalizer(stop)
+  return start
+
+def connect(s):
+  family = socket.AF_UNIX if isinstance(s.address, str) else socket.AF_INET
+  sock = socket.socket(family, socket.SOCK_STREAM)
+  sock.settimeout(10)
+  sock.connect(s.address)
+  return sock, sock.makefile('rb')
+
+def ask(session, *lines):
+  sock, answers = session
+  sock.sendall(''.join(line + '\n' for line in lines))
+  return [answers.readline().rstrip('\n') for _ in lines]
+
+def test_sessions(serving):
+  s = serving()
+  one, two = connect(s), connect(s)
+  assert ask(one, 'a = 20', 'a + 1', 'f ~ a * 2', 'f') == [
+      'ok', 'ok 21', 'ok @a * 2', 'ok 40']
+  # each session has its own context.
+  assert ask(two, 'a')[0].startswith('error Unknown variable a')
+  assert ask(two, 'a = 1', 'a') == ['ok', 'ok 1']
+  assert ask(one, 'a') == ['ok 20']
+  assert ask(one, 'x = (a=1, this)') == ['ok']
+  assert ask(one, '(x a)') == ['ok 1']
+
+def test_errors(serving):
+  s = serving()
+  session = connect(s)
+  assert ask(session, 'a = 1') == ['ok']
+  answers = ask(session, 'a = 2 *', 'a = 2 ^ 3', 'a = b', 'a')
+  assert answers[0].startswith('error Stuff unparsed')
+  assert answers[1].startswith('error Unrecognized')
+  assert answers[2].startswith('error Unknown variable b')
+  # a is unchanged.
+  assert answers[3] == 'ok 1'
+  # blank lines aren't answered.
+  session[0].sendall('\n  \n')
+  assert ask(session, 'a + 1') == ['ok 2']
+
+def test_same_as_repl(serving):
+  # the workers don't evaluate with eval(), but their answers are the same.
+  session = connect(serving())
+  assert ask(session, 'cond=0 else~nope if', 'cond=1 then=2 if',
+             'cond=0 else~(x = nope) then=1 if') == ['ok 0', 'ok 2', 'ok 0']
+  # this in a ~ body only has the slots of the context it's called from.
+  assert ask(session, 'f ~ this', '(a=1, f)') == [
+      'ok @this', 'ok Context(None){a:1}']
+
+def test_pipelining(serving):
+  # more lines than a session can have waiting, sent at once.
+  s = serving(pipeline=4)
+  session = connect(s)
+  lines = ['n = 0'] + ['n = n + 1'] * 200 + ['n']
+  assert ask(session, *lines)[-1] == 'ok 200'
+
+def test_timeout(serving):
+  s = serving(timeout=0.2)
+  slow, fast = connect(s), connect(s)
+  assert ask(slow, FIB, '(n=25 fib)')[1] == 'error Timed out'
+  # the session still works, and so do the others.
+  assert ask(slow, '(n=6 fib)') == ['ok 8']
+  assert ask(fast, '1 + 1') == ['ok 2']
+
+def test_unix_socket(serving, tmpdir):
+  path = str(tmpdir.join('socket'))
+  s = serving(path)
+  assert ask(connect(s), '2 * 3') == ['ok 6']
+
+def test_load_test(serving):
+  s = serving()
+  test = loadtest.LoadTest()
+  test.run(s.address, 200, 8)
+  assert test.finished == 200 and not test.failed and not test.errors
+  assert len(test.latencies) == 1600
+  assert 0 < test.percentile(50) <= test.percentile(99)
+
+def test_limits(serving):
+  s = serving(max_steps=100000, max_frames=1000)
+  session = connect(s)
+  loop = 'loop ~ (then=i else~(i=i+1 loop) cond=(i==n) if)'
+  assert ask(session, loop, '(i=0 n=1000000000 loop)')[1].startswith(
+      'error Took more than 100000 steps')
+  # not a tail call, so every level leaves a frame.
+  total = 'sum ~ (then ~ i+(i=i-1 sum) else=0 cond=i if)'
+  assert ask(session, total, '(i=5000 sum)')[1].startswith(
+      'error Used more than 1000 stack frames')
+  assert ask(session, '(i=0 n=100 loop)') == ['ok 100']
+
+def test_long_statements_share_the_worker(serving):
+  s = serving()
+  # sessions take turns on the workers, so the first and the third share
+  # one.
+  slow, _, fast = connect(s), connect(s), connect(s)
+  slow[0].sendall(FIB + '\n(n=22 fib)\n')
+  start = time.time()
+  assert ask(fast, '1 + 1', '2 * 3') == ['ok 2', 'ok 6']
+  fast_time = time.time() - start
+  assert slow[1].readline().startswith('ok @')
+  assert slow[1].readline() == 'ok 17711\n'
+  assert fast_time < (time.time() - start) / 2
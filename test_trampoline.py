@@ -0,0 +1,120 @@
+import math
+
+import pytest
+
+import bench
+import infixlang
+import trampoline
+import testing
+from testing import parse
+
+C = infixlang.Context
+
+# run the evaluator's test suite with the trampoline in place of eval().
+test_infixlang_suite = testing.engine_suite(trampoline.evaluate)
+
+WHILE = """
+  iterate ~ (i=i+1, sum=sum+i, stop=(i==%d), this)
+  while ~ (then=iterator, else~(iterator=(iterator iterate) while), cond=(iterator stop) if)
+  final = (iterator=(i=0 sum=0 iterate) while)
+  """
+
+def test_long_while_loop():
+  n = 20000
+  context = trampoline.evaluate(parse(WHILE % n), C())
+  final = context['final']
+  assert final['i'] == n
+  assert final['sum'] == n * (n + 1) / 2
+
+def test_while_loop_memory():
+  # the contexts reachable from the loop's result don't grow with the
+  # number of iterations.
+  def ancestors(c):
+    n = 0
+    while c is not None:
+      c, n = c.parent, n + 1
+    return n
+
+  short = trampoline.evaluate(parse(WHILE % 10), C())['final']
+  long = trampoline.evaluate(parse(WHILE % 1000), C())['final']
+  assert ancestors(short) == ancestors(long)
+
+def test_while_loop_captured_memory():
+  # each iterator is captured with this. none of them keep the ones before
+  # them, or the contexts made along the way, alive.
+  def final_size(n):
+    return bench.reachable_size(
+        trampoline.evaluate(parse(WHILE % n), C())['final'])
+  assert final_size(2000) == final_size(1000)
+
+def test_deep_recursion():
+  # not a tail call: every level waits for the sum of the levels below it.
+  n = 20000
+  tree = parse("""
+    sum ~ (then ~ i+(i=i-1 sum) else=0 cond=i if)
+    (i=%d sum)
+    """ % n)
+  assert trampoline.evaluate(tree, C()).val == n * (n + 1) / 2
+
+def test_factorial():
+  tree = parse("""
+    factorial ~ (then ~ i*(i=i-1 factorial) else=1 cond=i if)
+    (i=20 factorial)
+    """)
+  assert trampoline.evaluate(tree, C()).val == math.factorial(20)
+
+def test_if_without_else():
+  tree = parse('cond=0 then=1 if')
+  assert trampoline.evaluate(tree, C()).val == 0
+
+def test_suspend_and_resume():
+  evaluation = trampoline.Evaluation(parse(WHILE % 100), C())
+  slices = 0
+  while evaluation.run(50) is None:
+    slices += 1
+    assert not evaluation.done
+  assert evaluation.done and slices > 10
+  assert evaluation.result['final']['sum'] == 5050
+  assert evaluation.steps >= 50 * slices
+
+def test_limits():
+  forever = parse(WHILE % 0)
+  with pytest.raises(infixlang.LimitError):
+    trampoline.evaluate(forever, C(), max_steps=10000)
+  # not a tail call, so every level leaves a frame.
+  deep = parse("""
+    sum ~ (then ~ i+(i=i-1 sum) else=0 cond=i if)
+    (i=100000 sum)
+    """)
+  with pytest.raises(infixlang.LimitError):
+    trampoline.evaluate(deep, C(), max_frames=1000)
+  # a loop runs in constant stack space.
+  context = trampoline.evaluate(parse(WHILE % 1000), C(), max_frames=100)
+  assert context['final']['i'] == 1000
+
+def test_else_errors_are_swallowed():
+  # like eval(), if returns the truth context when else fails.
+  for string in ['cond=0 if', 'cond=0 else~nope if',
+                 'f ~ (cond=0 else~nope if) x = (f) 5',
+                 'x = 1 + (cond=0 else~(1 + nope) if) + 2',
+                 'g ~ (cond=0 else~(cond=0 else~nope if) if) (g) 7',
+                 'y = (cond=0 else~(x = 2, (1 + (cond=0 else~nope if)))'
+                 ' if) y']:
+    tree = parse(string)
+    expected = tree.eval(C())
+    result = trampoline.evaluate(tree, C())
+    assert result.val == expected.val
+    assert (sorted((k, repr(v)) for k, v in result.dictify().items()) ==
+            sorted((k, repr(v)) for k, v in expected.dictify().items()))
+  with pytest.raises(infixlang.UnknownVariableError):
+    trampoline.evaluate(parse('cond=1 then~nope if'), C())
+  with pytest.raises(infixlang.UnknownVariableError):
+    trampoline.evaluate(parse('(cond=0 else~1 if) + nope'), C())
+
+def test_else_loops_run_in_constant_stack_space():
+  # the loop recurses through else, so its handlers replace each other.
+  evaluation = trampoline.Evaluation(parse(WHILE % 1000), C(), max_frames=100)
+  while evaluation.run(50) is None:
+    assert len(evaluation.handlers) <= 1
+  assert evaluation.result['final']['i'] == 1000
+  assert not evaluation.handlers
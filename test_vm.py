@@ -0,0 +1,55 @@
+import pytest
+
+import engines
+import infixlang
+import vm
+import testing
+from testing import parse
+
+C = infixlang.Context
+
+# run the evaluator's test suite with the vm in place of eval().
+test_infixlang_suite = testing.engine_suite(vm.evaluate)
+
+def test_compiled_once():
+  tree = parse('f ~ (x + 1) x = 1 f')
+  vm.evaluate(tree, C())
+  code = tree.code
+  body = tree.val[0].val[2]
+  body_code = body.code
+  vm.evaluate(tree, C())
+  assert tree.code is code and body.code is body_code
+
+def test_code():
+  code = vm.compile_tree(parse('a = 1 + 2'))
+  assert [op for op, _ in code.instructions] == [
+      vm.CONST, vm.CONST, vm.BINOP, vm.BIND, vm.RETURN]
+  assert 'BINOP' in repr(code)
+
+def test_else_errors_are_swallowed():
+  # like eval(), if returns the truth context when else fails.
+  for string in ['cond=0 if', 'cond=0 else~nope if',
+                 'f ~ (cond=0 else~nope if) x = (f) 5']:
+    tree = parse(string)
+    expected = tree.eval(C())
+    result = vm.evaluate(tree, C())
+    assert result.val == expected.val
+    assert (sorted((k, repr(v)) for k, v in result.dictify().items()) ==
+            sorted((k, repr(v)) for k, v in expected.dictify().items()))
+
+def test_deep_recursion():
+  n = 5000
+  tree = parse("""
+    sum ~ (then ~ i+(i=i-1 sum) else=0 cond=i if)
+    (i=%d sum)
+    """ % n)
+  assert vm.evaluate(tree, C()).val == n * (n + 1) / 2
+
+def test_unknown_variable():
+  with pytest.raises(infixlang.UnknownVariableError):
+    vm.evaluate(parse('a = b'), C())
+
+def test_engines():
+  tree = parse('f ~ (x * 2) x = 3 y = f (y + 1)')
+  for engine in engines.ENGINES:
+    assert engines.evaluate(tree, C(), engine).val == 7
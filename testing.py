@@ -0,0 +1,38 @@
+"""Helpers for the tests."""
+import pytest
+
+import infixlang
+import test_infixlang
+
+# the classes whose eval() the test programs call.
+EVAL_CLASSES = [cls for cls in vars(infixlang).values()
+                if isinstance(cls, type) and 'eval' in vars(cls)]
+
+SUITE = sorted(name for name in dir(test_infixlang) if name.startswith('test_'))
+
+
+def parse(string):
+  """Parses a whole program."""
+  tree, rest = infixlang.expr_sequence.parse(infixlang.tokenize(string), {})
+  assert not rest
+  return tree
+
+def infixlang_suite(patch, names=SUITE):
+  """Returns a test that runs the named tests of test_infixlang after
+  patch(monkeypatch) has set up what they should run on."""
+  @pytest.mark.parametrize('name', names)
+  def test_infixlang_suite(name, monkeypatch):
+    patch(monkeypatch)
+    getattr(test_infixlang, name)()
+  return test_infixlang_suite
+
+def engine_suite(evaluate):
+  """Returns a test that runs test_infixlang's tests with evaluate(tree,
+  context) in place of eval()."""
+  def engine_eval(self, context):
+    return evaluate(self, context)
+
+  def patch(monkeypatch):
+    for cls in EVAL_CLASSES:
+      monkeypatch.setattr(cls, 'eval', engine_eval)
+  return infixlang_suite(patch)
@@ -0,0 +1,273 @@
+"""Evaluates parse trees with an explicit continuation stack.
+
+eval() recurses on the Python stack for every node it visits, so recursive
+~ definitions and loops like the README's while overflow the stack after a
+few hundred iterations. This evaluator keeps its pending work in a list
+instead, so the depth of a computation is limited only by memory.
+
+Expressions in tail position (the last expression of a sequence, the body of
+a variable bound with ~, and the then and else branches of if) don't push
+anything on the continuation stack. Neither does a parenthesized expression
+whose value goes straight into another one. So a loop written as a tail
+recursive ~ definition runs in constant stack space.
+
+Every call to a ~ body starts from a parentless copy of the calling context
+(see infixlang.captured). A context's parents are only used by stacktrace(),
+and dropping them keeps a loop from holding on to every context it has ever
+made, so loops also run in bounded memory.
+
+Like eval(), an if whose else branch raises UnknownVariableError, or that
+has no else branch, evaluates to its truth context. The if's else handler
+(see Evaluation.handlers) is what lets an else branch in tail position stay
+a tail call.
+"""
+import sys
+
+import infixlang
+from infixlang import (Context, ValueContext, UnknownVariableError,
+                       expr_reference, captured)
+
+
+def evaluate(tree, context, max_steps=None, max_frames=None):
+  return Evaluation(tree, context, max_steps, max_frames).run()
+
+
+# the kinds of nodes, and of frames on the continuation stack.
+(SEQUENCE, ASSIGNMENT, LINK, BINARY_OP, PARENTHESIZED, VALUE, VARIABLE, IF,
+ BUILTIN, OTHER, BINARY_OP_RHS) = range(11)
+
+# frames that only use the value of the result they receive.
+VALUE_ONLY = (ASSIGNMENT, BINARY_OP, BINARY_OP_RHS, PARENTHESIZED)
+
+node_kinds = {
+    infixlang.expr_sequence: SEQUENCE,
+    infixlang.expr_assignment: ASSIGNMENT,
+    infixlang.expr_link: LINK,
+    infixlang.expr_equality: BINARY_OP,
+    infixlang.parenthesized_expr: PARENTHESIZED,
+    infixlang.Value: VALUE,
+    infixlang.variable: VARIABLE,
+    infixlang.op_if: IF,
+    infixlang.builtin: BUILTIN,
+    }
+
+def node_kind(node):
+  cls = type(node)
+  try:
+    return node_kinds[cls]
+  except KeyError:
+    kind = OTHER
+    for base in cls.__mro__:
+      if base in node_kinds:
+        kind = node_kinds[base]
+        break
+    node_kinds[cls] = kind
+    return kind
+
+COND = infixlang.variable('cond')
+THEN = infixlang.variable('then')
+ELSE = infixlang.variable('else')
+
+# the most steps an evaluation with max_frames takes between looks at the
+# size of its stack.
+CHECK_EVERY = 1024
+
+
+class Evaluation(object):
+  """The state of the evaluation of a tree in a context.
+
+  Evaluations count their steps: one per node evaluated and one per context
+  made. One that takes more than max_steps steps, or has more than
+  max_frames frames on its continuation stack, raises a LimitError. The
+  stack is where the memory of a runaway evaluation goes, since a tail
+  recursive loop drops the contexts of the iterations before it (see
+  above), and every call that isn't a tail call leaves a frame. The stack is
+  only looked at every CHECK_EVERY steps, so it can overshoot max_frames by
+  that many frames.
+  """
+
+  def __init__(self, tree, context, max_steps=None, max_frames=None):
+    self.stack = []
+    # the node to evaluate next and the context to evaluate it in. when node
+    # is None, result holds a result to hand to the frame on top of the stack.
+    self.node = tree
+    self.context = context
+    self.result = None
+    # the else branches being evaluated, as (stack depth, truth context)
+    # pairs. a branch is done when a result is handed to the frame below its
+    # depth. an else branch in tail position of another replaces that one's
+    # handler instead of adding its own, since if it fails the other
+    # evaluates to its truth context too. so loops don't pile up handlers.
+    self.handlers = []
+    self.steps = 0
+    self.max_steps = max_steps
+    self.max_frames = max_frames
+    self.done = False
+
+  def run(self, fuel=None):
+    """Evaluates the tree, and returns the resulting context.
+
+    With fuel, it returns None after about that many more steps if the
+    evaluation isn't done, and the next call to run() picks up from there.
+    """
+    # frames on the stack are (kind, node, context, lhs value) tuples.
+    stack, handlers = self.stack, self.handlers
+    node, context, result = self.node, self.context, self.result
+    # the depth of the innermost else branch.
+    floor = handlers[-1][0] if handlers else 0
+    steps = self.steps
+    stop = None if fuel is None else steps + fuel
+    # the step at which to look at the fuel and the limits next, so the loop
+    # only compares one number per node.
+    check = self.next_check(steps, stop)
+
+    while True:
+      try:
+        while True:
+          if node is not None:
+            if steps >= check:
+              self.steps = steps
+              self.check_limits(steps, context)
+              if stop is not None and steps >= stop:
+                self.node, self.context, self.result = node, context, result
+                return None
+              check = self.next_check(steps, stop)
+            steps += 1
+            kind = node_kind(node)
+
+            if kind == VARIABLE:
+              v = context[node.val]
+              steps += 1
+              if isinstance(v, expr_reference):
+                # a tail call.
+                node, context = v.val, captured(context)
+              else:
+                node, result = None, ValueContext(context, v)
+
+            elif kind == VALUE:
+              steps += 1
+              node, result = None, ValueContext(context, node.val)
+
+            elif kind == BINARY_OP:
+              stack.append((BINARY_OP, node, context, None))
+              node = node.val[0]
+
+            elif kind == SEQUENCE:
+              stack.append((SEQUENCE, node, context, None))
+              node = node.val[0]
+
+            elif kind == ASSIGNMENT:
+              stack.append((ASSIGNMENT, node, context, None))
+              node = node.val[2]
+
+            elif kind == PARENTHESIZED:
+              # if the frame on top of the stack only needs a value, it can take
+              # the value of the inner expression directly.
+              if not stack or stack[-1][0] not in VALUE_ONLY:
+                stack.append((PARENTHESIZED, node, context, None))
+              node = node.val[1]
+
+            elif kind == LINK:
+              steps += 1
+              rhs_val = expr_reference(node.val[2])
+              result = Context(parent=context, val=rhs_val,
+                               slots={node.val[0].val: rhs_val})
+              node = None
+
+            elif kind == IF:
+              stack.append((IF, node, context, None))
+              node = COND
+
+            elif kind == BUILTIN:
+              steps += 1
+              node, result = None, ValueContext(context, node.apply(context))
+
+            else:
+              node, result = None, node.eval(context)
+
+          else:
+            if not stack:
+              self.node, self.context, self.result = None, None, result
+              # an else branch at the top is done too.
+              del handlers[:]
+              self.steps = steps
+              self.done = True
+              return result
+
+            kind, frame_node, frame_context, lhs = stack.pop()
+            if len(stack) < floor:
+              # the innermost else branch is done.
+              handlers.pop()
+              floor = handlers[-1][0] if handlers else 0
+
+            if kind == BINARY_OP:
+              stack.append((BINARY_OP_RHS, frame_node, frame_context,
+                            result.val))
+              node, context = frame_node.val[2], frame_context
+
+            elif kind == BINARY_OP_RHS:
+              steps += 1
+              op = frame_node.operators[frame_node.val[1].val]
+              result = ValueContext(frame_context, op(lhs, result.val))
+
+            elif kind == SEQUENCE:
+              c0 = result
+              node = frame_node.val[-1]
+              if isinstance(c0.val, Context):
+                steps += 1
+                context = c0.chain(c0.val)
+              else:
+                context = c0
+
+            elif kind == ASSIGNMENT:
+              steps += 1
+              result = Context(parent=frame_context, val=None,
+                               slots={frame_node.val[0].val:
+                                      captured(result.val)})
+
+            elif kind == PARENTHESIZED:
+              steps += 1
+              result = ValueContext(frame_context, result.val)
+
+            elif kind == IF:
+              truth_context = result
+              if truth_context.val:
+                node, context = THEN, truth_context
+              elif 'else' in truth_context:
+                node, context = ELSE, truth_context
+                depth = len(stack)
+                if handlers and handlers[-1][0] == depth:
+                  handlers[-1] = (depth, truth_context)
+                else:
+                  handlers.append((depth, truth_context))
+                  floor = depth
+              else:
+                result = truth_context
+
+      except UnknownVariableError:
+        if not handlers:
+          raise
+        # an else branch failed. like eval(), the if evaluates to its truth
+        # context.
+        depth, truth_context = handlers.pop()
+        floor = handlers[-1][0] if handlers else 0
+        del stack[depth:]
+        node, result = None, truth_context
+
+  def next_check(self, steps, stop):
+    check = sys.maxint
+    if stop is not None:
+      check = stop
+    if self.max_steps is not None:
+      check = min(check, self.max_steps)
+    if self.max_frames is not None:
+      check = min(check, steps + CHECK_EVERY)
+    return check
+
+  def check_limits(self, steps, context):
+    if self.max_steps is not None and steps >= self.max_steps:
+      raise infixlang.LimitError(
+          context, 'Took more than %d steps' % self.max_steps)
+    if self.max_frames is not None and len(self.stack) > self.max_frames:
+      raise infixlang.LimitError(
+          context, 'Used more than %d stack frames' % self.max_frames)
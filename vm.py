@@ -0,0 +1,336 @@
+"""Compiles parse trees to bytecode, and runs the bytecode.
+
+The compiler flattens a tree into a list of instructions. The machine that
+runs them has four registers:
+
+  ctx       the current context.
+  stack     values, and contexts saved by PUSH_CONTEXT.
+  frames    where to return to when the code of a ~ body ends.
+  handlers  the else branches of the ifs in progress. eval() returns the
+            truth context when evaluating else raises UnknownVariableError,
+            and so does the machine.
+
+Code compiled for its context leaves the result of the expression in ctx.
+Code compiled for its value leaves ctx alone and pushes the value of the
+expression on the stack, so the operands of arithmetic never get wrapped in
+contexts.
+
+The body of a ~ link is compiled the first time it's called, and the code is
+cached on the body's parse tree. Calls and returns don't use the Python
+stack, and a call that ends a body doesn't push a frame.
+"""
+import pmap
+import infixlang
+from infixlang import Context, ValueContext, expr_reference, captured
+from infixlang import UnknownVariableError
+
+
+def evaluate(tree, context):
+  return Machine().run(compile_tree(tree), context)
+
+
+# ----- Opcodes.
+
+(CONST,          # push arg.
+ VALUE,          # ctx = ValueContext(ctx, pop()).
+ CONST_VALUE,    # ctx = ValueContext(ctx, arg).
+ LOAD_VAR,       # push the value of variable arg, calling it if it's a ~ body.
+ VAR,            # ctx = the result of evaluating variable arg.
+ THIS,           # push ctx.
+ BINOP,          # rhs = pop(), lhs = pop(), push arg(lhs, rhs).
+ BIND,           # ctx = a child of ctx where variable arg is captured(pop()).
+ LINK,           # ctx = a child of ctx where variable arg[0] is ~ arg[1].
+ CHAIN,          # if ctx.val is a context, chain it into ctx.
+ PUSH_CONTEXT,   # push ctx.
+ POP_CONTEXT,    # v = ctx.val, ctx = pop(), push v.
+ JUMP,           # continue at arg.
+ JUMP_IF_FALSE,  # continue at arg if ctx.val is false.
+ SETUP_ELSE,     # if evaluating else fails from here on, continue at arg
+                 # with the current ctx.
+ POP_ELSE,       # evaluating else didn't fail.
+ EVAL,           # ctx = arg.eval(ctx), for nodes the compiler doesn't know.
+ RETURN,         # return from the code of a ~ body, or stop.
+ APPLY,          # push arg.apply(ctx), for builtins.
+) = range(19)
+
+OPCODE_NAMES = ('CONST VALUE CONST_VALUE LOAD_VAR VAR THIS BINOP BIND LINK '
+                'CHAIN PUSH_CONTEXT POP_CONTEXT JUMP JUMP_IF_FALSE SETUP_ELSE '
+                'POP_ELSE EVAL RETURN APPLY').split()
+
+
+class Code(object):
+  """A list of (opcode, arg) instructions."""
+
+  def __init__(self, instructions):
+    self.instructions = instructions
+
+  def __repr__(self):
+    return '\n'.join('%3d %-14s %r' % (i, OPCODE_NAMES[op], arg)
+                     for i, (op, arg) in enumerate(self.instructions))
+
+
+# ----- The compiler.
+
+def compile_tree(node):
+  """Returns the code for node, compiling it if it isn't cached."""
+  code = getattr(node, 'code', None)
+  if code is None:
+    out = []
+    Compiler(out).context(node)
+    out.append((RETURN, None))
+    code = node.code = Code(out)
+  return code
+
+
+class Compiler(object):
+  def __init__(self, out):
+    self.out = out
+
+  def emit(self, op, arg=None):
+    self.out.append((op, arg))
+    return len(self.out) - 1
+
+  def patch(self, at, target):
+    self.out[at] = (self.out[at][0], target)
+
+  def lookup(self, compilers, node):
+    for cls in type(node).__mro__:
+      if cls in compilers:
+        return compilers[cls]
+    return compilers[None]
+
+  def context(self, node):
+    """Emits code that leaves node.eval(ctx) in ctx."""
+    self.lookup(self.context_compilers, node)(self, node)
+
+  def value(self, node):
+    """Emits code that pushes node.eval(ctx).val and leaves ctx alone."""
+    self.lookup(self.value_compilers, node)(self, node)
+
+  # ----- Code that produces a context.
+
+  def context_fallback(self, node):
+    self.emit(EVAL, node)
+
+  def context_of_value(self, node):
+    self.value(node)
+    self.emit(VALUE)
+
+  def context_variable(self, node):
+    if node.val == 'this':
+      self.emit(THIS)
+      self.emit(VALUE)
+    else:
+      self.emit(VAR, node.val)
+
+  def context_sequence(self, node):
+    self.context(node.val[0])
+    if not isinstance(node.val[0], self.never_context_valued):
+      self.emit(CHAIN)
+    self.context(node.val[-1])
+
+  # nodes whose val is never a context, so a sequence that starts with one
+  # never needs to chain it.
+  never_context_valued = (infixlang.expr_assignment, infixlang.expr_link,
+                          infixlang.expr_equality, infixlang.integer)
+
+  def context_assignment(self, node):
+    self.value(node.val[2])
+    self.emit(BIND, node.val[0].val)
+
+  def context_link(self, node):
+    self.emit(LINK, (node.val[0].val, node.val[2]))
+
+  def context_if(self, node):
+    self.emit(VAR, 'cond')
+    jump_to_else = self.emit(JUMP_IF_FALSE)
+    self.emit(VAR, 'then')
+    jump_to_end = self.emit(JUMP)
+    self.patch(jump_to_else, len(self.out))
+    setup_else = self.emit(SETUP_ELSE)
+    self.emit(VAR, 'else')
+    self.emit(POP_ELSE)
+    self.patch(jump_to_end, len(self.out))
+    self.patch(setup_else, len(self.out))
+
+  def context_constant(self, node):
+    self.emit(CONST_VALUE, node.val)
+
+  context_compilers = {
+      None: context_fallback,
+      infixlang.expr_sequence: context_sequence,
+      infixlang.expr_assignment: context_assignment,
+      infixlang.expr_link: context_link,
+      infixlang.expr_equality: context_of_value,
+      infixlang.parenthesized_expr: context_of_value,
+      infixlang.Value: context_constant,
+      infixlang.variable: context_variable,
+      infixlang.op_if: context_if,
+      infixlang.builtin: context_of_value,
+      }
+
+  # ----- Code that produces a value.
+
+  def value_fallback(self, node):
+    self.emit(PUSH_CONTEXT)
+    self.context(node)
+    self.emit(POP_CONTEXT)
+
+  def value_binary_op(self, node):
+    self.value(node.val[0])
+    self.value(node.val[2])
+    self.emit(BINOP, node.operators[node.val[1].val])
+
+  def value_parenthesized(self, node):
+    self.value(node.val[1])
+
+  def value_constant(self, node):
+    self.emit(CONST, node.val)
+
+  def value_variable(self, node):
+    if node.val == 'this':
+      self.emit(THIS)
+    else:
+      self.emit(LOAD_VAR, node.val)
+
+  def value_builtin(self, node):
+    self.emit(APPLY, node)
+
+  value_compilers = {
+      None: value_fallback,
+      infixlang.expr_equality: value_binary_op,
+      infixlang.parenthesized_expr: value_parenthesized,
+      infixlang.Value: value_constant,
+      infixlang.variable: value_variable,
+      infixlang.builtin: value_builtin,
+      }
+
+
+# ----- The machine.
+
+class Machine(object):
+  def __init__(self):
+    self.stack = []
+    # each frame is the code and pc to return to, and for calls made for
+    # their value, the context to restore.
+    self.frames = []
+    # each handler is the code and pc to continue at, the context to continue
+    # with, and the depths of frames and stack to unwind to.
+    self.handlers = []
+
+  def run(self, code, ctx):
+    instructions, pc = code.instructions, 0
+    while True:
+      try:
+        return self.loop(instructions, pc, ctx)
+      except UnknownVariableError:
+        if not self.handlers:
+          raise
+        # an else branch failed. continue after it with the truth context.
+        instructions, pc, ctx, num_frames, num_stack = self.handlers.pop()
+        del self.frames[num_frames:]
+        del self.stack[num_stack:]
+
+  def loop(self, instructions, pc, ctx):
+    stack, frames, handlers = self.stack, self.frames, self.handlers
+    push, pop = stack.append, stack.pop
+    find = pmap.find
+
+    # the opcodes are tested roughly in the order of how often they run.
+    while True:
+      op, arg = instructions[pc]
+      pc += 1
+
+      if op == VAR:
+        leaf = find(ctx.bindings.root, hash(arg), arg)
+        if leaf is None:
+          raise UnknownVariableError(ctx, arg)
+        v = leaf.value
+        if isinstance(v, expr_reference):
+          if instructions[pc][0] != RETURN:
+            frames.append((instructions, pc, None))
+          # else it's a tail call, and the callee returns straight to our
+          # caller.
+          instructions, pc = compile_tree(v.val).instructions, 0
+        else:
+          ctx = ValueContext(ctx, v)
+
+      elif op == CHAIN:
+        if isinstance(ctx.val, Context):
+          ctx = ctx.chain(ctx.val)
+
+      elif op == BIND:
+        v = captured(pop())
+        ctx = Context(parent=ctx, val=None, slots={arg: v},
+                      bindings=ctx.bindings.set(arg, v))
+
+      elif op == LOAD_VAR:
+        leaf = find(ctx.bindings.root, hash(arg), arg)
+        if leaf is None:
+          raise UnknownVariableError(ctx, arg)
+        v = leaf.value
+        if isinstance(v, expr_reference):
+          frames.append((instructions, pc, ctx))
+          instructions, pc = compile_tree(v.val).instructions, 0
+        else:
+          push(v)
+
+      elif op == CONST:
+        push(arg)
+
+      elif op == BINOP:
+        rhs = pop()
+        push(arg(pop(), rhs))
+
+      elif op == PUSH_CONTEXT:
+        push(ctx)
+
+      elif op == POP_CONTEXT:
+        v = ctx.val
+        ctx = pop()
+        push(v)
+
+      elif op == RETURN:
+        if not frames:
+          return ctx
+        instructions, pc, saved = frames.pop()
+        if saved is not None:
+          push(ctx.val)
+          ctx = saved
+
+      elif op == VALUE:
+        ctx = ValueContext(ctx, pop())
+
+      elif op == CONST_VALUE:
+        ctx = ValueContext(ctx, arg)
+
+      elif op == LINK:
+        varname, body = arg
+        rhs_val = expr_reference(body)
+        ctx = Context(parent=ctx, val=rhs_val, slots={varname: rhs_val},
+                      bindings=ctx.bindings.set(varname, rhs_val))
+
+      elif op == JUMP_IF_FALSE:
+        if not ctx.val:
+          pc = arg
+
+      elif op == JUMP:
+        pc = arg
+
+      elif op == THIS:
+        push(ctx)
+
+      elif op == SETUP_ELSE:
+        handlers.append((instructions, arg, ctx, len(frames), len(stack)))
+
+      elif op == POP_ELSE:
+        handlers.pop()
+
+      elif op == APPLY:
+        push(arg.apply(ctx))
+
+      elif op == EVAL:
+        ctx = arg.eval(ctx)
+
+      else:
+        raise ValueError('Bad opcode %r' % op)